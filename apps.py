@@ -20,6 +20,7 @@ else:
 
 # ---- Math Libraries ---- #
 import numpy as np
+import precision
 
 # ---- Plotting Libraries ---- #
 import matplotlib as mpl;
@@ -361,20 +362,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 		self.dat_wr.filename = self.dat.filename.replace('.dat', '_wr.dat')
 
-		out_file = open(self.dat_wr.filename, 'w')
-		in_file  = open(self.dat.filename, 'r')
-
-		for (i, line) in enumerate(in_file):
-			if i > 11:
-				for element in self.dat_wr.signal:
-					out_file.write("{0:.6f}".format(float(np.real(element))) + '\n')
-					out_file.write("{0:.6f}".format(float(np.imag(element))) + '\n')
-				break
-			else:
-				out_file.write(line)
-
-		out_file.close()
-		in_file.close()
+		DatWriter(self.dat.header, fmt='%.6f').write(self.dat_wr.filename, self.dat_wr.signal)
 
 	# ---- Macromolecule Removal ---- #
 	def runMMRemoval(self):
@@ -457,37 +445,11 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		# 1. Save metabolite spectrum.
 		self.metabDat_mmr.filename = self.fullDat_mmr.filename.replace(self.fullDat_mmr.filename.split('/')[-1], 'sup.dat')
 
-		out_file = open(self.metabDat_mmr.filename, 'w')
-		in_file  = open(self.fullDat_mmr.filename, 'r')
-
-		for (i, line) in enumerate(in_file):
-			if i > 11:
-				for element in self.metabDat_mmr.signal:
-					out_file.write("{0:.6f}".format(float(np.real(element))) + '\n')
-					out_file.write("{0:.6f}".format(float(np.imag(element))) + '\n')
-				break
-			else:
-				out_file.write(line)
-
-		out_file.close()
-		in_file.close()
+		DatWriter(self.fullDat_mmr.header, fmt='%.6f').write(self.metabDat_mmr.filename, self.metabDat_mmr.signal)
 
 		# 2. Save HSVD fit.
 		self.MMDatHSVD_mmr.filename = self.MMDat_mmr.filename.replace('.dat', '_hsvd.dat')
-		out_file = open(self.MMDatHSVD_mmr.filename, 'w')
-		in_file  = open(self.MMDat_mmr.filename, 'r')
-
-		for (i, line) in enumerate(in_file):
-			if i > 11:
-				for element in self.MMDatHSVD_mmr.signal:
-					out_file.write("{0:.6f}".format(float(np.real(element))) + '\n')
-					out_file.write("{0:.6f}".format(float(np.imag(element))) + '\n')
-				break
-			else:
-				out_file.write(line)
-
-		out_file.close()
-		in_file.close()
+		DatWriter(self.MMDat_mmr.header, fmt='%.6f').write(self.MMDatHSVD_mmr.filename, self.MMDatHSVD_mmr.signal)
 
 	# ---- Methods to Load Files ---- #
 	def chooseDatFile_wr(self):
@@ -512,7 +474,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		try:
 			# load dat file
 			datFile  = str(self.filenameInput_dat.text())
-			self.dat = DatFile(datFile)
+			self.dat = DatFile(datFile, sidecar=True)
 			self.filenameInfoLabel_dat.setText(datFile.split('/')[-1] + " successfully loaded.")
 
 			# plot
@@ -575,7 +537,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		try:
 			# load dat file
 			fullDatFile_mmr     = str(self.filenameInput_fulldat_mmr.text())
-			self.fullDat_mmr = DatFile(fullDatFile_mmr)
+			self.fullDat_mmr = DatFile(fullDatFile_mmr, sidecar=True)
 			self.filenameInfoLabel_fulldat_mmr.setText(fullDatFile_mmr.split('/')[-1] + " successfully loaded.")
 
 			# plot
@@ -640,7 +602,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		try:
 			# load dat file
 			MMDatFile_mmr     = str(self.filenameInput_mmdat_mmr.text())
-			self.MMDat_mmr = DatFile(MMDatFile_mmr)
+			self.MMDat_mmr = DatFile(MMDatFile_mmr, sidecar=True)
 			self.filenameInfoLabel_mmdat_mmr.setText(MMDatFile_mmr.split('/')[-1] + " successfully loaded.")
 
 			# plot
@@ -757,7 +719,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		L = int(np.ceil(rows))
 		
 		# build the Hankel matrix
-		hankel_matrix = np.zeros((L, n-L+1), "complex")
+		hankel_matrix = np.zeros((L, n-L+1), precision.complex_dtype())
 		console.clear()
 		console.append('Fitting:\t' + str(dat.filename))
 		console.append('Creating Hankel matrix:\t[' + str(np.size(hankel_matrix, 0)) + 'x' + str(np.size(hankel_matrix, 1)) + ']')
@@ -808,7 +770,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		# a simpler but more expensive way is to construct a basis set from the
 		# known damping and frequency components and fit to the original data to
 		# get the amplitudes and phase data
-		X = np.zeros((dat.n, comp), "complex")
+		X = np.zeros((dat.n, comp), precision.complex_dtype())
 		# TODO this should use the singlet fitting module to make the basis
 		for i in range(comp):
 			X[:, i] = self.lorentzian(dat.t,
@@ -955,8 +955,8 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 				vox   = nib.load(mouse + '/mrsvoxel.nii.gz')
 				sup_out     = OutputFile(mouse + '/sup.out')
 				unsup_out   = OutputFile(mouse + '/uns.out')
-				sup_dat   = DatFile(mouse + '/sup.dat')
-				unsup_dat = DatFile(mouse + '/metab_uns.dat')
+				sup_dat   = DatFile(mouse + '/sup.dat', sidecar=True)
+				unsup_dat = DatFile(mouse + '/metab_uns.dat', sidecar=True)
 
 				brain_img = brain.get_data()
 				csf_img   = csf.get_data()
@@ -1179,8 +1179,8 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 				vox   = nib.load(mouse + '/' + mouse + '_voxel_overlay.nii.gz')
 				sup_out     = OutputFile(mouse + '/' + mouse + '_sup.out')
 				unsup_out   = OutputFile(mouse + '/' + mouse + '_uns.out')
-				sup_dat   = DatFile(mouse + '/' + mouse + '_sup.dat')
-				unsup_dat = DatFile(mouse + '/' + mouse + '_uns.dat')
+				sup_dat   = DatFile(mouse + '/' + mouse + '_sup.dat', sidecar=True)
+				unsup_dat = DatFile(mouse + '/' + mouse + '_uns.dat', sidecar=True)
 
 				brain_img = brain.get_data()
 				csf_img   = csf.get_data()
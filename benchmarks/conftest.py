@@ -0,0 +1,54 @@
+# pytest-benchmark benchmarks of the PINTS simulation pipeline, run by pintsbench.py or
+#
+#   python -m pytest benchmarks --rootdir . --pints-b0 297.2 --benchmark-storage pints/benchmarks --benchmark-autosave
+#
+# The --pints-* options are the options of pintsbench.py.
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+options = ['sequences', 'b0', 'te', 'metabolites', 'calibration-metabolite', 'calibration-points', 'backend', 'repeat', 'workers']
+
+def pytest_addoption(parser):
+	group = parser.getgroup('pints', 'PINTS benchmarks (see pintsbench.py)')
+	for option in options:
+		group.addoption('--pints-' + option, nargs='+' if option in ('sequences', 'b0', 'metabolites') else None, default=None)
+	group.addoption('--pints-no-reduction', action='store_true', default=False)
+
+def pints_args(config):
+	# the pintsbench.py options given as --pints-* (the pintsbench.py defaults otherwise)
+	import pintsbench
+	argv = []
+	for option in options:
+		value = config.getoption('pints_' + option.replace('-', '_'))
+		if value is not None:
+			argv += ['--' + option] + (value if isinstance(value, list) else [value])
+	if config.getoption('pints_no_reduction'):
+		argv += ['--no-reduction']
+	return pintsbench.parse_args(argv)
+
+def pytest_generate_tests(metafunc):
+	args = pints_args(metafunc.config)
+	if 'sequence' in metafunc.fixturenames:
+		metafunc.parametrize('sequence', args.sequences)
+	if 'b0' in metafunc.fixturenames:
+		import pintsbench
+		metafunc.parametrize('b0', args.b0, ids=[pintsbench.field_names[b0] for b0 in args.b0])
+	if 'metabolite' in metafunc.fixturenames:
+		metafunc.parametrize('metabolite', args.metabolites)
+
+@pytest.fixture(scope='session')
+def args(request):
+	args = pints_args(request.config)
+	if args.backend == 'pygamma':
+		pytest.importorskip('pygamma')
+	return args
+
+@pytest.fixture
+def in_repository(monkeypatch):
+	# the simulation code opens pints/... relative to the working directory
+	monkeypatch.chdir(ROOT)
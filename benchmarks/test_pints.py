@@ -0,0 +1,25 @@
+# Every benchmark runs --pints-repeat rounds; the pulse propagator cache is cleared
+# before every round, so each round builds its pulses from scratch.
+import pytest
+
+import pintsbench
+
+def run(benchmark, function, args):
+	benchmark.extra_info['backend'] = args.backend
+	benchmark.pedantic(function, setup=pintsbench.clear_caches, rounds=args.repeat, iterations=1)
+
+def test_simulate(benchmark, args, in_repository, sequence, b0, metabolite):
+	sim_experiment = pintsbench.benchmark_experiment(sequence, b0, args)
+	insysfile = pintsbench.benchmark_metabolites[metabolite] + '.sys'
+	run(benchmark, lambda: pintsbench.simulate_run(insysfile, sim_experiment), args)
+
+def test_binning(benchmark, args, in_repository, sequence, b0, metabolite):
+	sim_experiment = pintsbench.benchmark_experiment(sequence, b0, args)
+	insysfile = pintsbench.benchmark_metabolites[metabolite] + '.sys'
+	run(benchmark, pintsbench.binning_run(insysfile, sim_experiment), args)
+
+def test_calibration(benchmark, args, in_repository, sequence, b0):
+	if args.calibration_points <= 0:
+		pytest.skip('--pints-calibration-points 0')
+	sim_experiment = pintsbench.benchmark_experiment(sequence, b0, args)
+	run(benchmark, pintsbench.calibration_run(sim_experiment, args.calibration_metabolite, args.calibration_points, args.workers), args)
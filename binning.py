@@ -0,0 +1,118 @@
+import numpy as np
+
+# ---- transition binning ---- #
+# Note: Metabolite Peak Normalization and Blending
+
+# The transition tables calculated by the GAMMA density matrix simulations frequently contain a
+# large number of transitions caused by degenerate splittings and other processes. At the
+# conclusion of each simulation run a routine is called to extract lines from the transition table.
+# These lines are then normalized using a closed form calculation based on the number of spins.
+# To reduce the number of lines required for display, multiple lines are blended by binning them
+# together based on their PPM locations and phases. The following parameters are used to
+# customize these procedures:
+
+# Peak Search Range -- Low/High (PPM): the range in PPM that is searched for lines from the
+# metabolite simulation.
+
+# Peak Blending Tolerance (PPM and Degrees): the width of the bins (+/- in PPM and +/- in
+# PhaseDegrees) that are used to blend the lines in the simulation. Lines that are included in the
+# same bin are summed using complex addition based on Amplitude and Phase.
+
+PI = 3.14159265358979323846
+RAD2DEG = 180.0/PI
+
+def line_parameters(freqs, intensities, qnscale, ppmlo, ppmhi):
+	# Amplitude and phase of every line. Lines outside (ppmlo, ppmhi) keep their own
+	# frequency but reuse the amplitude and phase of the last line inside the range.
+	# Lines before the first one inside the range are dropped.
+	freqs = np.asarray(freqs, dtype=float)
+	intensities = np.asarray(intensities, dtype=complex)
+
+	in_range = (freqs > ppmlo) & (freqs < ppmhi)
+	if not np.any(in_range):
+		return np.zeros(0), np.zeros(0), np.zeros(0)
+
+	# index of the last in-range line at or before every line
+	last = np.where(in_range, np.arange(np.size(freqs)), -1)
+	last = np.maximum.accumulate(last)
+	keep = last >= 0
+
+	amps = np.sqrt(np.real(intensities)**2 + np.imag(intensities)**2) / qnscale
+	phases = -RAD2DEG * np.angle(intensities)
+
+	return freqs[keep], amps[last[keep]], phases[last[keep]]
+
+def bin_lines(freqs, amps, phases, tolppm, tolpha):
+	# Blends lines (in table order) into bins. A line is added to every existing bin
+	# within +/- tolppm and +/- tolpha of its current centre, moving the centre to the
+	# amplitude-weighted mean; a line that matches no bin starts a new one.
+	#
+	# The lines are merged in frequency order (table order if the table is already sorted
+	# by frequency, as the GAMMA and NumPy transition tables are). A bin centre then never
+	# leaves the range of the lines merged into it, so a gap of more than tolppm between
+	# neighbouring lines separates independent windows. All windows are merged at once:
+	# step k adds the k-th line of every window to that window's bins, so the number of
+	# Python steps is the length of the longest window instead of the number of lines.
+	freqs = np.asarray(freqs, dtype=float)
+	amps = np.asarray(amps, dtype=float)
+	phases = np.asarray(phases, dtype=float)
+	nlines = np.size(freqs)
+	if nlines == 0:
+		return np.zeros(0), np.zeros(0), np.zeros(0)
+
+	step = np.diff(freqs)
+	if not (np.all(step >= 0) or np.all(step <= 0)):
+		order = np.argsort(freqs, kind='stable')
+		freqs, amps, phases = freqs[order], amps[order], phases[order]
+		step = np.diff(freqs)
+
+	# windows: split where neighbours are further apart than tolppm (with a margin
+	# for rounding of the bin centres; splitting less often never changes the result)
+	split = np.abs(step) > tolppm + 1E-9*(tolppm + np.maximum(np.abs(freqs[1:]), np.abs(freqs[:-1])))
+	starts = np.concatenate(([0], np.flatnonzero(split) + 1))
+	lengths = np.diff(np.append(starts, nlines))
+	nwin = np.size(starts)
+
+	outf = np.zeros((nwin, np.amax(lengths)))
+	outa = np.zeros_like(outf)
+	outp = np.zeros_like(outf)
+	nbin = np.zeros(nwin, dtype=int)
+
+	for k in range(np.amax(lengths)):
+		win = np.flatnonzero(lengths > k)
+		line = starts[win] + k
+		freq = freqs[line][:, np.newaxis]
+		tmpa = amps[line][:, np.newaxis]
+		tmpp = phases[line][:, np.newaxis]
+
+		f = outf[win, :k]
+		a = outa[win, :k]
+		p = outp[win, :k]
+
+		match = (np.arange(k) < nbin[win][:, np.newaxis]) & (freq >= f-tolppm) & (freq <= f+tolppm) & (tmpp >= p-tolpha) & (tmpp <= p+tolpha)
+
+		ampsum = a + tmpa
+		with np.errstate(invalid='ignore', divide='ignore'):
+			outf[win, :k] = np.where(match, (a*f + tmpa*freq)/ampsum, f)
+			outp[win, :k] = np.where(match, (a*p + tmpa*tmpp)/ampsum, p)
+		outa[win, :k] = np.where(match, ampsum, a)
+
+		new = ~match.any(axis=1)
+		outf[win[new], nbin[win[new]]] = freq[new, 0]
+		outa[win[new], nbin[win[new]]] = tmpa[new, 0]
+		outp[win[new], nbin[win[new]]] = tmpp[new, 0]
+		nbin[win[new]] += 1
+
+	used = np.arange(np.shape(outf)[1]) < nbin[:, np.newaxis]
+	return outf[used], outa[used], outp[used]
+
+def bin_transitions(freqs, intensities, qnscale, tolppm, tolpha, ppmlo, ppmhi, rf_off):
+	# freqs: line frequencies in ppm (relative to rf_off), intensities: complex line intensities
+	# Returns the bin frequencies (ppm), amplitudes and phases (degrees) as lists.
+	freqs, amps, phases = line_parameters(freqs, intensities, qnscale, ppmlo, ppmhi)
+	outf, outa, outp = bin_lines(freqs, amps, phases, tolppm, tolpha)
+
+	outf = outf + rf_off
+	outp = outp - 90.0
+
+	return outf.tolist(), outa.tolist(), outp.tolist()
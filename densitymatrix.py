@@ -0,0 +1,385 @@
+import re
+import itertools
+import numpy as np
+from scipy.special import comb
+
+from timing import stage
+
+# ---- Isotopes ---- #
+# spin quantum number and gyromagnetic ratio relative to 1H
+isotopes = {
+	'1H':   (0.5,  1.0),
+	'2H':   (1.0,  0.15350609),
+	'13C':  (0.5,  0.25145020),
+	'14N':  (1.0,  0.07226317),
+	'15N':  (0.5, -0.10136767),
+	'19F':  (0.5,  0.94094011),
+	'23Na': (1.5,  0.26451900),
+	'31P':  (0.5,  0.40480742)}
+
+def isotope_qn(symbol):
+	return isotopes[symbol][0]
+
+# ---- Spin System ---- #
+class SpinSystem(object):
+	# A GAMMA .sys file with the accessors of pygamma's spin_system, so the rest of
+	# the simulation code can use either one.
+
+	def __init__(self):
+		self.name = ''
+		self.isotopes = []
+		self.qns = []
+		self.shifts = []
+		self.couplings = {}
+		self.omega = 0.0
+
+	def read(self, filename):
+		params = {}
+		with open(filename, 'r') as f:
+			for line in f:
+				if ':' not in line:
+					continue
+				name, value = line.split(':', 1)
+				params[name.split()[0]] = value.strip()
+
+		self.name = params.get('SysName', '')
+		nspins = int(params['NSpins'])
+		self.isotopes = [params.get('Iso(' + str(i) + ')', '1H') for i in range(nspins)]
+		self.qns = [isotope_qn(iso) for iso in self.isotopes]
+		self.shifts = [float(params.get('PPM(' + str(i) + ')', 0.0)) for i in range(nspins)]
+		self.omega = float(params['Omega'])
+
+		self.couplings = {}
+		for (name, value) in params.items():
+			match = re.match(r'J\((\d+),(\d+)\)', name)
+			if match:
+				i, j = sorted((int(match.group(1)), int(match.group(2))))
+				self.couplings[(i, j)] = float(value)
+
+	def spins(self):
+		return len(self.isotopes)
+
+	def symbol(self, i):
+		return self.isotopes[i]
+
+	def qn(self, i):
+		return self.qns[i]
+
+	def PPM(self, i, ppm=None):
+		if ppm is None:
+			return self.shifts[i]
+		self.shifts[i] = ppm
+
+	def J(self, i, j):
+		return self.couplings.get((min(i, j), max(i, j)), 0.0)
+
+	def Omega(self):
+		return self.omega
+
+	def dims(self):
+		return [int(2*self.qn(i) + 1) for i in range(self.spins())]
+
+# ---- Spin System Reduction ---- #
+class ReducedSpinSystem(object):
+	# A spin system split into parts that evolve independently. The accessors describe the
+	# original spin system; parts is a list of (SpinSystem, weight), and the signal of the
+	# whole spin system is the weighted sum of the signals of its parts.
+
+	def __init__(self, spin_system, parts):
+		self.spin_system = spin_system
+		self.parts = parts
+		self.name = spin_system.name
+
+	def spins(self):
+		return self.spin_system.spins()
+
+	def symbol(self, i):
+		return self.spin_system.symbol(i)
+
+	def qn(self, i):
+		return self.spin_system.qn(i)
+
+	def PPM(self, i):
+		return self.spin_system.PPM(i)
+
+	def J(self, i, j):
+		return self.spin_system.J(i, j)
+
+	def Omega(self):
+		return self.spin_system.Omega()
+
+	def dims(self):
+		return self.spin_system.dims()
+
+def reduce_spin_system(spin_system, tol=1e-6):
+	# Splits the spin system into the connected components of its J-coupling network and,
+	# within each component, replaces every group of magnetically equivalent spin-1/2 nuclei
+	# by its total spin F. Every combination of total spins is one part, weighted by the
+	# number of times it occurs and by the dimension of the spins outside its component.
+	# Both reductions are exact. Weakly coupled sub-blocks of a component are not split:
+	# the pulses act on all protons, so the blocks stay linked through J IzIz, and treating
+	# them separately would only be an approximation.
+	nspins = spin_system.spins()
+	dims = spin_system.dims()
+
+	parts = []
+	for component in coupled_components(spin_system):
+		outside = int(np.prod([dims[i] for i in range(nspins) if i not in component]))
+		groups = equivalent_groups(spin_system, component, tol)
+
+		for totals in itertools.product(*[total_spins(len(g)) if len(g) > 1 else [(spin_system.qn(g[0]), 1)] for g in groups]):
+			part = SpinSystem()
+			part.name = spin_system.name
+			part.omega = spin_system.Omega()
+			part.isotopes = [spin_system.symbol(g[0]) for g in groups]
+			part.qns = [F for (F, mult) in totals]
+			part.shifts = [spin_system.PPM(g[0]) for g in groups]
+			for (a, b) in itertools.combinations(range(len(groups)), 2):
+				J = spin_system.J(groups[a][0], groups[b][0])
+				if J != 0:
+					part.couplings[(a, b)] = J
+			parts.append((part, outside * int(np.prod([mult for (F, mult) in totals]))))
+
+	return ReducedSpinSystem(spin_system, parts)
+
+def coupled_components(spin_system):
+	# connected components of the J-coupling network, as lists of spin indices
+	nspins = spin_system.spins()
+	label = list(range(nspins))
+	for i in range(nspins):
+		for j in range(i+1, nspins):
+			if spin_system.J(i, j) != 0 and label[i] != label[j]:
+				old = label[j]
+				label = [label[i] if l == old else l for l in label]
+	return [[i for i in range(nspins) if label[i] == l] for l in sorted(set(label))]
+
+def equivalent_groups(spin_system, spins, tol):
+	groups = []
+	for i in spins:
+		for group in groups:
+			if magnetically_equivalent(spin_system, group[0], i, spins, tol):
+				group.append(i)
+				break
+		else:
+			groups.append([i])
+	return groups
+
+def magnetically_equivalent(spin_system, i, j, spins, tol):
+	# spin-1/2 nuclei of the same isotope with the same shift and the same coupling to every other spin
+	if spin_system.symbol(i) != spin_system.symbol(j) or spin_system.qn(i) != 0.5 or spin_system.qn(j) != 0.5:
+		return False
+	if abs(spin_system.PPM(i) - spin_system.PPM(j)) > tol:
+		return False
+	return all(abs(spin_system.J(i, k) - spin_system.J(j, k)) <= tol for k in spins if k != i and k != j)
+
+def total_spins(n):
+	# (F, multiplicity) of the total spin of n spin-1/2 nuclei
+	return [(n/2.0 - k, int(comb(n, k, exact=True) - (comb(n, k-1, exact=True) if k > 0 else 0))) for k in range(int(n//2) + 1)]
+
+# ---- Operators ---- #
+def single_spin_operators(qn):
+	# Iz and I+ in the basis m = qn, qn-1, ..., -qn
+	m = np.arange(qn, -qn-1, -1)
+	Iz = np.diag(m).astype(complex)
+	Ip = np.zeros((np.size(m), np.size(m)), dtype=complex)
+	for k in range(1, np.size(m)):
+		Ip[k-1, k] = np.sqrt(qn*(qn+1) - m[k]*(m[k]+1))
+	return Iz, Ip
+
+def embed(op, i, dims):
+	# op acting on spin i of the whole spin system
+	out = np.ones((1, 1), dtype=complex)
+	for (k, dim) in enumerate(dims):
+		out = np.kron(out, op if k == i else np.eye(dim))
+	return out
+
+def spin_operators(spin_system):
+	# Returns the lists Iz, Ip (I+) over all spins of the spin system
+	dims = spin_system.dims()
+	Iz, Ip = [], []
+	for i in range(spin_system.spins()):
+		iz, ip = single_spin_operators(spin_system.qn(i))
+		Iz.append(embed(iz, i, dims))
+		Ip.append(embed(ip, i, dims))
+	return Iz, Ip
+
+def total_operators(spin_system, obs_iso):
+	# Fx, Fy, F- of the observed isotope
+	Iz, Ip = spin_operators(spin_system)
+	d = int(np.prod(spin_system.dims()))
+	Fp = np.zeros((d, d), dtype=complex)
+	for i in range(spin_system.spins()):
+		if spin_system.symbol(i) == obs_iso:
+			Fp += Ip[i]
+	Fm = np.conj(Fp.T)
+	return (Fp + Fm)/2.0, (Fp - Fm)/2.0j, Fm
+
+def hamiltonian(spin_system):
+	# Hcs + HJ in Hz. Homonuclear couplings are strong (J I.I), heteronuclear ones weak (J IzIz).
+	if isinstance(spin_system, ReducedSpinSystem):
+		return [hamiltonian(part) for (part, weight) in spin_system.parts]
+
+	Iz, Ip = spin_operators(spin_system)
+	d = int(np.prod(spin_system.dims()))
+	H = np.zeros((d, d), dtype=complex)
+
+	for i in range(spin_system.spins()):
+		H += spin_system.PPM(i) * spin_system.Omega() * isotopes[spin_system.symbol(i)][1] * Iz[i]
+
+	for i in range(spin_system.spins()):
+		for j in range(i+1, spin_system.spins()):
+			J = spin_system.J(i, j)
+			if J == 0:
+				continue
+			H += J * np.dot(Iz[i], Iz[j])
+			if spin_system.symbol(i) == spin_system.symbol(j):
+				H += J/2.0 * (np.dot(Ip[i], np.conj(Ip[j].T)) + np.dot(np.conj(Ip[i].T), Ip[j]))
+
+	return H
+
+def sigma_eq(spin_system):
+	# high temperature equilibrium
+	Iz, Ip = spin_operators(spin_system)
+	return sum(isotopes[spin_system.symbol(i)][1] * Iz[i] for i in range(spin_system.spins()))
+
+def rotate(sigma, F, angle):
+	# ideal pulse: exp(-i angle F) sigma exp(i angle F)
+	E, V = np.linalg.eigh(F)
+	R = np.dot(V * np.exp(-1j*angle*E), np.conj(V.T))
+	return np.dot(R, np.dot(sigma, np.conj(R.T)))
+
+# ---- Shaped Pulses ---- #
+def pulse_propagator(spin_system, obs_iso, ampl_arr, phas_arr, step, max_block_bytes=64*1024**2):
+	# Propagator of a piecewise constant shaped pulse: ampl_arr [Hz], phas_arr [deg], step [sec].
+	return pulse_propagators(spin_system, obs_iso, [ampl_arr], [phas_arr], step, max_block_bytes)[0]
+
+def pulse_propagators(spin_system, obs_iso, ampl_arrs, phas_arrs, step, max_block_bytes=64*1024**2):
+	# Propagators of several versions of a shaped pulse (e.g. the same shape at different
+	# amplitudes), ampl_arrs and phas_arrs: (n_pulses, n_steps). Returns (n_pulses, dim, dim).
+	# The step propagators of all pulses are computed for blocks of steps at once (one batched
+	# eigh per block) and multiplied together as a binary tree.
+	if isinstance(spin_system, ReducedSpinSystem):
+		# one list of part propagators per pulse
+		Us = [pulse_propagators(part, obs_iso, ampl_arrs, phas_arrs, step, max_block_bytes) for (part, weight) in spin_system.parts]
+		return [[U[i] for U in Us] for i in range(np.size(ampl_arrs, 0))]
+
+	H0 = hamiltonian(spin_system)
+	Fx, Fy, Fm = total_operators(spin_system, obs_iso)
+	d = H0.shape[0]
+
+	ampl_arrs = np.atleast_2d(np.asarray(ampl_arrs, dtype=float))
+	phas_arrs = np.deg2rad(np.atleast_2d(np.asarray(phas_arrs, dtype=float)))
+	n_pulses, n_steps = ampl_arrs.shape
+	block = max(1, int(max_block_bytes // (4 * 16 * d * d * n_pulses)))
+
+	U = np.tile(np.eye(d, dtype=complex), (n_pulses, 1, 1))
+	for start in range(0, n_steps, block):
+		a = ampl_arrs[:, start:start+block, np.newaxis, np.newaxis]
+		p = phas_arrs[:, start:start+block, np.newaxis, np.newaxis]
+		H = H0 + a*(np.cos(p)*Fx - np.sin(p)*Fy)	# same sense of the RF phase as pygamma's PulWaveform
+
+		E, V = np.linalg.eigh(H)
+		Uk = np.matmul(V * np.exp(-2j*np.pi*E*step)[..., np.newaxis, :], np.conj(np.swapaxes(V, -1, -2)))
+
+		U = np.matmul(ordered_product(Uk), U)
+
+	return U
+
+def ordered_product(Uk):
+	# Uk[..., -1, :, :] ... Uk[..., 1, :, :] Uk[..., 0, :, :]
+	while np.size(Uk, -3) > 1:
+		n = np.size(Uk, -3)
+		even = n - n % 2
+		product = np.matmul(Uk[..., 1:even:2, :, :], Uk[..., 0:even:2, :, :])
+		if n % 2:
+			product = np.concatenate((product, Uk[..., even:, :, :]), axis=-3)
+		Uk = product
+	return Uk[..., 0, :, :]
+
+# ---- Acquisition ---- #
+class TransitionTable(object):
+	# Transitions of the detected signal, sum_k I[k] exp(i Fr[k] t), ordered by frequency.
+	# Fr is in rad/sec, as in pygamma's TTable1D.
+
+	def __init__(self, Fr, I):
+		order = np.argsort(-Fr, kind='stable')
+		self.Fr = Fr[order]
+		self.I = I[order]
+
+	def size(self):
+		return np.size(self.Fr)
+
+	def fid(self, t):
+		# the detected signal at times t [sec]; unlike the table itself, it does not depend
+		# on how degenerate transitions are split up
+		return np.dot(np.exp(1j*np.outer(t, self.Fr)), self.I)
+
+def transitions(H_eig, sigma, D, cutoff=1e-10):
+	# H_eig: (E, V) of the Hamiltonian; sigma and D in the original basis
+	E, V = H_eig
+	Vh = np.conj(V.T)
+	s = np.dot(Vh, np.dot(sigma, V))
+	d = np.dot(Vh, np.dot(D, V))
+
+	I = -d.T * s							# I_jk = -D_kj sigma_jk (sign as in pygamma's acquire1D)
+	Fr = 2*np.pi*(E[np.newaxis, :] - E[:, np.newaxis])	# evolves as exp(-2 pi i (E_j - E_k) t)
+
+	keep = np.abs(I) > cutoff*max(np.amax(np.abs(I)), 1e-300)
+	return TransitionTable(Fr[keep], I[keep])
+
+def acquire(spin_system, obs_iso, Ureal90, Ureal180s, delays_list, H=None):
+	# Excitation (Ureal90 = None: ideal 90-degree pulse), then for every set of delays:
+	# delay, refocusing pulse, delay, ..., delay, acquire (Ureal180s: one propagator per
+	# refocusing pulse). Free evolution is done in the eigenbasis of H, so each set of
+	# delays only costs the refocusing pulse products.
+	if isinstance(spin_system, ReducedSpinSystem):
+		tables = [acquire(part, obs_iso, None if Ureal90 is None else Ureal90[k], [U[k] for U in Ureal180s], delays_list, None if H is None else H[k]) for (k, (part, weight)) in enumerate(spin_system.parts)]
+		weights = [weight for (part, weight) in spin_system.parts]
+		return [merge_tables([part_tables[i] for part_tables in tables], weights) for i in range(len(delays_list))]
+
+	with stage('delay propagators'):
+		if H is None:
+			H = hamiltonian(spin_system)
+		Fx, Fy, Fm = total_operators(spin_system, obs_iso)
+
+		E, V = np.linalg.eigh(H)
+		Vh = np.conj(V.T)
+		dE = E[:, np.newaxis] - E[np.newaxis, :]
+
+	with stage('evolution'):
+		sigma0 = sigma_eq(spin_system)
+		if Ureal90 is None:
+			sigma1 = rotate(sigma0, Fx, np.pi/2.0)
+		else:
+			sigma1 = np.dot(Ureal90, np.dot(sigma0, np.conj(Ureal90.T)))
+
+		sigma1 = np.dot(Vh, np.dot(sigma1, V))
+		Us = {}
+		for U in Ureal180s:
+			if id(U) not in Us:
+				Us[id(U)] = np.dot(Vh, np.dot(U, V))
+
+	tables = []
+	for delays in delays_list:
+		with stage('evolution'):
+			sigma = sigma1
+			for (i, delay) in enumerate(delays):
+				sigma = sigma * np.exp(-2j*np.pi*dE*delay)
+				if i < len(delays) - 1:
+					U = Us[id(Ureal180s[i])]
+					sigma = np.dot(U, np.dot(sigma, np.conj(U.T)))
+		with stage('acquisition'):
+			tables.append(transitions((E, V), np.dot(V, np.dot(sigma, Vh)), Fm))
+
+	return tables
+
+def merge_tables(tables, weights):
+	return TransitionTable(np.concatenate([table.Fr for table in tables]), np.concatenate([weight*table.I for (table, weight) in zip(tables, weights)]))
+
+def combine_tables(tables, weights, decimals=6):
+	# Weighted sum of transition tables; transitions at the same frequency (Fr rounded to
+	# decimals, in rad/sec) are added up.
+	Fr = np.concatenate([table.Fr for table in tables])
+	I = np.concatenate([weight*table.I for (table, weight) in zip(tables, weights)])
+	Fr, index = np.unique(np.round(Fr, decimals), return_inverse=True)
+	return TransitionTable(Fr, np.bincount(index, np.real(I), np.size(Fr)) + 1j*np.bincount(index, np.imag(I), np.size(Fr)))
@@ -0,0 +1,97 @@
+# ---- System Libraries ---- #
+import os
+import json
+import base64
+import atexit
+import threading
+from collections import OrderedDict
+
+# ---- Math Libraries ---- #
+import numpy as np
+import pyfftw
+import pyfftw.builders
+
+# ---- FFT Plans ---- #
+class FFTService(object):
+	# FFTs along one axis through cached pyfftw.builders plans. Every (shape, dtype, axis)
+	# gets one plan with its own aligned input and output buffers, so repeated transforms
+	# of the same size neither plan nor allocate (apart from the returned copy). 2D arrays
+	# are transformed as a batch of FFTs along the time axis. FFTW wisdom is loaded from
+	# wisdom_file before the first plan and saved at exit, so later sessions plan quickly.
+
+	def __init__(self, wisdom_file='', max_plans=32, threads=1, planner_effort='FFTW_MEASURE'):
+		self.wisdom_file = wisdom_file
+		self.max_plans = max_plans
+		self.threads = threads
+		self.planner_effort = planner_effort
+		self.plans = OrderedDict()
+		self.lock = threading.Lock()	# plans share their buffers, so one transform at a time
+		self.wisdom_loaded = False
+		self.new_plans = 0
+
+	def plan(self, shape, dtype, axis):
+		key = (tuple(shape), np.dtype(dtype).str, axis)
+		if key in self.plans:
+			self.plans.move_to_end(key)
+			return self.plans[key]
+
+		self.load_wisdom()
+		buffer = pyfftw.empty_aligned(shape, dtype=dtype)
+		self.plans[key] = pyfftw.builders.fft(buffer, axis=axis, overwrite_input=True, avoid_copy=True, threads=self.threads, planner_effort=self.planner_effort)
+		self.new_plans += 1
+
+		while len(self.plans) > self.max_plans:
+			self.plans.popitem(last=False)
+		return self.plans[key]
+
+	def fft(self, x, axis=-1):
+		x = np.asarray(x)
+		if x.ndim == 0 or x.size == 0:
+			return np.fft.fft(x, axis=axis)
+
+		# single precision input stays in single precision
+		dtype = np.complex64 if x.dtype in (np.float32, np.complex64) else np.complex128
+		with self.lock:
+			plan = self.plan(x.shape, dtype, axis % x.ndim)
+			plan.input_array[...] = x
+			return plan().copy()
+
+	def spectrum(self, x, axis=-1):
+		# fftshift(fft(x)) as used for all plotted spectra
+		return np.fft.fftshift(self.fft(x, axis), axes=axis)
+
+	# ---- Wisdom ---- #
+	def load_wisdom(self):
+		if self.wisdom_loaded or not self.wisdom_file:
+			return
+		self.wisdom_loaded = True
+		try:
+			with open(self.wisdom_file, 'r') as f:
+				pyfftw.import_wisdom(tuple(base64.b64decode(wisdom) for wisdom in json.load(f)))
+		except Exception:
+			pass
+
+	def save_wisdom(self):
+		if not self.wisdom_file or self.new_plans == 0:
+			return
+		try:
+			if not os.path.exists(os.path.dirname(self.wisdom_file)):
+				os.makedirs(os.path.dirname(self.wisdom_file))
+
+			# write to a temporary file first so a concurrent reader never sees a partial file
+			tmp_filename = self.wisdom_file + '.' + str(os.getpid()) + '.tmp'
+			with open(tmp_filename, 'w') as f:
+				json.dump([base64.b64encode(wisdom).decode('ascii') for wisdom in pyfftw.export_wisdom()], f)
+			os.replace(tmp_filename, self.wisdom_file)
+		except Exception:
+			pass
+
+# one service per process, wisdom shared by all MAGIQ tools
+fft_service = FFTService(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pints', 'cache', 'fftw_wisdom.json'))
+atexit.register(fft_service.save_wisdom)
+
+def fft(x, axis=-1):
+	return fft_service.fft(x, axis)
+
+def spectrum(x, axis=-1):
+	return fft_service.spectrum(x, axis)
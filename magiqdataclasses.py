@@ -10,14 +10,13 @@ import datetime as dt
 import time
 import glob
 import platform
-import struct
 import re
 
 import subprocess as subproc
 
 import multiprocessing as mp
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from itertools import groupby
 
@@ -25,7 +24,8 @@ from itertools import groupby
 import scipy as sp
 import numpy as np
 import math
-from pyfftw.interfaces import scipy_fftpack as fftw
+import fftplans
+import precision
 
 # ---- Data Classes ---- #
 class Experiment(object):
@@ -124,8 +124,29 @@ class Experiment(object):
 		self.ppmlo = 0.0
 		self.ppmhi = 10.0
 
+		# on-disk shaped-pulse propagator cache ('' keeps the cache in memory only)
+		self.propagator_cache_dir = ''
+
+		# density-matrix simulation backend: 'pygamma', or 'numpy' (densitymatrix.py) for the tests and
+		# pintsbench.py only; it does not reproduce pygamma for every shipped spin system yet
+		# (see tests/test_densitymatrix.py), so PINTS and pintsbatch.py always use pygamma
+		self.backend = 'pygamma'
+		# NumPy backend: simulate uncoupled parts and magnetically equivalent groups in reduced spaces
+		self.reduce_spin_systems = True
+
+		# spatially resolved simulation: grid positions [mm] along each direction selected by the
+		# sequence's pulses (sLASER: excitation, AFP pair 1, AFP pair 2; LASER: AFP pairs 1-3) and
+		# the slice-selection gradients [mT/m]; no positions simulates a single isochromat
+		self.spatial_positions = []
+		self.slice_gradients = []
+
+		# on-disk cache of simulated metabolites ('' disables it)
+		self.basis_cache_dir = 'pints/cache/basis'
+
 		# Experimental Data
 		self.data = self.tree()
+		self.basis = None	# BasisSet of the metabolites in data (set once they are loaded)
+		self.model = None	# BasisModel of basis
 
 		# Relationships for .CST and .GES Files
 		self.shift_linked_metabs = []
@@ -262,21 +283,102 @@ class RefSignal(object):
 		self.t = t
 		self.b0 = b0
 
+def peak_field(field):
+	# A peak parameter of a Metabolite/Macromolecule: a list until the object is added
+	# to a BasisSet, then a view onto the basis set's array for that parameter.
+	def get(self):
+		if self.basis is None:
+			return self.__lists__[field]
+		return self.basis.view(self.index, field)
+
+	def set(self, values):
+		if self.basis is None:
+			self.__lists__[field] = values
+		else:
+			self.basis.assign(self.index, field, values)
+
+	return property(get, set)
+
+class FIDCache(object):
+	# Bounded LRU of the FIDs of one Metabolite/Macromolecule, shared by getFID, getSpec and
+	# the energy functions (the spectrum and energies of an entry are computed on first use).
+	# Entries are keyed by (TE, b0, time axis, sfactor, afactor, pfactor, dfactor, lb), the
+	# precision policy and the peak parameters: the BasisSet version once the object is in a
+	# basis set, the lists themselves before. The time axis is identified by the array
+	# object, so a time axis changed in place is not noticed; neither are values written
+	# into a basis set's arrays directly (call clear() then, as for BasisModel.invalidate()).
+	# Copies and pickles start with an empty cache.
+
+	total_hits = 0	# of all caches, for profiling
+	total_misses = 0
+
+	def __init__(self, max_entries=8):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __getstate__(self):
+		return {'max_entries': self.max_entries}
+
+	def __setstate__(self, state):
+		self.__init__(state['max_entries'])
+
+	def clear(self):
+		self.entries.clear()
+
+	def entry(self, metab, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
+		key = (TE, b0, id(t), sfactor, afactor, pfactor, dfactor, lb, precision.policy, metab.__state__())
+		entry = self.entries.get(key)
+		if entry is not None and entry['t'] is t:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			FIDCache.total_hits += 1
+			return entry
+		self.misses += 1
+		FIDCache.total_misses += 1
+
+		# the entry keeps a reference to t, so its id cannot be reused while it is cached
+		entry = {'t': t, 'fid': metab.__getFID__(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)}
+		self.entries[key] = entry
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+		return entry
+
+	def spectrum(self, entry):
+		if 'spec' not in entry:
+			entry['spec'] = fftplans.spectrum(entry['fid'])
+		return entry['spec']
+
+	def energy(self, entry, name):
+		# 'energy_FID' or 'energy_spec'
+		if name not in entry:
+			signal = entry['fid'] if name == 'energy_FID' else self.spectrum(entry)
+			entry[name] = np.sum(np.power(np.absolute(signal), 2))
+		return entry[name]
+
 class Metabolite(object):
+	__slots__ = ('name', 'peak', 'crlb', 'A_m', 'T2', 'T1_GM', 'T1_WM', 'T2_GM', 'T2_WM', 'protons', 'var', 'basis', 'index', '__lists__', 'fid_cache')
+
+	ppm     = peak_field('ppm')		# i.e. shift
+	width_L = peak_field('width_L')
+	area    = peak_field('area')	# i.e. amplitude
+	phase   = peak_field('phase')
+	delay   = peak_field('delay')
+	width_G = peak_field('width_G')
+
 	def __init__(self):
 
 		# General Metabolite Information
 		self.name = ''
 
-		# Metabolite Data
+		# Metabolite Data (see BasisSet)
+		self.basis = None
+		self.index = None
+		self.__lists__ = dict((field, []) for field in BasisSet.fields)
+		self.fid_cache = FIDCache()
+
 		self.peak = []
-		self.ppm = []		# i.e. shift
-		self.width_L = []
-		self.area = []		# i.e. amplitude
-		self.phase = []
-		self.delay = []
-		self.width_G = []
-		
 		self.crlb = []
 		
 		# Metabolite Properties
@@ -299,7 +401,18 @@ class Metabolite(object):
 	def num_peaks(self):
 		return sp.size(self.area)
 
+	def __state__(self):
+		# everything the FID depends on apart from the getFID arguments (see FIDCache)
+		if self.basis is None:
+			peaks = tuple(tuple(np.ravel(self.__lists__[field]).tolist()) for field in BasisSet.fields)
+		else:
+			peaks = (id(self.basis), self.basis.version, self.index)
+		return (peaks, self.A_m, self.T2)
+
 	def getFID(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
+		return self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)['fid'].copy()
+
+	def __getFID__(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
 
 		# b0 should be float [MHz]
 		# t should be a numpy array
@@ -311,7 +424,7 @@ class Metabolite(object):
 		ppmtoHz = b0    # conversion between ppm and Hz is the main field
 
 		# generate exponentially decaying sinusoids for each peak
-		sinusoids = sp.empty([self.num_peaks(), sp.size(t)], dtype=complex)
+		sinusoids = sp.empty([self.num_peaks(), sp.size(t)], dtype=precision.complex_dtype())
 		for i in range (0, self.num_peaks()):
 
 			# ---- MODEL BASED ON FITMAN ---- #
@@ -348,19 +461,20 @@ class Metabolite(object):
 		# # add line broadening
 		# FID = sp.exp(-sp.pi*lb*t) * FID
 
-		return FID
+		return precision.signal(FID)
 
 	def getSpec(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb, fs):
-		n = sp.size(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb))
+		entry = self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)
+		n = sp.size(entry['fid'])
 		f = sp.arange(+n//2,-n//2,-1)*(fs/n)*(1/b0)
 
-		return (-f, fftw.fftshift(fftw.fft(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb))))
+		return (-f, self.fid_cache.spectrum(entry).copy())
 
 	def energy_FID(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
-		return np.sum(np.power(np.absolute(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)), 2))
+		return self.fid_cache.energy(self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb), 'energy_FID')
 
 	def energy_spec(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
-		return np.sum(np.power(np.absolute(fftw.fftshift(fftw.fft(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)))), 2))
+		return self.fid_cache.energy(self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb), 'energy_spec')
 
 	def sumAmp(self):
 		return np.sum(self.area)
@@ -369,6 +483,12 @@ class Metabolite(object):
 		return np.sumAmp()/ref_value
 
 class Macromolecule(object):
+	__slots__ = ('name', 'line_type', 'lw', 'A_m', 'T2', 'basis', 'index', '__lists__', 'fid_cache')
+
+	ppm   = peak_field('ppm')
+	area  = peak_field('area')
+	phase = peak_field('phase')	# radians (degrees for Metabolite)
+
 	def __init__(self, name, shift, line_type, lw, area, phase):
 
 		self.name = name
@@ -377,14 +497,25 @@ class Macromolecule(object):
 		self.A_m = 1.0
 		self.T2 = 0.0
 
-		self.ppm = [shift]
-		self.area = [area]
-		self.phase = [phase]
+		self.basis = None
+		self.index = None
+		self.__lists__ = {'ppm': [shift], 'area': [area], 'phase': [phase]}
+		self.fid_cache = FIDCache()
 
 	def name_short(self):
 		return self.name
 
+	def __state__(self):
+		if self.basis is None:
+			peaks = tuple(tuple(np.ravel(values).tolist()) for values in self.__lists__.values())
+		else:
+			peaks = (id(self.basis), self.basis.version, self.index)
+		return (peaks, self.A_m, self.T2, self.lw, self.line_type)
+
 	def getFID(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
+		return self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)['fid'].copy()
+
+	def __getFID__(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
 		# b0, lb should be floats (MHz, Hz)
 		# t should be a numpy array
 
@@ -405,19 +536,212 @@ class Macromolecule(object):
 		elif self.line_type == 'G':
 			FID = A_m * A_k * sp.exp(1j*(w_k*t) + 1j*(phi_k)) * sp.exp(-np.power(sp.pi,2)/(4*np.log(2)) * np.power(lw,2) * np.power(t,2))
 
-		return FID * sp.exp(-sp.pi*lb*t)
+		return precision.signal(FID * sp.exp(-sp.pi*lb*t))
 
 	def getSpec(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb, fs):
-		n = sp.size(self.getFID(TE, b0, t, sfactor, afactor, pfactor, lb))
+		entry = self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)
+		n = sp.size(entry['fid'])
 		f = sp.arange(+n//2,-n//2,-1)*(fs/n)*(1/b0)
 
-		return (-f, fftw.fftshift(fftw.fft(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb))))
+		return (-f, self.fid_cache.spectrum(entry).copy())
 
 	def energy_FID(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
-		return np.sum(np.power(np.absolute(self.getFID(TE, b0, t, sfactor, afactor, pfactor, lb)), 2))
+		return self.fid_cache.energy(self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb), 'energy_FID')
 
 	def energy_spec(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
-		return np.sum(np.power(np.absolute(fftw.fftshift(fftw.fft(self.getFID(TE, b0, t, sfactor, afactor, pfactor, dfactor, lb)))), 2))
+		return self.fid_cache.energy(self.fid_cache.entry(self, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb), 'energy_spec')
+
+class BasisSet(object):
+	# Struct-of-arrays storage of the peaks of a set of metabolites: one contiguous float64
+	# array per peak parameter, with the peaks of metabolite i at offsets[i]:offsets[i+1].
+	# The Metabolite/Macromolecule objects passed in become views onto these arrays.
+	# Parameters a metabolite does not have (e.g. width_L of a simulated metabolite) are
+	# stored as NaN and read back as empty arrays, like the empty lists before. Metabolites
+	# already in another basis set are copied and move to the new one.
+
+	fields = ('ppm', 'area', 'phase', 'width_L', 'delay', 'width_G')
+
+	def __init__(self, metabolites=[]):
+		self.metabolites = OrderedDict((metab.name, metab) for metab in metabolites)
+		self.version = 0	# counts changes of the peak arrays (see BasisModel)
+		self.names = list(self.metabolites.keys())
+
+		counts = np.array([np.size(metab.ppm) for metab in self.metabolites.values()], dtype=int)
+		self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(int)
+		self.peak_metabolite = np.repeat(np.arange(len(counts)), counts)	# metabolite index of every peak
+
+		# which parameters every metabolite has
+		self.present = {}
+		for field in self.fields:
+			self.present[field] = np.zeros(len(counts), dtype=bool)
+			columns = []
+			for (i, metab) in enumerate(self.metabolites.values()):
+				values = metab.__lists__.get(field, []) if metab.basis is None else metab.basis.view(metab.index, field)
+				if np.size(values) == counts[i] and counts[i] > 0:
+					self.present[field][i] = True
+					columns.append(np.asarray(values, dtype=np.float64).ravel())
+				elif np.size(values) == 0:
+					columns.append(np.full(counts[i], np.nan))
+				else:
+					raise ValueError(metab.name + ': ' + str(np.size(values)) + ' values of ' + field + ' for ' + str(counts[i]) + ' peaks')
+			setattr(self, field, np.concatenate(columns) if columns else np.empty(0))
+
+		for (i, metab) in enumerate(self.metabolites.values()):
+			metab.basis = self
+			metab.index = i
+			metab.__lists__ = None
+			metab.fid_cache.clear()
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, name):
+		return name in self.metabolites
+
+	def __getitem__(self, name):
+		return self.metabolites[name]
+
+	def peaks(self, i):
+		return slice(self.offsets[i], self.offsets[i+1])
+
+	def view(self, i, field):
+		if not self.present[field][i]:
+			return getattr(self, field)[0:0]
+		return getattr(self, field)[self.peaks(i)]
+
+	def assign(self, i, field, values):
+		# values are written into the arrays, so the number of peaks cannot change
+		values = np.asarray(values, dtype=np.float64).ravel()
+		if np.size(values) != self.offsets[i+1] - self.offsets[i]:
+			raise ValueError(self.names[i] + ': ' + str(np.size(values)) + ' values of ' + field + ' for ' + str(self.offsets[i+1] - self.offsets[i]) + ' peaks')
+		getattr(self, field)[self.peaks(i)] = values
+		self.present[field][i] = True
+		self.version += 1
+
+	def getFIDs(self, names, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
+		# FIDs of the named metabolites (rows), same model as Metabolite.getFID and
+		# Macromolecule.getFID, with all peaks evaluated in one (peaks x time) array
+		indices, counts, c_k, w_k, a_k, b_k, phi_k, t_0 = self.peak_parameters(names, b0, sfactor, afactor, pfactor, dfactor, lb)
+		return self.scaling(indices, TE, t) * self.synthesize(counts, c_k, w_k, a_k, b_k, phi_k, t_0, t)
+
+	def peak_parameters(self, names, b0, sfactor, afactor, pfactor, dfactor, lb):
+		# (metabolite indices, peaks per metabolite, per-peak model parameters)
+		indices = np.array([self.names.index(name) for name in names], dtype=int)
+		counts = self.offsets[indices+1] - self.offsets[indices]
+		peaks = np.concatenate([np.arange(self.offsets[i], self.offsets[i+1]) for i in indices]) if np.size(indices) else np.empty(0, dtype=int)
+
+		metabs = [self.metabolites[self.names[i]] for i in indices]
+		macromolecule = np.repeat([isinstance(metab, Macromolecule) for metab in metabs], counts).astype(bool)
+		gaussian = np.repeat([isinstance(metab, Macromolecule) and metab.line_type == 'G' for metab in metabs], counts).astype(bool)
+		lw = np.repeat([metab.lw if isinstance(metab, Macromolecule) else 0.0 for metab in metabs], counts)
+
+		def parameter(field, default):
+			# per-peak values, default for the metabolites that do not have the parameter
+			return np.where(np.repeat(self.present[field][indices], counts), getattr(self, field)[peaks], default)
+
+		# ---- MODEL BASED ON FITMAN (see Metabolite.getFID) ---- #
+		c_k = self.area[peaks] * afactor
+		w_k = (self.ppm[peaks] - sfactor) * b0
+		a_k = np.where(macromolecule & ~gaussian, lw, parameter('width_L', 0.0)) + lb
+		b_k = np.where(gaussian, lw, parameter('width_G', 0.0))
+		phi_k = np.where(macromolecule, self.phase[peaks], np.deg2rad(self.phase[peaks])) + pfactor	# radians
+		t_0 = np.where(macromolecule, 0.0, parameter('delay', dfactor))
+
+		return indices, counts, c_k, w_k, a_k, b_k, phi_k, t_0
+
+	def synthesize(self, counts, c_k, w_k, a_k, b_k, phi_k, t_0, t, reduce=True):
+		# Sum of the peaks of every metabolite (reduceat cannot produce empty sums), or the
+		# (peaks x time) sinusoids themselves if not reduce. The time axis is done in blocks
+		# so the (peaks x time) array stays small.
+		n_peaks = np.size(c_k)
+		real_dtype = precision.real_dtype()
+		signals = np.zeros([np.size(counts) if reduce else n_peaks, np.size(t)], dtype=precision.complex_dtype())
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int)[counts > 0]
+		rows = counts > 0 if reduce else slice(None)
+		block = max(1, 65536 // max(1, n_peaks))
+		for j in range(0, np.size(t) if n_peaks else 0, block):
+			tt = t[np.newaxis,j:j+block] + t_0[:,np.newaxis]
+			# real and imaginary parts separately (real exp/cos/sin are much faster than complex exp)
+			envelope = c_k[:,np.newaxis].astype(real_dtype) * np.exp((-np.pi*a_k[:,np.newaxis]*np.abs(tt) - np.power(np.pi,2)/(4*np.log(2))*np.power(b_k[:,np.newaxis],2)*np.power(tt,2)).astype(real_dtype))
+			angle = precision.wrap(2*np.pi*w_k[:,np.newaxis]*tt + phi_k[:,np.newaxis])
+			real, imag = envelope*np.cos(angle), envelope*np.sin(angle)
+			signals.real[rows, j:j+block] = np.add.reduceat(real, starts, axis=0) if reduce else real
+			signals.imag[rows, j:j+block] = np.add.reduceat(imag, starts, axis=0) if reduce else imag
+		return signals
+
+	def scaling(self, indices, TE, t):
+		# A_m and T2 effects (metabolites with a T2 value only) of every metabolite (rows)
+		metabs = [self.metabolites[self.names[i]] for i in indices]
+		A_m = np.array([metab.A_m for metab in metabs], dtype=float)
+		T2 = np.array([0.0 if isinstance(metab, Macromolecule) else metab.T2 for metab in metabs], dtype=float)
+		decay = np.exp(-(t[np.newaxis,:]+TE*10**(-3))/np.where(T2 > 0, T2, 1.0)[:,np.newaxis])
+		return (A_m[:,np.newaxis] * np.where((T2 > 0)[:,np.newaxis], decay, 1.0)).astype(precision.real_dtype())
+
+	def properties(self, names):
+		# everything outside the peak arrays that the FIDs depend on
+		return tuple((self.metabolites[name].A_m, self.metabolites[name].T2, getattr(self.metabolites[name], 'lw', None), getattr(self.metabolites[name], 'line_type', None)) for name in names)
+
+class BasisModel(object):
+	# BasisSet.getFIDs for interactive use (sliders for the shift, phase and line broadening).
+	# The sinusoids at zero shift, phase and line broadening, including the Gaussian
+	# envelopes, and the A_m/T2 scaling are computed once; a change of sfactor, afactor,
+	# pfactor or lb is then applied by elementwise multiplication:
+	#   peak(t) = base(t) * exp(-2i*pi*sfactor*b0*(t+t_0)) * exp(-pi*lb*(t+t_0)) * afactor * exp(i*pfactor)
+	# (the line broadening only when t+t_0 >= 0, as then |t+t_0| = t+t_0). The cache is
+	# rebuilt when the metabolites, their parameters, TE, b0, the time axis or dfactor change;
+	# call invalidate() after writing into the basis set's arrays directly.
+
+	def __init__(self, basis):
+		self.basis = basis
+		self.key = None
+		self.t = None
+		self.hits = 0
+		self.misses = 0
+
+	def invalidate(self):
+		self.key = None
+
+	def __prepare__(self, names, TE, b0, t, dfactor, lb):
+		indices, counts, c_k, w_k, a_k, b_k, phi_k, t_0 = self.basis.peak_parameters(names, b0, 0, 1, 0, dfactor, 0)
+		separable_lb = np.size(t) == 0 or bool(np.all(np.min(t) + t_0 >= 0))
+
+		key = (id(self.basis), self.basis.version, tuple(names), float(TE), float(b0), float(dfactor), None if separable_lb else float(lb), self.basis.properties(names), precision.policy)
+		if key == self.key and np.array_equal(t, self.t):
+			self.hits += 1
+			return
+		self.misses += 1
+
+		if not separable_lb:
+			a_k = a_k + lb
+		self.key = key
+		self.t = np.array(t, copy=True)
+		self.counts = counts
+		self.t_0 = t_0
+		self.separable_lb = separable_lb
+		self.scale = self.basis.scaling(indices, TE, t)
+
+		# with one delay per metabolite the shift and line broadening factors are the same
+		# for all of its peaks, so only the sums of the peaks are kept
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int)
+		self.uniform = all(np.all(t_0[start:start+count] == t_0[start]) for (start, count) in zip(starts, counts) if count > 0)
+		self.base = self.basis.synthesize(counts, c_k, w_k, a_k, b_k, phi_k, t_0, t, self.uniform)
+
+	def getFIDs(self, names, TE, b0, t, sfactor, afactor, pfactor, dfactor, lb):
+		self.__prepare__(names, TE, b0, t, dfactor, lb)
+
+		lb_k = lb if self.separable_lb else 0.0
+		starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(int)
+		if self.uniform:
+			# factor of every metabolite (any delay will do for metabolites without peaks)
+			t_0 = self.t_0[np.minimum(starts, max(np.size(self.t_0)-1, 0))] if np.size(self.t_0) else np.zeros(np.size(self.counts))
+			FIDs = precision.signal(np.exp(-2j*np.pi*sfactor*b0*t_0 - np.pi*lb_k*t_0))[:,np.newaxis] * self.base
+		else:
+			weights = precision.signal(np.exp(-2j*np.pi*sfactor*b0*self.t_0 - np.pi*lb_k*self.t_0))
+			FIDs = np.zeros([np.size(self.counts), np.size(t)], dtype=self.base.dtype)
+			FIDs[self.counts > 0] = np.add.reduceat(weights[:,np.newaxis] * self.base, starts[self.counts > 0], axis=0)
+
+		factor = precision.signal(afactor * np.exp(1j*pfactor) * np.exp(-2j*np.pi*sfactor*b0*self.t - np.pi*lb_k*self.t))
+		return self.scale * factor[np.newaxis,:] * FIDs
 
 class CSTGroup(object):
 	def __init__(self, typeCST, name, members, minCST, maxCST):
@@ -502,6 +826,9 @@ class OutputFile(object):
 				# self.metabolites[metabolite].area[-1], self.metabolites[metabolite].phase[-1], self.metabolites[metabolite].delay[-1], \
 				# self.metabolites[metabolite].width_G[-1], self.metabolites[metabolite].crlb[-1]
 
+		# peak parameters of all metabolites in contiguous arrays
+		self.basis = BasisSet([self.metabolites[metabolite] for metabolite in self.metabolites_list])
+
 		print('=======================================')
 
 		# this attribute allows user to reference output data structure directly via peak number 
@@ -511,46 +838,122 @@ class OutputFile(object):
 
 	def tree(self): return defaultdict(self.tree)
 
+def read_dat(filename, sidecar=False):
+	# Header lines (the first 12) and complex signal of a FITMAN *.dat file, whose body is
+	# one value per line, alternating real and imaginary parts. The body is parsed in one
+	# pass and must hold as many values as the first header line gives (ValueError
+	# otherwise, before any sidecar is written); with sidecar, the signal is also saved as
+	# filename + '.npy', preceded by the size and mtime of the dat file, and later loads
+	# memory-map it (copy-on-write) as long as the dat file is unchanged. A sidecar that
+	# cannot be written is skipped.
+	with open(filename, 'r') as f:
+		header = [f.readline() for i in range(12)]
+		stat = os.fstat(f.fileno())
+		stamp = np.array([stat.st_size, stat.st_mtime], dtype=np.float64)
+
+		sidecar_file = filename + '.npy'
+		if sidecar and os.path.exists(sidecar_file):
+			try:
+				cached = np.load(sidecar_file, mmap_mode='c')
+				if cached.dtype == np.float64 and cached.ndim == 1 and np.array_equal(cached[0:2], stamp):
+					return header, cached[2:].view(np.complex128)
+			except Exception:
+				pass
+
+		# float() of every token, so a malformed value raises as the line-by-line parser did
+		values = np.array(f.read().split(), dtype=np.float64)
+
+	if np.size(values) != int(header[0]):
+		raise ValueError(filename + ': ' + str(np.size(values)) + ' data values, the header gives ' + header[0].strip())
+	values = values[0:2*(np.size(values)//2)]
+	signal = values[0::2] + 1j*values[1::2]
+
+	if sidecar:
+		try:
+			tmp_filename = sidecar_file + '.' + str(os.getpid()) + '.tmp'
+			with open(tmp_filename, 'wb') as f:
+				np.save(f, np.concatenate((stamp, values)))
+			os.replace(tmp_filename, sidecar_file)
+		except Exception:
+			pass
+
+	return header, signal
+
+class DatHeader(object):
+	# The 12 header lines of a FITMAN *.dat file. Values are written with str(), so strings
+	# (e.g. the lines of an existing file, see from_lines) are written as they are.
+
+	def __init__(self, points, averages, dwell_time, b0, scans, source, date, scan_info, timing_info, footer=('SIMULTANEOUS', '0.0', 'EMPTY')):
+		self.points = points			# number of data lines (2 per complex point)
+		self.averages = averages
+		self.dwell_time = dwell_time	# sec
+		self.b0 = b0					# MHz
+		self.scans = scans
+		self.source = source
+		self.date = date
+		self.scan_info = scan_info		# MachS=... ConvS=... V1=... V2=... V3=...
+		self.timing_info = timing_info	# TE=... s TR=... s P1=... P2=... P3=... Gain=...
+		self.footer = tuple(footer)
+
+	@classmethod
+	def from_lines(cls, lines):
+		lines = [line.rstrip('\n') for line in lines]
+		return cls(*(lines[0:9] + [lines[9:12]]))
+
+	def lines(self):
+		return [str(value) for value in (self.points, self.averages, self.dwell_time, self.b0, self.scans, self.source, self.date, self.scan_info, self.timing_info)] + [str(value) for value in self.footer]
+
+class DatWriter(object):
+	# Writes FITMAN *.dat files: the header lines, then the real and imaginary part of every
+	# point on alternate lines. fmt is a %-format for the values ('%.6f' for PINTS and APPS),
+	# or None for str() of every value (BrukerFID). The body is formatted with one string
+	# operation and written at once; the output is the same, byte for byte, as writing
+	# fmt % value (or str(value)) for every value.
+
+	def __init__(self, header, fmt='%.6f'):
+		self.header = header
+		self.fmt = fmt
+
+	def body(self, signal):
+		signal = np.asarray(signal).ravel()
+		values = np.empty(2*np.size(signal), dtype=signal.real.dtype)
+		values[0::2] = np.real(signal)
+		values[1::2] = np.imag(signal)
+
+		if self.fmt is not None:
+			return ((self.fmt + '\n') * np.size(values)) % tuple(values.tolist())
+		# str() of numpy float64 values is the repr of the Python float
+		strings = map(repr, values.tolist()) if values.dtype == np.float64 else map(str, values)
+		return ''.join(string + '\n' for string in strings)
+
+	def write(self, filename, signal):
+		with open(filename, 'w') as f:
+			f.write(''.join(line + '\n' for line in self.header.lines()) + self.body(signal))
+
 class DatFile(object):
-	def __init__(self, filename):
+	# sidecar: keep a .npy copy of the signal next to the file (see read_dat)
+	def __init__(self, filename, sidecar=False):
 		self.filename = filename
+		self.sidecar = sidecar
 		self.loadDatFile()
 
 	def loadDatFile(self):
 		print('=======================================')
 		print('Reading dat from ', self.filename, ' ...')		
-	
-		in_file = open(self.filename,'r')
-
-		self.n = 0
-		self.fs = 0
-		self.b0 = 0
-		dat = []
-
-		for (i, line) in enumerate(in_file):
-			if i == 0:
-				self.n = int(line.replace(' ', '').replace('\n', ''))//2
-			elif i == 2:
-				self.fs = 1/float(line.replace(' ', '').replace('\n', ''))
-			elif i == 3:
-				self.b0 = float(line.replace(' ', '').replace('\n', ''))
-			elif i == 7:
-				self.ConvS = float(line.replace('\n','').split(' ')[1].split('=')[1])
-			elif i == 8:
-				self.gain = float(line.replace('\n','').split(' ')[-1].split('=')[1])
-				self.TE   = float(line.replace('\n','').split(' ')[0].split('=')[1])
-			elif i == 11:
-				pass
-			elif i > 11:
-				dat.append(float(line.replace(' ', '').replace('\n', '')))
 
-		real = sp.array(dat)[0::2]
-		imag = sp.array(dat)[1::2]
+		header, signal = read_dat(self.filename, self.sidecar)
+		self.header = DatHeader.from_lines(header)
+
+		self.n = int(header[0].replace(' ', '').replace('\n', ''))//2
+		self.fs = 1/float(header[2].replace(' ', '').replace('\n', ''))
+		self.b0 = float(header[3].replace(' ', '').replace('\n', ''))
+		self.ConvS = float(header[7].replace('\n','').split(' ')[1].split('=')[1])
+		self.gain = float(header[8].replace('\n','').split(' ')[-1].split('=')[1])
+		self.TE   = float(header[8].replace('\n','').split(' ')[0].split('=')[1])
+
 		print('n', self.n, 'fs', self.fs, 'b0', self.b0)
 		print('ConvS', self.ConvS, 'gain', self.gain)
-		print('Real', real, sp.size(real))
-		print('Imag', imag, sp.size(imag))
-		self.signal = real+1j*imag
+		self.signal = precision.signal(signal)
 
 		self.t = sp.arange(0, self.n, 1) * (1/self.fs)
 		print('=======================================')
@@ -561,7 +964,7 @@ class DatFile(object):
 	def getSpec(self):
 		n = sp.size(self.signal)
 		f = sp.arange(-n//2,+n//2, 1)*(self.fs/n)*(1/self.b0)
-		return (f, fftw.fftshift(fftw.fft(self.signal)))
+		return (f, fftplans.spectrum(self.signal))
 
 class RDAFile(object):
 	def __init__(self, filename, **kwargs):
@@ -581,37 +984,27 @@ class RDAFile(object):
 			return
 
 		flags = dict()
-		defaults= {'scale_fid': True}
+		defaults= {'scale_fid': True, 'lazy': False}
 		for name in list(defaults.keys()):
 			flags[name] = kwargs.get(name, defaults[name])
 
-		# Read header of RDA file
-		rawfid = f.read()
-		hstart = rawfid.find(b">>> Begin of header <<<") + len(b">>> Begin of header <<<\n") + 1
-		hend = rawfid.find(b">>> End of header <<<")
-		hstring = rawfid[hstart:hend]; hstring = hstring.decode()
-		hlist = hstring.split("\r\n")
-		hlist2 = [h.split(": ") for h in hlist]
-		fid_hdr = dict(hlist2[h] for h in range(0, len(hlist2)-1, 1))
-		fid_data = rawfid[hend + len(">>> End of header <<<\n") + 1:]
-		f.close()
-
-		# Convert raw spectral data and scale
-		element_size = 16  # complex double
-		element_count = len(fid_data) // element_size
-		format = "dd"
-
-		try:
-			fid_data = struct.unpack(format * element_count, fid_data)
-		except struct.error:
+		# Read header of RDA file (the data are not read yet)
+		rawhdr = b''
+		while rawhdr.find(b">>> End of header <<<") < 0:
+			chunk = f.read(65536)
+			if not chunk:
+				break
+			rawhdr += chunk
+		fid_hdr, data_start = self.parse_header(rawhdr)
+		self.header = fid_hdr
+
+		# The data are little-endian complex doubles
+		data_size = os.fstat(f.fileno()).st_size - data_start
+		if data_size % 16 != 0:
 			print("Unexpected input encountered while reading raw data.")
+			f.close()
 			return
 
-		fid_data = [complex(fid_data[w], fid_data[w+1]) for w in range(0, len(fid_data), 2)] 
-
-		fid_data_type = "complex128"
-		fid_data = np.fromiter(fid_data, fid_data_type)
-
 		# Some acquisition parameters from header
 		larmor = float(fid_hdr['MRFrequency'])
 		fid_date = dt.datetime.strptime(fid_hdr['StudyDate'], '%Y%m%d').strftime('%d%b%y')
@@ -622,27 +1015,24 @@ class RDAFile(object):
 		# Reorder data by size of CSI grid (SVS has grid size of 1 x 1)
 		vect_size = int(fid_hdr['VectorSize'])
 		fid_time = np.arange(fid_dt, (vect_size + 1) * fid_dt, fid_dt)
-		fid_data = fid_data.reshape([len(fid_data)//vect_size, vect_size])
-		spec_data = np.zeros(fid_data.shape, dtype=complex)
 
-		final_scale = np.ones(fid_data.shape[0])
-		for i_csi in range(fid_data.shape[0]):
-			if flags['scale_fid']:
-				scale = np.ones(fid_data.shape[1])
-				for p in range(48):
-					data_pt = fid_data[i_csi, p]
-					if np.abs(data_pt) > 10:
-						while np.abs(data_pt) > 10:
-							scale[p] = scale[p] / 10
-							data_pt = data_pt / 10
-						final_scale[i_csi] = min(scale)
-					elif np.abs(data_pt) < 1:
-						while np.abs(data_pt) < 1:
-							scale[p] = scale[p] * 10
-							data_pt = data_pt * 10
-						final_scale[i_csi] = max(scale)
-			fid_data[i_csi,:] = fid_data[i_csi,:] * final_scale[i_csi]
-			spec_data[i_csi,:], freq = self.fid_to_spec(fid_data[i_csi,:], fid_time)
+		if flags['lazy']:
+			# FIDs stay in the file; fid, spec and ConvS compute the vectors they are indexed with
+			f.close()
+			self.csi = CSIData(np.memmap(filename, dtype='<c16', mode='r', offset=data_start, shape=(data_size//16//vect_size, vect_size)), flags['scale_fid'], self.scale_factors)
+			fid_data = LazyRows(self.csi.fid, self.csi.shape)
+			spec_data = LazyRows(self.csi.spec, self.csi.shape)
+			final_scale = LazyRows(self.csi.scales, self.csi.shape[0:1])
+		else:
+			f.seek(data_start)
+			fid_data = np.fromfile(f, dtype='<c16')
+			f.close()
+			fid_data = fid_data.reshape([len(fid_data)//vect_size, vect_size])
+
+			final_scale = self.scale_factors(fid_data) if flags['scale_fid'] else np.ones(fid_data.shape[0])
+			fid_data = precision.signal(fid_data * final_scale[:,np.newaxis])
+			spec_data = fftplans.spectrum(fid_data, axis=-1)
+		freq = sp.fftpack.fftshift(sp.fftpack.fftfreq(vect_size, fid_time[1] - fid_time[0]))
 
 		csi_size = np.array([fid_hdr['CSIMatrixSize[0]'], fid_hdr['CSIMatrixSize[1]'], fid_hdr['CSIMatrixSize[2]'], vect_size], dtype=int)
 		csi_size = csi_size[csi_size > 1]  # Remove singleton dimensions
@@ -688,12 +1078,129 @@ class RDAFile(object):
 		self.n_averages = fid_nt
 		self.vox_size = vox_size
 		self.vox_affine = R_fid
+		self.csi_grid = np.array([fid_hdr['CSIMatrixSize[0]'], fid_hdr['CSIMatrixSize[1]'], fid_hdr['CSIMatrixSize[2]']], dtype=int)
+
+	def index(self, row, col, slc=0):
+		# vector index of voxel(s) (row, col, slc) of the CSI grid, with the columns
+		# (CSIMatrixSize[0]) running fastest, then the rows and the slices; e.g.
+		# rda.spec[rda.index(row, col, slc)]
+		return np.ravel_multi_index((slc, row, col), (self.csi_grid[2], self.csi_grid[1], self.csi_grid[0]))
+
+	def parse_header(self, rawfid):
+		# header dict and start of the data in the raw file
+		hstart = rawfid.find(b">>> Begin of header <<<") + len(b">>> Begin of header <<<\n") + 1
+		hend = rawfid.find(b">>> End of header <<<")
+		hlist = rawfid[hstart:hend].decode().split("\r\n")
+		fid_hdr = dict(h.split(": ") for h in hlist[0:-1])
+		return fid_hdr, hend + len(">>> End of header <<<\n") + 1
+
+	def scale_factors(self, fid_data):
+		# ConvS of every vector: powers of 10 that bring the first 48 points into [1, 10].
+		# The point that is last outside [1, 10] decides: if it is above 10 the smallest
+		# factor is used, otherwise the largest. Every point is divided (or multiplied) by 10
+		# in place until it is in range, all points at once, so the factors are exactly the
+		# same as when each point is scaled on its own. Zero and non-finite points are skipped.
+		magnitude = np.abs(fid_data[:,0:48])
+		above = np.isfinite(magnitude) & (magnitude > 10)
+		below = (magnitude > 0) & (magnitude < 1)
+
+		scale = np.ones(magnitude.shape)
+		points = fid_data[:,0:48].copy()
+		active = above.copy()
+		while np.any(active):
+			scale[active] = scale[active] / 10
+			points[active] = points[active] / 10
+			active &= np.abs(points) > 10
+		points = fid_data[:,0:48].copy()
+		active = below.copy()
+		while np.any(active):
+			scale[active] = scale[active] * 10
+			points[active] = points[active] * 10
+			active &= np.abs(points) < 1
+
+		final_scale = np.ones(fid_data.shape[0])
+		outside = above | below
+		last = outside.shape[1] - 1 - np.argmax(outside[:,::-1], axis=1)
+		rows = np.flatnonzero(np.any(outside, axis=1))
+		final_scale[rows] = np.where(above[rows, last[rows]], np.min(scale[rows], axis=1, initial=1.0), np.max(scale[rows], axis=1, initial=1.0))
+		return final_scale
 
 	def fid_to_spec(self, fid_data, time):
-		spec = sp.fftpack.fftshift(sp.fftpack.fft(fid_data)) 
+		spec = fftplans.spectrum(fid_data)
 		freq = sp.fftpack.fftshift(sp.fftpack.fftfreq(fid_data.size, time[1] - time[0])) 
 		return spec, freq
 
+class CSIData(object):
+	# Lazy access to the vectors of an RDA file (RDAFile(filename, lazy=True)). The FIDs stay
+	# memory-mapped; ConvS, the scaled FIDs and the spectra are computed only for the vectors
+	# that are asked for. Spectra are computed in batches of block_size vectors, and the
+	# max_blocks most recently used batches are kept.
+
+	def __init__(self, fids, scale_fid, scale_factors, block_size=64, max_blocks=64):
+		self.fids = fids
+		self.shape = fids.shape
+		self.scale_fid = scale_fid
+		self.scale_factors = scale_factors
+		self.block_size = block_size
+		self.max_blocks = max_blocks
+		self.conv_s = np.full(self.shape[0], np.nan)
+		self.blocks = OrderedDict()
+
+	def scales(self, rows):
+		if not self.scale_fid:
+			return np.ones(np.size(rows))
+		missing = np.unique(rows[np.isnan(self.conv_s[rows])])
+		if np.size(missing):
+			self.conv_s[missing] = self.scale_factors(self.fids[missing, 0:48])
+		return self.conv_s[rows]
+
+	def fid(self, rows):
+		return precision.signal(self.fids[rows] * self.scales(rows)[:,np.newaxis])
+
+	def spec(self, rows):
+		block_of_row = rows // self.block_size
+		needed = np.unique(block_of_row)
+		missing = [block for block in needed if block not in self.blocks]
+		if missing:
+			# one batched FFT of all blocks that are not cached
+			block_rows = [np.arange(block*self.block_size, min((block+1)*self.block_size, self.shape[0])) for block in missing]
+			spectra = fftplans.spectrum(self.fid(np.concatenate(block_rows)), axis=-1)
+			start = 0
+			for (block, r) in zip(missing, block_rows):
+				self.blocks[block] = spectra[start:start+np.size(r)].copy()
+				start += np.size(r)
+
+		spec = np.empty((np.size(rows), self.shape[1]), dtype=precision.complex_dtype())
+		for block in needed:
+			self.blocks.move_to_end(block)
+			selected = block_of_row == block
+			spec[selected] = self.blocks[block][rows[selected] - block*self.block_size]
+		while len(self.blocks) > max(self.max_blocks, np.size(needed)):
+			self.blocks.popitem(last=False)
+		return spec
+
+class LazyRows(object):
+	# Array-like access (rows first) to data computed per row by function(rows)
+	def __init__(self, function, shape):
+		self.function = function
+		self.shape = tuple(shape)
+		self.ndim = len(self.shape)
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __getitem__(self, key):
+		key = key if isinstance(key, tuple) else (key,)
+		rows = np.arange(self.shape[0])[key[0]]
+		data = self.function(np.atleast_1d(rows))
+		if np.ndim(rows) == 0:
+			return data[0][key[1:]]
+		return data[(slice(None),) + key[1:]]
+
+	def __array__(self, dtype=None, copy=None):
+		data = self.function(np.arange(self.shape[0]))
+		return data if dtype is None else data.astype(dtype)
+
 class Procpar(object):
 	def __init__(self, filename):
 		self.filename = filename
@@ -1067,22 +1574,32 @@ class VarianVoxel(object):
 		return m_nifti
 
 class BrukerFID(object):
-	def __init__(self, file_dir):
+	# raw_file is 'fid', or 'ser'/'rawdata.job0' for data sets that keep every repetition
+	# or average. With split, the raw file is read as transients of PVM_DigNp points and
+	# signal is their sum, like the accumulated fid; without, the whole file is one FID.
+	# split=None splits every raw file but 'fid'. The transients stay memory-mapped and
+	# are only scaled and copied by transients().
+	def __init__(self, file_dir, raw_file='fid', split=None):
 		self.file_dir = file_dir
-
-		# READ RAW DATA
-		data_real, data_imag = self.__parseFID__(file_dir)
+		if split is None:
+			split = raw_file != 'fid'
 
 		# READ ACQUISITION PARAMS
 		self.header = self.__parseMethodFile__(file_dir)
 		self.header_params = list(self.header.keys())
+		self.acqp = self.__parseParamFile__(file_dir + '/acqp') if os.path.exists(file_dir + '/acqp') else {}
 
 		DigShift = int(self.header['PVM_DigShift']['value'])
 		DigDw    = float(self.header['PVM_DigDw']['value'])
 
+		# READ RAW DATA
+		self.raw = self.__parseFID__(file_dir, raw_file, split)
+		self.n_transients = np.shape(self.raw)[0]
+
 		# CHOP OFF ADC DELAY
-		self.signal = np.array(data_real) + 1j*np.array(data_imag)
-		self.signal = self.signal[DigShift:]
+		self.raw = self.raw[:, DigShift:, :]
+		pairs = np.asarray(np.sum(self.raw, axis=0, dtype=np.float64))
+		self.signal = pairs[:, 0] + 1j*pairs[:, 1]
 		self.n = np.size(self.signal, 0)
 
 		# SCALE SIGNAL SUCH THAT MAGNITUDE OF FID IS BETWEEN 1 AND 10
@@ -1099,26 +1616,63 @@ class BrukerFID(object):
 				scaled_point = scaled_point / 10.
 				self.ConvS = self.ConvS / 10.
 		# | Apply scaling factor to signal
-		self.signal = np.real(self.signal) * self.ConvS + 1j*np.imag(self.signal) * self.ConvS
+		self.signal = precision.signal(np.real(self.signal) * self.ConvS + 1j*np.imag(self.signal) * self.ConvS)
 
 		self.fs = 1/(DigDw/1000)
 		self.t = sp.arange(0, self.n, 1) * (1/self.fs)
 
-	def __parseFID__(self, file_dir):
-		f = open(file_dir + '/fid', 'r')
-		data = np.fromfile(f, np.int32)
-		data_real = []
-		data_imag = []
-		for (i, num) in enumerate(data):
-			if i % 2 == 0:
-				data_real.append(num)
-			else:
-				data_imag.append(num)
-		f.close()
-		return data_real, data_imag
+	def transients(self, rows=slice(None)):
+		# (transients x n) array of the selected transients, scaled like signal
+		pairs = np.asarray(self.raw[rows], dtype=np.float64)
+		return precision.signal(pairs[..., 0] * self.ConvS + 1j*pairs[..., 1] * self.ConvS)
+
+	def __parseFID__(self, file_dir, raw_file='fid', split=True):
+		# (transients x points x 2) view of the raw data file: real and imaginary parts of
+		# every transient, memory-mapped without a copy of the file. The word format and byte
+		# order are read from acqp (GO_raw_data_format, BYTORDA); without acqp, the file is
+		# read as little-endian int32. Without split, the whole file is a single transient.
+		formats = {'GO_16BIT_SGN_INT': 'i2', 'GO_32BIT_SGN_INT': 'i4', 'GO_32BIT_FLOAT': 'f4', 'GO_64BIT_FLOAT': 'f8'}
+		raw_format = self.acqp_value('GO_raw_data_format', 'GO_32BIT_SGN_INT')
+		if raw_format not in formats:
+			raise ValueError(file_dir + '/acqp: unsupported GO_raw_data_format ' + raw_format + ' (' + ', '.join(formats) + ')')
+		dtype = np.dtype(('>' if self.acqp_value('BYTORDA', 'little') == 'big' else '<') + formats[raw_format])
+
+		filename = file_dir + '/' + raw_file
+		if os.path.getsize(filename) < dtype.itemsize:
+			return np.zeros((1, 0, 2), dtype=dtype)
+		data = np.memmap(filename, dtype=dtype, mode='r')
+
+		# points per transient; with Standard_KBlock, every transient is padded to 1024 bytes
+		if not split:
+			points = np.size(data)//2
+		elif 'PVM_DigNp' in self.header:
+			points = int(self.header['PVM_DigNp']['value'])
+		elif 'ACQ_size' in self.acqp:
+			points = int(np.ravel(self.acqp['ACQ_size']['value'])[0])//2
+		else:
+			points = np.size(data)//2
+		stride = 2*points
+		if split and self.acqp_value('GO_block_size', '') == 'Standard_KBlock':
+			stride = int(np.ceil(stride*dtype.itemsize/1024.)*1024)//dtype.itemsize
+		if points == 0 or np.size(data) < 2*points:
+			points = np.size(data)//2	# a single transient
+			stride = 2*points
+
+		# (the padding of the last transient may be missing)
+		transients = (np.size(data) - 2*points)//stride + 1
+		return np.lib.stride_tricks.as_strided(data, shape=(transients, points, 2), strides=(stride*dtype.itemsize, 2*dtype.itemsize, dtype.itemsize), writeable=False)
+
+	def acqp_value(self, key, default):
+		if key not in self.acqp:
+			return default
+		return str(self.acqp[key]['value']).strip()
 
 	def __parseMethodFile__(self, file_dir):
-		f = open(file_dir + '/method', 'r')
+		return self.__parseParamFile__(file_dir + '/method')
+
+	def __parseParamFile__(self, filename):
+		# JCAMP-DX parameters of a Bruker method/acqp file
+		f = open(filename, 'r')
 		
 		lines = []
 		for line in f:
@@ -1165,9 +1719,6 @@ class BrukerFID(object):
 			out_name = out_name + '.dat'
 
 		now = dt.datetime.now()
-		
-		data_real = np.real(self.signal)
-		data_imag = -np.imag(self.signal)
 
 		DigDw = float(self.header['PVM_DigDw']['value'])
 		FrqRef = float(self.header['PVM_FrqRef']['value'][0])
@@ -1186,31 +1737,17 @@ class BrukerFID(object):
 		EchoTime = float(self.header['PVM_EchoTime']['value'])
 		RepetitionTime = float(self.header['PVM_RepetitionTime']['value'])
 
-		o = open(out_name, 'w')
-		o.write(str(np.size(data_real) + np.size(data_imag)) + '\n')
-		o.write('1\n')
-		o.write(str(DigDw/1000.) + '\n')
-		o.write(str(FrqRef) + '\n')
-		o.write(str(NAvgs) + '\n')
-		o.write(self.file_dir + '/fid\n')
-		o.write(now.strftime("%Y %m %d") + '\n')
-		o.write('MachS=0 ConvS=' + str(self.ConvS) + ' ')
-		o.write('V1=' + str(VoxArrSize[0]) + ' ' + 'V2=' + str(VoxArrSize[1]) + ' ' + 'V3=' + str(VoxArrSize[2]) + '\n')
-		o.write('TE=' + str(EchoTime / 1000.) + ' s ')
-		o.write('TR=' + str(RepetitionTime / 1000.) + ' s ')
-		o.write('P1=' + str(VoxArrPosition[0]) + ' P2=' + str(VoxArrPosition[1]) + ' P3=' + str(VoxArrPosition[2]) + ' Gain=' + str(EncChanScaling[0]) + '\n')
-		o.write('SIMULTANEOUS\n0.0\n')
-		o.write('EMPTY\n')
-
-		for i, p in enumerate(self.signal):
-			o.write(str(data_real[i]) + '\n')
-			o.write(str(data_imag[i]) + '\n')
-		o.close()
+		header = DatHeader(2*np.size(self.signal), 1, DigDw/1000., FrqRef, NAvgs, self.file_dir + '/fid', now.strftime("%Y %m %d"),
+						   'MachS=0 ConvS=' + str(self.ConvS) + ' ' + 'V1=' + str(VoxArrSize[0]) + ' ' + 'V2=' + str(VoxArrSize[1]) + ' ' + 'V3=' + str(VoxArrSize[2]),
+						   'TE=' + str(EchoTime / 1000.) + ' s ' + 'TR=' + str(RepetitionTime / 1000.) + ' s ' + 'P1=' + str(VoxArrPosition[0]) + ' P2=' + str(VoxArrPosition[1]) + ' P3=' + str(VoxArrPosition[2]) + ' Gain=' + str(EncChanScaling[0]))
+
+		# the imaginary parts are written negated
+		DatWriter(header, fmt=None).write(out_name, np.conj(self.signal))
 
 	def getSpec(self):
 		n = sp.size(self.signal)
 		f = sp.arange(-n//2,+n//2, 1)*(self.fs/n)*(1/float(self.header['PVM_FrqRef']['value'][0]))
-		return (-f, fftw.fftshift(fftw.fft(self.signal)))
+		return (-f, fftplans.spectrum(self.signal))
 
 	def print_params(self, console):
 		# PRINT SOME USEFUL PARAMS TO CONSOLE
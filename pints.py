@@ -1,7 +1,6 @@
 from __future__ import print_function
 
 # ---- System Libraries ---- #
-from builtins import zip
 from builtins import str
 from builtins import range
 import sys
@@ -18,15 +17,15 @@ if PyQt6_spec != None:
 else:
 	from PyQt5 import QtCore, QtGui, QtWidgets, uic
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 # ---- Math Libraries ---- #
 import scipy as sp
 import scipy.signal as spsg
 
 import numpy as np
-import math
-from pyfftw.interfaces import scipy_fftpack as fftw
+import fftplans
+import precision
 
 # ---- Plotting Libraries ---- #
 import matplotlib as mpl;
@@ -40,8 +39,8 @@ import matplotlib.pyplot as plt; plt.style.use('ggplot')
 from magiqdataclasses import *
 
 # ---- Simulation Libraries ---- #
-import pygamma as pg
 from simclasses import *
+import timing
 
 qtCreatorFile = "pints/ui/PINTS.ui"
 Ui_MainWindow, QtBaseClass = uic.loadUiType(qtCreatorFile)
@@ -272,29 +271,6 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		# Editing Pulse Info
 		# --- TBD ---
 
-	def fit_sin(self, tt, yy):
-		'''Fit sin to the input time sequence, and return fitting parameters "amp", "omega", "phase", "offset", "freq", "period" and "fitfunc"'''
-		tt = np.array(tt)
-		yy = np.array(yy)
-		ff = np.fft.fftfreq(len(tt), (tt[1]-tt[0]))   # assume uniform spacing
-		Fyy = abs(np.fft.fft(yy))
-		guess_freq = abs(ff[np.argmax(Fyy[1:])+1])   # excluding the zero frequency "peak", which is related to offset
-		guess_amp = np.std(yy) * 2.**0.5
-		guess_offset = np.mean(yy)
-		guess = np.array([guess_amp, 2.*np.pi*guess_freq, 0., guess_offset])
-
-		popt, pcov = sp.optimize.curve_fit(self.sinfunc, tt, yy, p0=guess)
-		A, w, p, c = popt
-		f = w/(2.*np.pi)
-		fitfunc = lambda t: A * np.sin(w*t + p) + c
-		return {"amp": A, "omega": w, "phase": p, "offset": c, "freq": f, "period": 1./f, "fitfunc": fitfunc, "maxcov": np.max(pcov), "rawres": (guess,popt,pcov)}
-
-	def sinfunc(self, t, A, w, p, c):
-		return A * np.sin(w*t + p) + c
-
-	def logs_func(self, x, A, B, K, s):
-		return A + (K - A)/(1 + np.exp(-B*(x-s)))
-
 	def confirmSimParams(self):
 		if self.sLASERradioButton_bruker.isChecked():
 
@@ -338,106 +314,8 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		self.sim_experiment.description = 'Density-matrix simulations of metabolites using PyGAMMA and metabolite parameters from V. Govindaraju et. al, NMR Biomed. 2000;13:129-153'
 		self.sim_experiment.type = 'PINTS'
 
-		self.insysfiles = [     
-					'alanine.sys',
-					'aspartate.sys',
-					'choline_1-CH2_2-CH2.sys',
-					'choline_N(CH3)3_a.sys',
-					'choline_N(CH3)3_b.sys',
-					'creatine_N(CH3).sys',
-					'creatine_X.sys',
-					'd-glucose-alpha.sys',
-					'd-glucose-beta.sys',
-					'eth.sys',
-					'gaba.sys',
-					'glutamate.sys',
-					'glutamine.sys',
-					'glutathione_cysteine.sys',
-					'glutathione_glutamate.sys',
-					'glutathione_glycine.sys',
-					'glycine.sys',
-					'gpc_7-CH2_8-CH2.sys',
-					'gpc_glycerol.sys',
-					'gpc_N(CH3)3_a.sys',
-					'gpc_N(CH3)3_b.sys',
-					'lactate.sys',
-					'myoinositol.sys',
-					'naa_acetyl.sys',
-					'naa_aspartate.sys',
-					'naag_acetyl.sys',
-					'naag_aspartyl.sys',
-					'naag_glutamate.sys',
-					'pcho_N(CH3)3_a.sys',
-					'pcho_N(CH3)3_b.sys',
-					'pcho_X.sys',
-					'pcr_N(CH3).sys',
-					'pcr_X.sys',
-					'peth.sys',
-					'scyllo-inositol.sys',
-					'taurine.sys']
-
-		if self.sim_experiment.b0 == 123.3:
-			self.macromolecules = [ 
-						'MM09', 
-						'MM12', 
-						'MM14', 
-						'MM16', 
-						'MM20', 
-						'MM21', 
-						'MM23', 
-						'MM26', 
-						'MM30', 
-						'MM31', 
-						'MM37', 
-						'MM38', 
-						'MM40' ]
-
-			# From https://www.ncbi.nlm.nih.gov/pmc/articles/PMC5215417/
-			self.macromolecules_data = self.tree()
-			self.macromolecules_data['MM09'] = Macromolecule('MM09',  0.90, 'L', 21.20, 0.72, 0)
-			self.macromolecules_data['MM12'] = Macromolecule('MM12',  1.21, 'L', 19.16, 0.28, 0)
-			self.macromolecules_data['MM14'] = Macromolecule('MM14',  1.38, 'L', 15.90, 0.38, 0)
-			self.macromolecules_data['MM16'] = Macromolecule('MM16',  1.63, 'L', 07.50, 0.05, 0)
-			self.macromolecules_data['MM20'] = Macromolecule('MM20',  2.01, 'L', 29.03, 0.45, 0)
-			self.macromolecules_data['MM21'] = Macromolecule('MM21',  2.09, 'L', 20.53, 0.36, 0)
-			self.macromolecules_data['MM23'] = Macromolecule('MM23',  2.25, 'L', 17.89, 0.36, 0)
-			self.macromolecules_data['MM26'] = Macromolecule('MM26',  2.61, 'L', 05.30, 0.04, 0)
-			self.macromolecules_data['MM30'] = Macromolecule('MM30',  2.96, 'L', 14.02, 0.20, 0)
-			self.macromolecules_data['MM31'] = Macromolecule('MM31',  3.11, 'L', 17.89, 0.11, 0)
-			self.macromolecules_data['MM37'] = Macromolecule('MM37',  3.67, 'L', 33.52, 0.64, 0)
-			self.macromolecules_data['MM38'] = Macromolecule('MM38',  3.80, 'L', 11.85, 0.07, 0)
-			self.macromolecules_data['MM40'] = Macromolecule('MM40',  3.96, 'L', 37.48, 1.00, 0)
-		else:
-			self.macromolecules = [ 'lm1', 
-						'lm2', 
-						'lm3', 
-						'lm4', 
-						'lm5', 
-						'lm6', 
-						'lm7', 
-						'lm8', 
-						'lm9', 
-						'lm10', 
-						'lm11', 
-						'lm12', 
-						'lm13', 
-						'lm14' ]
-
-			self.macromolecules_data = self.tree()
-			self.macromolecules_data['lm1']  = Macromolecule('lm1',  0.9457810, 'L', 50.72009, 3.5501260, -1.13820100)
-			self.macromolecules_data['lm2']  = Macromolecule('lm2',  1.4757810, 'L', 54.12614, 2.8557010, 0.054570260)
-			self.macromolecules_data['lm3']  = Macromolecule('lm3',  1.7057810, 'L', 68.32043, 3.9072800, -0.06015777)
-			self.macromolecules_data['lm4']  = Macromolecule('lm4',  2.1157810, 'L', 96.43580, 4.7191390, -0.09620739)
-			self.macromolecules_data['lm5']  = Macromolecule('lm5',  2.3157810, 'L', 69.70896, 2.7845620, -0.57759460)
-			self.macromolecules_data['lm6']  = Macromolecule('lm6',  3.0157810, 'L', 42.72932, 1.0176800, -0.65827850)
-			self.macromolecules_data['lm7']  = Macromolecule('lm7',  3.9854041, 'L', 29.64625, 1.2094070, 0.288971500)
-			self.macromolecules_data['lm8']  = Macromolecule('lm8',  7.1257810, 'L', 274.4760, 4.0466410, 0.302700400)
-			self.macromolecules_data['lm9']  = Macromolecule('lm9',  7.8557810, 'L', 37.37627, 1.3135740, 0.020221810)
-			self.macromolecules_data['lm10'] = Macromolecule('lm10', 2.6557810, 'L', 121.4557, 2.3499680, -0.58261020)
-			self.macromolecules_data['lm11'] = Macromolecule('lm11', 1.2357810, 'L', 30.68139, 0.7444791, -1.13820100)
-			self.macromolecules_data['lm12'] = Macromolecule('lm12', -0.628240, 'L', 1789.202, 21.518780, -3.65296700)
-			self.macromolecules_data['lm13'] = Macromolecule('lm13', 3.2957810, 'L', 109.4958, 1.6655390, 0.163575600)
-			self.macromolecules_data['lm14'] = Macromolecule('lm14', 3.7057810, 'L', 169.6304, 4.8735330, -1.35431900)
+		self.insysfiles = list(default_insysfiles)
+		self.macromolecules, self.macromolecules_data = macromolecule_set(self.sim_experiment.b0)
 
 		self.sim_experiment.obs_iso = '1H'
 
@@ -513,151 +391,29 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		self.simProgressBar.setMaximum(int(np.size(self.insysfiles)) + 2)
 		self.simProgressBar.setValue(0)
 
+		# timing report per calibration experiment
+		self.calibration_timings = OrderedDict()
+
 		if self.sLASERradioButton_bruker.isChecked():
 
 			# Create a new simulations results file
-			self.save_dir_sim = 'pints/experiments/sLASER_sim_bruker_' \
-								+ datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S") \
-								+ '_TE' + str(self.sim_experiment.TE)
-			
-			if self.T7Button.isChecked():
-				self.save_dir_sim += '_7T/'
-			elif self.T3Button.isChecked():
-				self.save_dir_sim += '_3T/'
-			elif self.T9Button.isChecked():
-				self.save_dir_sim += '_9T/'
+			self.save_dir_sim = results_dir('pints/experiments', self.sim_experiment, datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S"))
 
 			if not os.path.exists(self.save_dir_sim):
 				os.makedirs(self.save_dir_sim)
-			self.sim_results = open(self.save_dir_sim + 'sLASER_sim_results.txt', 'w')
+			self.sim_results = open(self.save_dir_sim + results_filename(self.sim_experiment), 'w')
 
 			# Write parameters in file
-			self.sim_results.write(';PINTS for FITMAN Simulation Output\n')
-			self.sim_results.write(';Experiment Information\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
-			self.sim_results.write(';Name: ' + self.sim_experiment.name + '\n')
-			self.sim_results.write(';Created: ' + self.sim_experiment.date + '\n')
-			self.sim_results.write(';Comment: ' + self.sim_experiment.description + '\n')
-			self.sim_results.write(';PI: ' + self.sim_experiment.author + '\n')
-			self.sim_results.write(';b0: ' + str(self.sim_experiment.b0) + '\n')
-			self.sim_results.write(';' + str(int(np.size(self.insysfiles)+int(np.size(self.macromolecules)))) + ' Metabolites: ' + str(self.insysfiles).replace('[','').replace(']','').replace('\'','').replace('.sys',''))
-			if self.macroIncludeButton.isChecked(): self.sim_results.write(', ' + str(self.macromolecules).replace('[','').replace(']','').replace('\'',''))
-			self.sim_results.write('\n')
-
-			self.sim_results.write(';Simulation Results\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
+			write_results_header(self.sim_results, self.sim_experiment, self.insysfiles, self.macromolecules, self.macroIncludeButton.isChecked())
 
 			# Set up for calibration experiments
-			insysfile = str(self.calibrationMetaboliteComboBox.currentText()) + '.sys'
-			if self.sim_experiment.b0 == 123.3:
-				insysfile = 'pints/metabolites/3T_' + insysfile
-			elif self.sim_experiment.b0 == 297.2:
-				insysfile = 'pints/metabolites/7T_' + insysfile
-			elif self.sim_experiment.b0 == 400.2:
-				insysfile = 'pints/metabolites/9.4T_' + insysfile
-			print('')
-			print(insysfile)
+			insysfile = sysfile_path(str(self.calibrationMetaboliteComboBox.currentText()) + '.sys', self.sim_experiment.b0)
 
-			spin_system = pg.spin_system()
-			spin_system.read(insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
+			spin_system = read_spin_system(insysfile, self.sim_experiment.RF_OFFSET, self.sim_experiment.backend, self.sim_experiment.reduce_spin_systems)
 
 			# Run the 180 calibration
 			self.simConsole.append('\n1. 180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			A180_calibration_data = []
-
-			for A_180 in self.sim_experiment.A_180s:
-
-				TE = self.sim_experiment.TE * 1E-3
-				TE1 = self.sim_experiment.TE1 * 1E-3
-				TE2 = self.sim_experiment.TE2 * 1E-3
-
-				# build 90 degree pulse
-				pulse_dur_90 = 0
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.slaser_build180(self.sim_experiment.inpulse180file, A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'bruker')
-
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = TE1/2.0 - pulse_dur_90/2.0 - pulse_dur_180/2.0
-				delay2 = TE1/2.0 + TE2/2.0 - pulse_dur_180
-				delay3 = TE2 - pulse_dur_180
-				delay4 = delay2
-				delay5 = TE1/2.0 - pulse_dur_180 + self.sim_experiment.DigShift
-
-				# TE_fill = TE - 2.*TE1 - 2.*TE2
-				# delay1 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay2 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay3 = TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay4 = TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay5 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + self.sim_experiment.DigShift
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-
-				sigma0 = pg.sigma_eq(spin_system)	# init
-				sigma1 = pg.Ixpuls(spin_system, sigma0, self.sim_experiment.obs_iso, 90.0)		# apply ideal 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib180 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox.currentText()), A_180, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib180.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A180_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a logistic function
-			initial_guess_A = np.amin(A180_calibration_data)
-			initial_guess_B = np.abs(np.amax(A180_calibration_data)-np.amin(A180_calibration_data))/np.abs(A180_calibration_data[np.argmax(A180_calibration_data)]-A180_calibration_data[np.argmin(A180_calibration_data)])
-			initial_guess_K = np.amax(A180_calibration_data)
-			initial_guess_s = self.sim_experiment.A_180s[np.argmin(A180_calibration_data)]
-			fit_x = self.sim_experiment.A_180s
-			fit_y = np.pad(A180_calibration_data[np.argmin(A180_calibration_data):], (np.size(A180_calibration_data[:np.argmin(A180_calibration_data)]), 0), 'constant', constant_values=(np.amin(A180_calibration_data),0))
-			params, params_covariance = sp.optimize.curve_fit(self.logs_func, fit_x, fit_y, p0=[initial_guess_A,initial_guess_B,initial_guess_K, initial_guess_s])#, bounds=([-np.inf, 0, 0, 0], [0, np.inf, np.inf, self.sim_experiment.A_180s[-1]]))
-			self.simConsole.append('       | A + (K - A)/(1 + np.exp(-B*x)): ')
-			self.simConsole.append('       | A0 = ' + str(initial_guess_A) + ', B0 = ' + str(initial_guess_B) + ', K0 = ' + str(initial_guess_K) + ', s0 = ' + str(initial_guess_s))
-			self.simConsole.append('       | A = ' + str(params[0]) + ', B = ' + str(params[1]) + ', K = ' + str(params[2]) + ', s = ' + str(params[3]))
-			A180_calibration_data_init   = self.logs_func(self.sim_experiment.A_180s, initial_guess_A, initial_guess_B, initial_guess_K, initial_guess_s)
-			A180_calibration_data_fitted = self.logs_func(self.sim_experiment.A_180s, params[0], params[1], params[2], params[3])
-
-			# save results
-			if self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) < self.sim_experiment.A_180s[-1]:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) # pad to be sure of adiabicity
-			else:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()]
-
-			plt.figure()
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_init, color='green')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()]*1.2, str(self.sim_experiment.A_180), rotation='vertical', color='black')
-			plt.title('180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			plt.xlabel('A_180 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A180_calibration_data) + 0.25*np.amin(A180_calibration_data),np.amax(A180_calibration_data) + 0.25*np.amax(A180_calibration_data)])
-			plt.savefig(self.save_dir_sim + '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			self.sim_experiment.A_180 = self.calibratePlateau(insysfile, str(self.calibrationMetaboliteComboBox.currentText()), 180, self.sim_experiment.A_180s, None, '180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment', 'A_180 [mT]', '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
 
 			# update progress bar
 			self.simProgressBar.setValue(1)
@@ -668,87 +424,8 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 			# Run the 90 calibration
 			self.simConsole.append('\n2. 90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			A90_calibration_data = []
-
-			for A_90 in self.sim_experiment.A_90s:
-
-				TE = self.sim_experiment.TE * 1E-3
-				TE1 = self.sim_experiment.TE1 * 1E-3
-				TE2 = self.sim_experiment.TE2 * 1E-3
-
-				# build 90 degree pulse
-				A_90, pulse90, pulse_dur_90, peak_to_end_90, Ureal90 = self.slaser_build90(self.sim_experiment.inpulse90file, A_90, self.sim_experiment.PULSE_90_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'bruker')
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.slaser_build180(self.sim_experiment.inpulse180file, A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'bruker')
-
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = TE1/2.0 - pulse_dur_90/2.0 - pulse_dur_180/2.0
-				delay2 = TE1/2.0 + TE2/2.0 - pulse_dur_180
-				delay3 = TE2 - pulse_dur_180
-				delay4 = delay2
-				delay5 = TE1/2.0 - pulse_dur_180 + self.sim_experiment.DigShift
-
-				# TE_fill = TE - 2.*TE1 - 2.*TE2
-				# delay1 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 - pulse_dur_90/2.0
-				# delay2 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay3 = TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay4 = TE2/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0
-				# delay5 = TE1/2.0 - pulse_dur_180/2.0 + TE_fill/8.0 + self.sim_experiment.DigShift
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-
-				sigma0 = pg.sigma_eq(spin_system)	# init
-				sigma1 = Ureal90.evolve(sigma0)		# apply 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib90 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox.currentText()), A_90, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib90.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A90_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a sine function
-			fitted_sine     = self.fit_sin(self.sim_experiment.A_90s, A90_calibration_data)
-			params          = [fitted_sine[key] for key in fitted_sine.keys()]
-			self.simConsole.append('       | A * sin(w*x + p) + c:')
-			self.simConsole.append('       | A = ' + str(params[0]) + ', w = ' + str(params[1]) + ', p = ' + str(params[2]) + ', c = ' + str(params[3]))
-			A90_calibration_data_fitted = self.sinfunc(self.sim_experiment.A_90s, params[0], params[1], params[2], params[3])
-
-			# save results
-			self.sim_experiment.A_90 = self.sim_experiment.A_90s[np.argmax(A90_calibration_data_fitted)]
-			plt.figure()
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()]*1.2, str(self.sim_experiment.A_90), rotation='vertical', color='black')
-			plt.title('90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			plt.xlabel('A_90 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A90_calibration_data) + 0.25*np.amin(A90_calibration_data),np.amax(A90_calibration_data) + 0.25*np.amax(A90_calibration_data)])
-			plt.savefig(self.save_dir_sim + '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			# AFPs at the last amplitude of the 180 sweep
+			self.sim_experiment.A_90 = self.calibrateMaximum(insysfile, str(self.calibrationMetaboliteComboBox.currentText()), 90, self.sim_experiment.A_90s, self.sim_experiment.A_180s[-1], '90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment', 'A_90 [mT]', '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
 
 			self.simConsole.append('       | CALIBRATED 90 SLR AMPLITUDE: ' + str(self.sim_experiment.A_90))
 
@@ -757,142 +434,23 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		elif self.sLASERradioButton.isChecked():
 			
 			# Create a new simulations results file
-			self.save_dir_sim = 'pints/experiments/sLASER_sim_siemens_' \
-								+ datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S") \
-								+ '_TE' + str(self.sim_experiment.TE)
-			
-			if self.T7Button.isChecked():
-				self.save_dir_sim += '_7T/'
-			elif self.T3Button.isChecked():
-				self.save_dir_sim += '_3T/'
-			elif self.T9Button.isChecked():
-				self.save_dir_sim += '_9T/'
+			self.save_dir_sim = results_dir('pints/experiments', self.sim_experiment, datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S"))
 
 			if not os.path.exists(self.save_dir_sim):
 				os.makedirs(self.save_dir_sim)
-			self.sim_results = open(self.save_dir_sim + 'sLASER_sim_results.txt', 'w')
+			self.sim_results = open(self.save_dir_sim + results_filename(self.sim_experiment), 'w')
 
 			# Write parameters in file
-			self.sim_results.write(';PINTS for FITMAN Simulation Output\n')
-			self.sim_results.write(';Experiment Information\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
-			self.sim_results.write(';Name: ' + self.sim_experiment.name + '\n')
-			self.sim_results.write(';Created: ' + self.sim_experiment.date + '\n')
-			self.sim_results.write(';Comment: ' + self.sim_experiment.description + '\n')
-			self.sim_results.write(';PI: ' + self.sim_experiment.author + '\n')
-			self.sim_results.write(';b0: ' + str(self.sim_experiment.b0) + '\n')
-			self.sim_results.write(';' + str(int(np.size(self.insysfiles)+int(np.size(self.macromolecules)))) + ' Metabolites: ' + str(self.insysfiles).replace('[','').replace(']','').replace('\'','').replace('.sys',''))
-			if self.macroIncludeButton.isChecked(): self.sim_results.write(', ' + str(self.macromolecules).replace('[','').replace(']','').replace('\'',''))
-			self.sim_results.write('\n')
-
-			self.sim_results.write(';Simulation Results\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
+			write_results_header(self.sim_results, self.sim_experiment, self.insysfiles, self.macromolecules, self.macroIncludeButton.isChecked())
 
 			# Set up for calibration experiments
-			insysfile = str(self.calibrationMetaboliteComboBox.currentText()) + '.sys'
-			if self.sim_experiment.b0 == 123.3:
-				insysfile = 'pints/metabolites/3T_' + insysfile
-			elif self.sim_experiment.b0 == 297.2:
-				insysfile = 'pints/metabolites/7T_' + insysfile
-			elif self.sim_experiment.b0 == 400.2:
-				insysfile = 'pints/metabolites/9.4T_' + insysfile
-			print('')
-			print(insysfile)
+			insysfile = sysfile_path(str(self.calibrationMetaboliteComboBox.currentText()) + '.sys', self.sim_experiment.b0)
 
-			spin_system = pg.spin_system()
-			spin_system.read(insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
+			spin_system = read_spin_system(insysfile, self.sim_experiment.RF_OFFSET, self.sim_experiment.backend, self.sim_experiment.reduce_spin_systems)
 
 			# Run the 180 calibration
 			self.simConsole.append('\n1. 180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			A180_calibration_data = []
-
-			for A_180 in self.sim_experiment.A_180s:
-
-				TE = self.sim_experiment.TE
-				TE1 = float((TE * 0.31) / 1000.0)
-				TE3 = float((TE * 0.31) / 1000.0)
-				TE2 = float(TE/1000.0 - TE1 - TE3)
-				TE_fill = TE/1000.0 - TE1 - TE2 - TE3
-
-				# build 90 degree pulse
-				peak_to_end_90 = 0
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.slaser_build180(self.sim_experiment.inpulse180file, A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'siemens')
-
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = TE1/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0 - peak_to_end_90
-				delay2 = TE1/2.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-				delay3 = TE2/4.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-				delay4 = TE2/4.0 + TE_fill/8.0 + TE3/2.0 + TE_fill/8.0 - pulse_dur_180
-				delay5 = TE3/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-
-				sigma0 = pg.sigma_eq(spin_system)	# init
-				sigma1 = pg.Ixpuls(spin_system, sigma0, self.sim_experiment.obs_iso, 90.0)		# apply ideal 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib180 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox.currentText()), A_180, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib180.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A180_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a logistic function
-			initial_guess_A = np.amin(A180_calibration_data)
-			initial_guess_B = np.abs(np.amax(A180_calibration_data)-np.amin(A180_calibration_data))/np.abs(A180_calibration_data[np.argmax(A180_calibration_data)]-A180_calibration_data[np.argmin(A180_calibration_data)])
-			initial_guess_K = np.amax(A180_calibration_data)
-			initial_guess_s = self.sim_experiment.A_180s[np.argmin(A180_calibration_data)]
-			fit_x = self.sim_experiment.A_180s
-			fit_y = np.pad(A180_calibration_data[np.argmin(A180_calibration_data):], (np.size(A180_calibration_data[:np.argmin(A180_calibration_data)]), 0), 'constant', constant_values=(np.amin(A180_calibration_data),0))
-			params, params_covariance = sp.optimize.curve_fit(self.logs_func, fit_x, fit_y, p0=[initial_guess_A,initial_guess_B,initial_guess_K, initial_guess_s])#, bounds=([-np.inf, 0, 0, 0], [0, np.inf, np.inf, self.sim_experiment.A_180s[-1]]))
-			self.simConsole.append('       | A + (K - A)/(1 + np.exp(-B*x)): ')
-			self.simConsole.append('       | A0 = ' + str(initial_guess_A) + ', B0 = ' + str(initial_guess_B) + ', K0 = ' + str(initial_guess_K) + ', s0 = ' + str(initial_guess_s))
-			self.simConsole.append('       | A = ' + str(params[0]) + ', B = ' + str(params[1]) + ', K = ' + str(params[2]) + ', s = ' + str(params[3]))
-			A180_calibration_data_init   = self.logs_func(self.sim_experiment.A_180s, initial_guess_A, initial_guess_B, initial_guess_K, initial_guess_s)
-			A180_calibration_data_fitted = self.logs_func(self.sim_experiment.A_180s, params[0], params[1], params[2], params[3])
-
-			# save results
-			if self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) < self.sim_experiment.A_180s[-1]:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) # pad to be sure of adiabicity
-			else:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()]
-			plt.figure()
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_init, color='green')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()]*1.2, str(self.sim_experiment.A_180), rotation='vertical', color='black')
-			plt.title('180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			plt.xlabel('A_180 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A180_calibration_data) + 0.25*np.amin(A180_calibration_data),np.amax(A180_calibration_data) + 0.25*np.amax(A180_calibration_data)])
-			plt.savefig(self.save_dir_sim + '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			self.sim_experiment.A_180 = self.calibratePlateau(insysfile, str(self.calibrationMetaboliteComboBox.currentText()), 180, self.sim_experiment.A_180s, None, '180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment', 'A_180 [mT]', '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
 
 			# update progress bar
 			self.simProgressBar.setValue(1)
@@ -903,81 +461,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 			# Run the 90 calibration
 			self.simConsole.append('\n2. 90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			A90_calibration_data = []
-
-			for A_90 in self.sim_experiment.A_90s:
-				TE = self.sim_experiment.TE
-				TE1 = float((TE * 0.31) / 1000.0)
-				TE3 = float((TE * 0.31) / 1000.0)
-				TE2 = float(TE/1000.0 - TE1 - TE3)
-				TE_fill = TE/1000.0 - TE1 - TE2 - TE3
-
-				# build 90 degree pulse
-				A_90, pulse90, pulse_dur_90, peak_to_end_90, Ureal90 = self.slaser_build90(self.sim_experiment.inpulse90file, A_90, self.sim_experiment.PULSE_90_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'siemens')
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.slaser_build180(self.sim_experiment.inpulse180file, self.sim_experiment.A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False, 'siemens')
-
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = TE1/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0 - peak_to_end_90
-				delay2 = TE1/2.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-				delay3 = TE2/4.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-				delay4 = TE2/4.0 + TE_fill/8.0 + TE3/2.0 + TE_fill/8.0 - pulse_dur_180
-				delay5 = TE3/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-
-				sigma0 = pg.sigma_eq(spin_system)							# init
-				sigma1 = Ureal90.evolve(sigma0)								# apply 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib90 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox.currentText()), A_90, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib90.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A90_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a sine function
-			fitted_sine     = self.fit_sin(self.sim_experiment.A_90s, A90_calibration_data)
-			params          = [fitted_sine[key] for key in fitted_sine.keys()]
-			self.simConsole.append('       | A * sin(w*x + p) + c:')
-			self.simConsole.append('       | A = ' + str(params[0]) + ', w = ' + str(params[1]) + ', p = ' + str(params[2]) + ', c = ' + str(params[3]))
-			A90_calibration_data_fitted = self.sinfunc(self.sim_experiment.A_90s, params[0], params[1], params[2], params[3])
-
-			# save results
-			self.sim_experiment.A_90 = self.sim_experiment.A_90s[np.argmax(A90_calibration_data_fitted)]
-			plt.figure()
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()]*1.2, str(self.sim_experiment.A_90), rotation='vertical', color='black')
-			plt.title('90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment')
-			plt.xlabel('A_90 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A90_calibration_data) + 0.25*np.amin(A90_calibration_data),np.amax(A90_calibration_data) + 0.25*np.amax(A90_calibration_data)])
-			plt.savefig(self.save_dir_sim + '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			self.sim_experiment.A_90 = self.calibrateMaximum(insysfile, str(self.calibrationMetaboliteComboBox.currentText()), 90, self.sim_experiment.A_90s, self.sim_experiment.A_180, '90-degree calibration sLASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox.currentText()) + ') experiment', 'A_90 [mT]', '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
 
 			self.simConsole.append('       | CALIBRATED 90 SLR AMPLITUDE: ' + str(self.sim_experiment.A_90))
 
@@ -986,159 +470,23 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		elif self.LASERradioButton.isChecked():
 			
 			# Create a new simulations results file
-			self.save_dir_sim = 'pints/experiments/LASER_sim_' \
-								+ datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S") \
-								+ '_TE' + str(self.sim_experiment.TE)
-			
-			if self.T7Button.isChecked():
-				self.save_dir_sim += '_7T/'
-			elif self.T3Button.isChecked():
-				self.save_dir_sim += '_3T/'
-			elif self.T9Button.isChecked():
-				self.save_dir_sim += '_9T/'
+			self.save_dir_sim = results_dir('pints/experiments', self.sim_experiment, datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S"))
 
 			if not os.path.exists(self.save_dir_sim):
 				os.makedirs(self.save_dir_sim)
-			self.sim_results = open(self.save_dir_sim + 'LASER_sim_results.txt', 'w')
+			self.sim_results = open(self.save_dir_sim + results_filename(self.sim_experiment), 'w')
 
 			# Write parameters in file
-			self.sim_results.write(';PINTS for FITMAN Simulation Output\n')
-			self.sim_results.write(';Experiment Information\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
-			self.sim_results.write(';Name: ' + self.sim_experiment.name + '\n')
-			self.sim_results.write(';Created: ' + self.sim_experiment.date + '\n')
-			self.sim_results.write(';Comment: ' + self.sim_experiment.description + '\n')
-			self.sim_results.write(';PI: ' + self.sim_experiment.author + '\n')
-			self.sim_results.write(';b0: ' + str(self.sim_experiment.b0) + '\n')
-			self.sim_results.write(';' + str(int(np.size(self.insysfiles)+int(np.size(self.macromolecules)))) + ' Metabolites: ' + str(self.insysfiles).replace('[','').replace(']','').replace('\'','').replace('.sys',''))
-			if self.macroIncludeButton.isChecked(): self.sim_results.write(', ' + str(self.macromolecules).replace('[','').replace(']','').replace('\'',''))
-			self.sim_results.write('\n')
-
-			self.sim_results.write(';Simulation Results\n')
-			self.sim_results.write(';---------------------------------------------------------------------------\n')
+			write_results_header(self.sim_results, self.sim_experiment, self.insysfiles, self.macromolecules, self.macroIncludeButton.isChecked())
 
 			# Set up for calibration experiments
-			insysfile = str(self.calibrationMetaboliteComboBox_laser.currentText()) + '.sys'
-			if self.sim_experiment.b0 == 123.3:
-				insysfile = 'pints/metabolites/3T_' + insysfile
-			elif self.sim_experiment.b0 == 297.2:
-				insysfile = 'pints/metabolites/7T_' + insysfile
-			elif self.sim_experiment.b0 == 400.2:
-				insysfile = 'pints/metabolites/9.4T_' + insysfile
-
-			spin_system = pg.spin_system()
-			spin_system.read(insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
+			insysfile = sysfile_path(str(self.calibrationMetaboliteComboBox_laser.currentText()) + '.sys', self.sim_experiment.b0)
+
+			spin_system = read_spin_system(insysfile, self.sim_experiment.RF_OFFSET, self.sim_experiment.backend, self.sim_experiment.reduce_spin_systems)
 
 			# Run the 180 calibration
 			self.simConsole.append('\n1. 180-degree calibration LASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox_laser.currentText())  + ') experiment')
-			A180_calibration_data = []
-
-			for A_180 in self.sim_experiment.A_180s:
-
-				# build 90 degree pulse
-				pulse_dur_90 = 0
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.laser_buildafp(self.sim_experiment.inpulse180file, A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False)
-
-				# calculate pulse timings
-				ROF1 = 100E-6   #sec
-				ROF2 = 10E-6    #sec
-				TCRUSH1 = 0.0008 #sec
-				TCRUSH2 = 0.0008 #sec
-
-				ss_grad_rfDelayFront = TCRUSH1 - ROF1
-				ss_grad_rfDelayBack  = TCRUSH2 - ROF2
-				ro_grad_atDelayFront = 0
-				ro_grad_atDelayBack  = 0
-
-				TE  = self.sim_experiment.TE / 1000.
-				ipd = (TE - pulse_dur_90 \
-						  - 6*(ss_grad_rfDelayFront + pulse_dur_180 + ss_grad_rfDelayBack) \
-						  - ro_grad_atDelayFront) / 12
-
-				# initialize acquisition
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = ipd + ss_grad_rfDelayFront
-				delay2 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay3 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay4 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay5 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay6 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay7 = ss_grad_rfDelayBack + ipd + ro_grad_atDelayFront
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-				Udelay6 = pg.prop(H, delay6)
-				Udelay7 = pg.prop(H, delay7)
-
-				sigma0 = pg.sigma_eq(spin_system)	# init
-				sigma1 = pg.Ixpuls(spin_system, sigma0, self.sim_experiment.obs_iso, 90.0)		# apply ideal 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP5
-				sigma0 = pg.evolve(sigma1, Udelay6)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP6
-				sigma0 = pg.evolve(sigma1, Udelay7)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib180 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox_laser.currentText()), A_180, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib180.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A180_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a logistic function
-			initial_guess_A = np.amin(A180_calibration_data)
-			initial_guess_B = np.abs(np.amax(A180_calibration_data)-np.amin(A180_calibration_data))/np.abs(A180_calibration_data[np.argmax(A180_calibration_data)]-A180_calibration_data[np.argmin(A180_calibration_data)])
-			initial_guess_K = np.amax(A180_calibration_data)
-			initial_guess_s = self.sim_experiment.A_180s[np.argmin(A180_calibration_data)]
-			fit_x = self.sim_experiment.A_180s
-			fit_y = np.pad(A180_calibration_data[np.argmin(A180_calibration_data):], (np.size(A180_calibration_data[:np.argmin(A180_calibration_data)]), 0), 'constant', constant_values=(np.amin(A180_calibration_data),0))
-			params, params_covariance = sp.optimize.curve_fit(self.logs_func, fit_x, fit_y, p0=[initial_guess_A,initial_guess_B,initial_guess_K, initial_guess_s])#, bounds=([-np.inf, 0, 0, 0], [0, np.inf, np.inf, self.sim_experiment.A_180s[-1]]))
-			self.simConsole.append('       | A + (K - A)/(1 + np.exp(-B*x)): ')
-			self.simConsole.append('       | A0 = ' + str(initial_guess_A) + ', B0 = ' + str(initial_guess_B) + ', K0 = ' + str(initial_guess_K) + ', s0 = ' + str(initial_guess_s))
-			self.simConsole.append('       | A = ' + str(params[0]) + ', B = ' + str(params[1]) + ', K = ' + str(params[2]) + ', s = ' + str(params[3]))
-			A180_calibration_data_init   = self.logs_func(self.sim_experiment.A_180s, initial_guess_A, initial_guess_B, initial_guess_K, initial_guess_s)
-			A180_calibration_data_fitted = self.logs_func(self.sim_experiment.A_180s, params[0], params[1], params[2], params[3])
-
-			# save results
-			if self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) < self.sim_experiment.A_180s[-1]:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_180s[-1]/6) # pad to be sure of adiabicity
-			else:
-				self.sim_experiment.A_180 = self.sim_experiment.A_180s[(np.abs(np.asarray(fit_y)-params[2])).argmin()]
-			plt.figure()
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_init, color='green')
-			plt.plot(self.sim_experiment.A_180s, A180_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_180, A180_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_180s)-self.sim_experiment.A_180)).argmin()]*1.2, str(self.sim_experiment.A_180), rotation='vertical', color='black')
-			plt.title('180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox_laser.currentText()) + ') experiment')
-			plt.xlabel('A_180 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A180_calibration_data) + 0.25*np.amin(A180_calibration_data),np.amax(A180_calibration_data) + 0.25*np.amax(A180_calibration_data)])
-			plt.savefig(self.save_dir_sim + '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			self.sim_experiment.A_180 = self.calibratePlateau(insysfile, str(self.calibrationMetaboliteComboBox_laser.currentText()), 180, self.sim_experiment.A_180s, None, '180-degree calibration sLASER (w/ ideal 90, ' + str(self.calibrationMetaboliteComboBox_laser.currentText()) + ') experiment', 'A_180 [mT]', '180-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
 
 			# update progress bar
 			self.simProgressBar.setValue(1)
@@ -1149,112 +497,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 			# Run the 90 calibration
 			self.simConsole.append('\n2. 90-degree calibration LASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox_laser.currentText()) + ') experiment')
-			A90_calibration_data = []
-
-			for A_90 in self.sim_experiment.A_90s:
-
-				# build 90 degree pulse
-				A_90, pulse90, pulse_dur_90, Ureal90 = self.laser_buildahp(self.sim_experiment.inpulse90file, A_90, self.sim_experiment.PULSE_90_LENGTH, self.sim_experiment.getGyratio(), spin_system, False)
-
-				# build 180 degree pulse
-				A_180, pulse180, pulse_dur_180, Ureal180 = self.laser_buildafp(self.sim_experiment.inpulse180file, self.sim_experiment.A_180, self.sim_experiment.PULSE_180_LENGTH, self.sim_experiment.getGyratio(), spin_system, False)
-
-				# calculate pulse timings
-				ROF1 = 100E-6   #sec
-				ROF2 = 10E-6    #sec
-				TCRUSH1 = 0.0008 #sec
-				TCRUSH2 = 0.0008 #sec
-
-				ss_grad_rfDelayFront = TCRUSH1 - ROF1
-				ss_grad_rfDelayBack  = TCRUSH2 - ROF2
-				ro_grad_atDelayFront = 0
-				ro_grad_atDelayBack  = 0
-
-				TE  = self.sim_experiment.TE / 1000.
-				ipd = (TE - pulse_dur_90 \
-						  - 6*(ss_grad_rfDelayFront + pulse_dur_180 + ss_grad_rfDelayBack) \
-						  - ro_grad_atDelayFront) / 12
-
-				# initialize acquisition
-				H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-				D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-				ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-				ACQ = ac
-
-				delay1 = ipd + ss_grad_rfDelayFront
-				delay2 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay3 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay4 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay5 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay6 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-				delay7 = ss_grad_rfDelayBack + ipd + ro_grad_atDelayFront
-
-				Udelay1 = pg.prop(H, delay1)
-				Udelay2 = pg.prop(H, delay2)
-				Udelay3 = pg.prop(H, delay3)
-				Udelay4 = pg.prop(H, delay4)
-				Udelay5 = pg.prop(H, delay5)
-				Udelay6 = pg.prop(H, delay6)
-				Udelay7 = pg.prop(H, delay7)
-
-				sigma0 = pg.sigma_eq(spin_system)	# init
-				sigma1 = Ureal90.evolve(sigma0)		# apply 90-degree pulse
-				sigma0 = pg.evolve(sigma1, Udelay1)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-				sigma0 = pg.evolve(sigma1, Udelay2)
-				sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-				sigma0 = pg.evolve(sigma1, Udelay3)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-				sigma0 = pg.evolve(sigma1, Udelay4)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-				sigma0 = pg.evolve(sigma1, Udelay5)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP5
-				sigma0 = pg.evolve(sigma1, Udelay6)
-				sigma1 = Ureal180.evolve(sigma0) 	# apply AFP6
-				sigma0 = pg.evolve(sigma1, Udelay7)
-
-				# acquire
-				mx = pg.TTable1D(ACQ.table(sigma0))
-
-				# binning to remove degenerate peaks
-				outf, outa, outp = self.binning_code(mx, self.sim_experiment.b0, spin_system, self.sim_experiment.obs_iso, self.sim_experiment.tolppm, self.sim_experiment.tolpha, self.sim_experiment.ppmlo, self.sim_experiment.ppmhi, self.sim_experiment.RF_OFFSET)
-
-				metab_calib90 = self.apply_metab_properties(str(self.calibrationMetaboliteComboBox_laser.currentText()), A_90, outf, outa, outp, insysfile)
-				lb = 15 if (self.sim_experiment.b0 == 297.2 or self.sim_experiment.b0 == 400.2) else 6
-				f, spectra = metab_calib90.getSpec(TE, self.sim_experiment.b0, self.sim_experiment.getTime(), 0, 1, 0, 0, lb, self.sim_experiment.getFs())
-
-				A90_calibration_data.append(np.real(spectra)[np.argmax(np.abs(spectra))])
-
-			# Fit a logistic function
-			initial_guess_A = 0 # np.amin(A90_calibration_data)
-			initial_guess_B = np.abs(np.amax(A90_calibration_data)-np.amin(A90_calibration_data))/np.abs(A90_calibration_data[np.argmax(A90_calibration_data)]-A90_calibration_data[np.argmin(A90_calibration_data)])
-			initial_guess_K = np.amax(A90_calibration_data)
-			initial_guess_s = self.sim_experiment.A_90s[np.argmin(A90_calibration_data)]
-			fit_x = self.sim_experiment.A_90s
-			fit_y = np.pad(A90_calibration_data[np.argmin(A90_calibration_data):], (np.size(A90_calibration_data[:np.argmin(A90_calibration_data)]), 0), 'constant', constant_values=(np.amin(A90_calibration_data),0))
-			params, params_covariance = sp.optimize.curve_fit(self.logs_func, fit_x, fit_y, p0=[initial_guess_A,initial_guess_B,initial_guess_K, initial_guess_s])#, bounds=([-np.inf, 0, 0, 0], [0, np.inf, np.inf, self.sim_experiment.A_90s[-1]]))
-			self.simConsole.append('       | A + (K - A)/(1 + np.exp(-B*x)): ')
-			self.simConsole.append('       | A0 = ' + str(initial_guess_A) + ', B0 = ' + str(initial_guess_B) + ', K0 = ' + str(initial_guess_K) + ', s0 = ' + str(initial_guess_s))
-			self.simConsole.append('       | A = ' + str(params[0]) + ', B = ' + str(params[1]) + ', K = ' + str(params[2]) + ', s = ' + str(params[3]))
-			A90_calibration_data_init   = self.logs_func(self.sim_experiment.A_90s, initial_guess_A, initial_guess_B, initial_guess_K, initial_guess_s)
-			A90_calibration_data_fitted = self.logs_func(self.sim_experiment.A_90s, params[0], params[1], params[2], params[3])
-
-			# save results
-			if self.sim_experiment.A_90s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_90s[-1]/6) < self.sim_experiment.A_90s[-1]:
-				self.sim_experiment.A_90 = self.sim_experiment.A_90s[(np.abs(np.asarray(fit_y)-params[2])).argmin()] + int(self.sim_experiment.A_90s[-1]/6) # pad to be sure of adiabicity
-			else:
-				self.sim_experiment.A_90 = self.sim_experiment.A_90s[(np.abs(np.asarray(fit_y)-params[2])).argmin()]
-			plt.figure()
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data, '.', color='blue')
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data_init, color='green')
-			plt.plot(self.sim_experiment.A_90s, A90_calibration_data_fitted, color='red')
-			plt.plot(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()], 'x', color='black')
-			plt.text(self.sim_experiment.A_90, A90_calibration_data[(np.abs(np.asarray(self.sim_experiment.A_90s)-self.sim_experiment.A_90)).argmin()]*1.2, str(self.sim_experiment.A_90), rotation='vertical', color='black')
-			plt.title('90-degree calibration LASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox_laser.currentText()) + ') experiment')
-			plt.xlabel('A_90 [mT]')
-			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(A90_calibration_data) + 0.25*np.amin(A90_calibration_data),np.amax(A90_calibration_data) + 0.25*np.amax(A90_calibration_data)])
-			plt.savefig(self.save_dir_sim + '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf')
-			plt.close()
+			self.sim_experiment.A_90 = self.calibratePlateau(insysfile, str(self.calibrationMetaboliteComboBox_laser.currentText()), 90, self.sim_experiment.A_90s, self.sim_experiment.A_180, '90-degree calibration LASER (w/ AFP 180, ' + str(self.calibrationMetaboliteComboBox_laser.currentText()) + ') experiment', 'A_90 [mT]', '90-DEGREE-CALIBRATION' + '_' + str(self.sim_experiment.PULSE_180_LENGTH) + 'secAFP.pdf', 0)
 
 			self.simConsole.append('       | CALIBRATED 90 AHP AMPLITUDE: ' + str(self.sim_experiment.A_90))
 
@@ -1264,324 +507,138 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 		self.simConsole.append('\n3. Density Matrix Simulations of Metabolites')
 
-		self.thread_pool = self.tree()
-		self.sim_objects = self.tree()
-
-		self.youngest_thread = 0
-		self.threads_processed = 0
-
-		for (i, insysfile) in enumerate(self.insysfiles):
-
-			# create a new thread to simulate metabolite
-			simulation_thread = QtCore.QThread()
-			self.thread_pool[i] = simulation_thread
-
-			# create a new simulation
-			simulation = MetaboliteSimulation(i, insysfile, self.sim_experiment)
-			self.sim_objects[i] = simulation
-
-			# events to output to console
-			self.sim_objects[i].postToConsole.connect(self.postToConsole)
+		# simulate all metabolites in a pool of worker processes
+		self.sim_thread = QtCore.QThread()
+		self.sim_pool = SimulationPool(self.insysfiles, self.sim_experiment)
 
-			# events to output results
-			self.sim_objects[i].outputResults.connect(self.outputResults)
+		# events to output to console
+		self.sim_pool.postToConsole.connect(self.postToConsole)
 
-			# events to signal that simulation is complete
-			self.sim_objects[i].finished.connect(self.simFinished)
+		# events to output results
+		self.sim_pool.outputResults.connect(self.outputResults)
 
-			self.sim_objects[i].moveToThread(self.thread_pool[i])
-			self.thread_pool[i].started.connect(self.sim_objects[i].simulate)
+		# events to signal that a metabolite is complete
+		self.sim_pool.finished.connect(self.simFinished)
+		self.sim_pool.allFinished.connect(self.sim_thread.quit)
 
-		self.startThreads()
+		self.sim_pool.moveToThread(self.sim_thread)
+		self.sim_thread.started.connect(self.sim_pool.simulate)
+		self.sim_thread.start()
 
 	# ---- Methods for Simulation ---- #
 	def tree(self): return defaultdict(self.tree)
 
-	def startThreads(self):
-		if self.youngest_thread + 3 > len(self.insysfiles)-1:
-			for i in range(self.youngest_thread, len(self.insysfiles)):
-				self.thread_pool[i].start()
-		else:
-			self.thread_pool[self.youngest_thread + 3].start()
-			self.thread_pool[self.youngest_thread + 2].start()
-			self.thread_pool[self.youngest_thread + 1].start()
-			self.thread_pool[self.youngest_thread + 0].start()
-
-	def simFinished(self, thread_num):
-		self.thread_pool[thread_num].quit()
-		self.threads_processed = self.threads_processed + 1
+	def simFinished(self, metab_num):
 		self.simProgressBar.setValue(self.simProgressBar.value() + 1)
 
 		if self.simProgressBar.value() == self.simProgressBar.maximum():
 			
 			if self.macroIncludeButton.isChecked():
 				# add lipids
-				for lipid in self.macromolecules:
-					macromolecule = self.macromolecules_data[lipid]
-					# name, TE, A_m, shift, line_type, lw, area, phase
-					self.sim_results.write(macromolecule.name + '\t' + str(float(self.sim_experiment.TE)) \
-						+ '\t' + str(float(macromolecule.A_m)) + '\t' + str(float(macromolecule.ppm[0])) \
-						+ '\t' + str(macromolecule.line_type) + '\t' + str(macromolecule.lw) \
-						+ '\t' + str(macromolecule.area[0]) + '\t' + str(macromolecule.phase[0]) + '\n')
+				write_macromolecule_results(self.sim_results, self.macromolecules, self.macromolecules_data, self.sim_experiment.TE)
 
 			self.simConsole.append('  | Saving simulation data ...')
 			time.sleep(2)
 			self.sim_results.close()
 			self.simConsole.append('  | Simulation finished.')
 
+			# per-stage timings of the calibrations and metabolites
+			timings = {'calibration': self.calibration_timings, 'metabolites': self.sim_pool.timings}
+			timing.write(self.save_dir_sim + timings_filename(self.sim_experiment), timings)
+			self.simConsole.append('\n4. Timing')
+			for line in timing.summary(OrderedDict(list(self.calibration_timings.items()) + list(self.sim_pool.timings.items()))):
+				self.simConsole.append(line)
+
 			# save console output to text file
 			with open(self.save_dir_sim + 'console.txt', 'w') as console_output_file:
 				console_output_file.write(str(self.simConsole.toPlainText()))
 
 			self.confirmSimParamsButton.setEnabled(True)
 			self.runSimulationButton.setEnabled(False)
-		else:
-			if self.threads_processed == 4:
-				self.youngest_thread = self.youngest_thread + 4
-				self.threads_processed = 0
-				self.startThreads()
 
 	def postToConsole(self, string):
 		self.simConsole.append(string)
 
 	def outputResults(self, metabolite):
-		for (i, area) in enumerate(metabolite.area):
-			self.sim_results.write(metabolite.name + '\t' + str(float(self.sim_experiment.TE)) + '\t' + str(float(metabolite.A_m)) + '\t' + str(float(metabolite.T2)) + '\t' + str(i) + '\t' + str(metabolite.ppm[i]) + '\t' + str(metabolite.area[i]) + '\t' + str(metabolite.phase[i]) + '\n')
-
-	def binning_code(self, mx, b0, spin_system, obs_iso, tolppm, tolpha, ppmlo, ppmhi, rf_off):
-
-		# BINNING
-		# Note: Metabolite Peak Normalization and Blending
-
-		# The transition tables calculated by the GAMMA density matrix simulations frequently contain a
-		# large number of transitions caused by degenerate splittings and other processes. At the
-		# conclusion of each simulation run a routine is called to extract lines from the transition table.
-		# These lines are then normalized using a closed form calculation based on the number of spins.
-		# To reduce the number of lines required for display, multiple lines are blended by binning them
-		# together based on their PPM locations and phases. The following parameters are used to
-		# customize these procedures:
-
-		# Peak Search Range -- Low/High (PPM): the range in PPM that is searched for lines from the
-		# metabolite simulation.
-
-		# Peak Blending Tolerance (PPM and Degrees): the width of the bins (+/- in PPM and +/- in
-		# PhaseDegrees) that are used to blend the lines in the simulation. Lines that are included in the
-		# same bin are summed using complex addition based on Amplitude and Phase.
+		write_metabolite_results(self.sim_results, metabolite, self.sim_experiment.TE)
 
-		field  = b0
-		nspins = spin_system.spins()
+	def calibratePlateau(self, insysfile, metab_name, flip, amplitudes, A_fixed, title, xlabel, pdf_name, guess_A=None):
+		# Adiabatic pulses: find the amplitude where the signal reaches its plateau.
+		reports = []
+		if self.denseCalibrationButton.isChecked():
+			calibration_data = calibration_sweep(insysfile, metab_name, self.sim_experiment, flip, amplitudes, A_fixed, timings=reports)
 
-		nlines = mx.size()
+			# Fit a logistic function
+			A_cal, guess, params = plateau_fit(amplitudes, calibration_data, guess_A)
+			self.simConsole.append('       | A + (K - A)/(1 + np.exp(-B*x)): ')
+			self.simConsole.append('       | A0 = ' + str(guess[0]) + ', B0 = ' + str(guess[1]) + ', K0 = ' + str(guess[2]) + ', s0 = ' + str(guess[3]))
+			self.simConsole.append('       | A = ' + str(params[0]) + ', B = ' + str(params[1]) + ', K = ' + str(params[2]) + ', s = ' + str(params[3]))
+			calibration_data_init   = logs_func(amplitudes, *guess)
+			calibration_data_fitted = logs_func(amplitudes, *params)
+		else:
+			evaluated, calibration_data, A_cal = adaptive_calibration(insysfile, metab_name, self.sim_experiment, flip, amplitudes, A_fixed, 'plateau', timings=reports)
+			self.simConsole.append('       | adaptive search: ' + str(np.size(evaluated)) + ' of ' + str(np.size(amplitudes)) + ' amplitudes simulated')
 
-		tmp = pg.Isotope(obs_iso)
-		obs_qn = tmp.qn()
+		self.calibration_timings[title] = timing.merge(reports)
 
-		qnscale = 1.0
-		for i in range(nspins):
-			qnscale *= 2*spin_system.qn(i)+1
-		qnscale = qnscale / (2.0 * (2.0*obs_qn+1))
+		if A_cal + int(amplitudes[-1]/6) < amplitudes[-1]:
+			A_cal = A_cal + int(amplitudes[-1]/6) # pad to be sure of adiabicity
 
-		freqs = []
-		outf = []
-		outa = []
-		outp = []
-		nbin = 0
-		found = False
+		if self.denseCalibrationButton.isChecked():
+			plt.figure()
+			plt.plot(amplitudes, calibration_data, '.', color='blue')
+			plt.plot(amplitudes, calibration_data_init, color='green')
+			plt.plot(amplitudes, calibration_data_fitted, color='red')
+			plt.plot(A_cal, calibration_data[(np.abs(np.asarray(amplitudes)-A_cal)).argmin()], 'x', color='black')
+			plt.text(A_cal, calibration_data[(np.abs(np.asarray(amplitudes)-A_cal)).argmin()]*1.2, str(A_cal), rotation='vertical', color='black')
+			plt.title(title)
+			plt.xlabel(xlabel)
+			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(calibration_data) + 0.25*np.amin(calibration_data),np.amax(calibration_data) + 0.25*np.amax(calibration_data)])
+			plt.savefig(self.save_dir_sim + pdf_name)
+			plt.close()
 
-		PI = 3.14159265358979323846
-		RAD2DEG = 180.0/PI
+		return A_cal
 
-		indx = mx.Sort(0,-1,0)
+	def calibrateMaximum(self, insysfile, metab_name, flip, amplitudes, A_fixed, title, xlabel, pdf_name):
+		# Excitation pulses: find the amplitude with the largest signal.
+		reports = []
+		if self.denseCalibrationButton.isChecked():
+			calibration_data = calibration_sweep(insysfile, metab_name, self.sim_experiment, flip, amplitudes, A_fixed, timings=reports)
 
-		for i in range(nlines):
-			freqs.append(-1 * mx.Fr(indx[i])/(2.0*PI*field))
+			# Fit a sine function
+			A_cal, params = maximum_fit(amplitudes, calibration_data)
+			self.simConsole.append('       | A * sin(w*x + p) + c:')
+			self.simConsole.append('       | A = ' + str(params[0]) + ', w = ' + str(params[1]) + ', p = ' + str(params[2]) + ', c = ' + str(params[3]))
+			calibration_data_fitted = sinfunc(amplitudes, *params)
+			plt.figure()
+			plt.plot(amplitudes, calibration_data, '.', color='blue')
+			plt.plot(amplitudes, calibration_data_fitted, color='red')
+			plt.plot(A_cal, calibration_data[(np.abs(np.asarray(amplitudes)-A_cal)).argmin()], 'x', color='black')
+			plt.text(A_cal, calibration_data[(np.abs(np.asarray(amplitudes)-A_cal)).argmin()]*1.2, str(A_cal), rotation='vertical', color='black')
+			plt.title(title)
+			plt.xlabel(xlabel)
+			plt.ylabel('Signal Intensity'); plt.ylim([np.amin(calibration_data) + 0.25*np.amin(calibration_data),np.amax(calibration_data) + 0.25*np.amax(calibration_data)])
+			plt.savefig(self.save_dir_sim + pdf_name)
+			plt.close()
+		else:
+			evaluated, calibration_data, A_cal = adaptive_calibration(insysfile, metab_name, self.sim_experiment, flip, amplitudes, A_fixed, 'maximum', timings=reports)
+			self.simConsole.append('       | adaptive search: ' + str(np.size(evaluated)) + ' of ' + str(np.size(amplitudes)) + ' amplitudes simulated')
 
-		for i in range(nlines):
-			freq = freqs[i]
-			if (freq > ppmlo) and (freq < ppmhi):
-				val = mx.I(indx[i])
-				tmpa = np.sqrt(val.real()**2 + val.imag()**2) / qnscale
-				tmpp = -RAD2DEG * np.angle(val.real()+1j*val.imag())
+		self.calibration_timings[title] = timing.merge(reports)
 
-			if nbin == 0:
-				outf.append(freq)
-				outa.append(tmpa)
-				outp.append(tmpp)
-				nbin += 1
-			else:
-				for k in range(nbin):
-					if (freq >= outf[k]-tolppm) and (freq <= outf[k]+tolppm):
-						if (tmpp >= outp[k]-tolpha) and (tmpp <= outp[k]+tolpha):
-							ampsum   =  outa[k]+tmpa
-							outf[k]  = (outa[k]*outf[k] + tmpa*freq)/ampsum
-							outp[k]  = (outa[k]*outp[k] + tmpa*tmpp)/ampsum
-							outa[k] +=  tmpa;
-							found = True 
-				if not found:
-					outf.append(freq)
-					outa.append(tmpa)
-					outp.append(tmpp)
-					nbin += 1
-				found = False
-
-		for i, item in enumerate(outf):
-			outf[i] = item + rf_off
-			outp[i] = outp[i] - 90.0
-
-		return outf, outa, outp
-
-	def apply_metab_properties(self, metab_name, var, outf, outa, outp, insysfile):
-
-		metab = Metabolite()
-		metab.name = metab_name
-		metab.var = var
-
-		for i in range(np.size(outf)):
-			if outf[i] <= 5:
-				metab.ppm.append(outf[i])
-				metab.area.append(outa[i])
-				metab.phase.append(-1.0*outp[i])
-
-		insysfile = insysfile.replace('pints/metabolites/3T_', '')
-		insysfile = insysfile.replace('pints/metabolites/7T_', '')
-		insysfile = insysfile.replace('pints/metabolites/9.4T_', '')
-
-		if insysfile == 'alanine.sys': #
-			metab.A_m = 0.078
-			metab.T2 = (87E-3)
-		elif insysfile == 'aspartate.sys':
-			metab.A_m = 0.117
-			metab.T2 = (87E-3)
-		elif insysfile == 'choline_1-CH2_2-CH2.sys': #
-			metab.A_m = 0.165
-			metab.T2 = (87E-3)
-		elif insysfile == 'choline_N(CH3)3_a.sys' or insysfile == 'choline_N(CH3)3_b.sys': #
-			metab.A_m = 0.165
-			metab.T2 = (121E-3)
-		elif insysfile == 'creatine_N(CH3).sys':
-			metab.A_m = 0.296
-			metab.T2 = (90E-3)
-		elif insysfile == 'creatine_X.sys':
-			metab.A_m = 0.296
-			metab.T2 = (81E-3)
-		elif insysfile == 'd-glucose-alpha.sys': #
-			metab.A_m = 0.049
-			metab.T2 = (87E-3)
-		elif insysfile == 'd-glucose-beta.sys': #
-			metab.A_m = 0.049
-			metab.T2 = (87E-3)
-		elif insysfile == 'eth.sys': #
-			metab.A_m = 0.320
-			metab.T2 = (87E-3)
-		elif insysfile == 'gaba.sys': #
-			metab.A_m = 0.155
-			metab.T2 = (82E-3)
-		elif insysfile == 'glutamate.sys':
-			metab.A_m = 0.898
-			metab.T2 = (88E-3)
-		elif insysfile == 'glutamine.sys':
-			metab.A_m = 0.427
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_cysteine.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_glutamate.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_glycine.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glycine.sys':
-			metab.A_m = 0.068
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_7-CH2_8-CH2.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_glycerol.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_N(CH3)3_a.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (121E-3)
-		elif insysfile == 'gpc_N(CH3)3_b.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (121E-3)
-		elif insysfile == 'lactate.sys': #
-			metab.A_m = 0.039
-			metab.T2 = (87E-3)
-		elif insysfile == 'myoinositol.sys':
-			metab.A_m = 0.578
-			metab.T2 = (87E-3)
-		elif insysfile == 'naa_acetyl.sys':
-			metab.A_m = 1.000
-			metab.T2 = (130E-3)
-		elif insysfile == 'naa_aspartate.sys':
-			metab.A_m = 1.000
-			metab.T2 = (69E-3)
-		elif insysfile == 'naag_acetyl.sys':
-			metab.A_m = 0.160
-			metab.T2 = (130E-3)
-		elif insysfile == 'naag_aspartyl.sys':
-			metab.A_m = 0.160
-			metab.T2 = (87E-3)
-		elif insysfile == 'naag_glutamate.sys':
-			metab.A_m = 0.160
-			metab.T2 = (87E-3)
-		elif insysfile == 'pcho_N(CH3)3_a.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (121E-3)
-		elif insysfile == 'pcho_N(CH3)3_b.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (121E-3)
-		elif insysfile == 'pcho_X.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (87E-3)
-		elif insysfile == 'pcr_N(CH3).sys':
-			metab.A_m = 0.422
-			metab.T2 = (90E-3)
-		elif insysfile == 'pcr_X.sys':
-			metab.A_m = 0.422
-			metab.T2 = (81E-3)
-		elif insysfile == 'peth.sys':
-			metab.A_m = 0.126
-			metab.T2 = (87E-3)
-		elif insysfile == 'scyllo-inositol.sys':
-			metab.A_m = 0.044
-			metab.T2 = (87E-3)
-		elif insysfile == 'taurine.sys':
-			metab.A_m = 0.117
-			metab.T2 = (85E-3)
-		elif insysfile == 'water.sys':
-			metab.A_m = 1.000
-			metab.T2 = (43.60E-3)
-
-		return metab
+		return A_cal
 
 	def slaser_build180(self, inpulse180file, A_180, PULSE_180_LENGTH, gyratio, spin_system, plot_flag, scanner):
 		# A: amplitude in milliTesla
 
-		pulse180 = Pulse(inpulse180file, PULSE_180_LENGTH, scanner)
-
-		n_old = np.linspace(0, PULSE_180_LENGTH, np.size(pulse180.waveform))
-		n_new = np.linspace(0, PULSE_180_LENGTH, np.size(pulse180.waveform)+1)
-
-		waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse180.waveform)*A_180)(n_new)
-		waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse180.waveform)*A_180)(n_new)
-		pulse180.waveform = waveform_real + 1j*(waveform_imag)
-
-		if scanner == 'bruker':
-			ampl_arr = np.abs(pulse180.waveform)
-		else:
-			ampl_arr = np.abs(pulse180.waveform) *gyratio
-
-		phas_arr = np.unwrap(np.angle(pulse180.waveform))*180.0/math.pi
-		freq_arr = np.gradient(phas_arr)
-
 		if plot_flag:
+			pulse180, n_new, ampl_arr, phas_arr = shaped_pulse(inpulse180file, A_180, PULSE_180_LENGTH, gyratio, scanner, True)
+			freq_arr = np.gradient(phas_arr)
+
 			plt.figure()
 			plt.subplot(3,1,1)
-			plt.plot(n_new, waveform_real)
-			plt.plot(n_new, waveform_imag)
+			plt.plot(n_new, np.real(pulse180.waveform))
+			plt.plot(n_new, np.imag(pulse180.waveform))
 			plt.subplot(3,1,2)
 			plt.plot(n_new, ampl_arr)
 			plt.subplot(3,1,3)
@@ -1589,40 +646,21 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			plt.savefig(self.save_dir_sim + '180AFP' + '_' + str(PULSE_180_LENGTH) + 'sec.png')
 			plt.close()
 
-		pulse = pg.row_vector(len(pulse180.waveform))
-		ptime = pg.row_vector(len(pulse180.waveform))
-		for j, val in enumerate(zip(ampl_arr, phas_arr)):
-			pulse.put(pg.complex(val[0],val[1]), j)
-			ptime.put(pg.complex(n_new[1],0), j)
-
-		pulse_dur_180 = pulse.size() * pulse180.pulsestep
-		pwf_180 = pg.PulWaveform(pulse, ptime, "180afp")
-		pulc_180 = pg.PulComposite(pwf_180, spin_system, self.sim_experiment.obs_iso)
+		pulse_dur_180, pulsestep_180, Ureal180 = pulse_propagator(inpulse180file, A_180, PULSE_180_LENGTH, gyratio, spin_system, self.sim_experiment.obs_iso, scanner, True, True, self.sim_experiment.RF_OFFSET, "180afp")
 
-		Ureal180 = pulc_180.GetUsum(-1)
-
-		return A_180, pulse180, pulse_dur_180, Ureal180
+		return A_180, pulse_dur_180, Ureal180
 
 	def laser_buildafp(self, inpulse180file, A_180, PULSE_180_LENGTH, gyratio, spin_system, plot_flag):
 		# A: amplitude in milliTesla
 
-		pulse180 = Pulse(inpulse180file, PULSE_180_LENGTH, 'varian')
-
-		n_new = np.linspace(0, PULSE_180_LENGTH, 512)
-
-		waveform_real = np.real(pulse180.waveform)*A_180
-		waveform_imag = np.imag(pulse180.waveform)*A_180
-		pulse180.waveform = waveform_real + 1j*(waveform_imag)
-
-		ampl_arr = np.abs(pulse180.waveform)*gyratio
-		phas_arr = np.unwrap(np.angle(pulse180.waveform))*180.0/math.pi
-		freq_arr = np.gradient(phas_arr)
-
 		if plot_flag:
+			pulse180, n_new, ampl_arr, phas_arr = shaped_pulse(inpulse180file, A_180, PULSE_180_LENGTH, gyratio, 'varian', False)
+			freq_arr = np.gradient(phas_arr)
+
 			plt.figure()
 			plt.subplot(3,1,1)
-			plt.plot(n_new, waveform_real)
-			plt.plot(n_new, waveform_imag)
+			plt.plot(n_new, np.real(pulse180.waveform))
+			plt.plot(n_new, np.imag(pulse180.waveform))
 			plt.subplot(3,1,2)
 			plt.plot(n_new, ampl_arr)
 			plt.subplot(3,1,3)
@@ -1630,42 +668,19 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			plt.savefig(self.save_dir_sim + '180AFP' + '_' + str(PULSE_180_LENGTH) + 'sec.png')
 			plt.close()
 
-		pulse = pg.row_vector(len(pulse180.waveform))
-		ptime = pg.row_vector(len(pulse180.waveform))
-		for j, val in enumerate(zip(ampl_arr, phas_arr)):
-			pulse.put(pg.complex(val[0],val[1]), j)
-			ptime.put(pg.complex(n_new[1],0), j)
-
-		pulse_dur_180 = pulse.size() * pulse180.pulsestep
-		pwf_180 = pg.PulWaveform(pulse, ptime, "180afp")
-		pulc_180 = pg.PulComposite(pwf_180, spin_system, self.sim_experiment.obs_iso)
+		pulse_dur_180, pulsestep_180, Ureal180 = pulse_propagator(inpulse180file, A_180, PULSE_180_LENGTH, gyratio, spin_system, self.sim_experiment.obs_iso, 'varian', False, True, self.sim_experiment.RF_OFFSET, "180afp")
 
-		Ureal180 = pulc_180.GetUsum(-1)
-
-		return A_180, pulse180, pulse_dur_180, Ureal180
+		return A_180, pulse_dur_180, Ureal180
 
 	def slaser_build90(self, inpulse90file, A_90, PULSE_90_LENGTH, gyratio, spin_system, plot_flag, scanner):
-		pulse90 = Pulse(inpulse90file, PULSE_90_LENGTH, scanner)
-
-		n_old = np.linspace(0, PULSE_90_LENGTH, np.size(pulse90.waveform))
-		n_new = np.linspace(0, PULSE_90_LENGTH, np.size(pulse90.waveform)+1)
-
-		waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse90.waveform)*A_90)(n_new)
-		waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse90.waveform)*A_90)(n_new)
-		pulse90.waveform = waveform_real + 1j*(waveform_imag)
-
-		if scanner == 'bruker':
-			ampl_arr = np.abs(pulse90.waveform)
-		else:
-			ampl_arr = np.abs(pulse90.waveform)*gyratio
 
-		phas_arr = np.unwrap(np.angle(pulse90.waveform))*180.0/math.pi
-		
 		if plot_flag:
+			pulse90, n_new, ampl_arr, phas_arr = shaped_pulse(inpulse90file, A_90, PULSE_90_LENGTH, gyratio, scanner, True)
+
 			plt.figure()
 			plt.subplot(3,1,1)
-			plt.plot(n_new, waveform_real)
-			plt.plot(n_new, waveform_imag)
+			plt.plot(n_new, np.real(pulse90.waveform))
+			plt.plot(n_new, np.imag(pulse90.waveform))
 			plt.subplot(3,1,2)
 			plt.plot(n_new, ampl_arr)
 			plt.subplot(3,1,3)
@@ -1673,42 +688,24 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			plt.savefig(self.save_dir_sim + '90EXCITE' + '_' + str(PULSE_90_LENGTH) + 'sec.png')
 			plt.close()
 
-		pulse = pg.row_vector(len(pulse90.waveform))
-		ptime = pg.row_vector(len(pulse90.waveform))
-		for j, val in enumerate(zip(ampl_arr, phas_arr)):
-			pulse.put(pg.complex(val[0],val[1]), j)
-			ptime.put(pg.complex(pulse90.pulsestep,0), j)
+		pulse_dur_90, pulsestep_90, Ureal90 = pulse_propagator(inpulse90file, A_90, PULSE_90_LENGTH, gyratio, spin_system, self.sim_experiment.obs_iso, scanner, True, False, self.sim_experiment.RF_OFFSET, "90excite")
 
-		pulse_dur_90 = pulse.size() * pulse90.pulsestep
 		if scanner == 'bruker':
 			peak_to_end_90 = 0
 		else:
-			peak_to_end_90 = pulse_dur_90 - (209 + self.sim_experiment.fudge_factor) * pulse90.pulsestep
-		pwf_90 = pg.PulWaveform(pulse, ptime, "90excite")
-		pulc_90 = pg.PulComposite(pwf_90, spin_system, self.sim_experiment.obs_iso)
+			peak_to_end_90 = pulse_dur_90 - (209 + self.sim_experiment.fudge_factor) * pulsestep_90
 
-		Ureal90 = pulc_90.GetUsum(-1)
-
-		return A_90, pulse90, pulse_dur_90, peak_to_end_90, Ureal90
+		return A_90, pulse_dur_90, peak_to_end_90, Ureal90
 
 	def laser_buildahp(self, inpulse90file, A_90, PULSE_90_LENGTH, gyratio, spin_system, plot_flag):
-		pulse90 = Pulse(inpulse90file, PULSE_90_LENGTH, 'varian')
-
-		n_old = np.linspace(0, PULSE_90_LENGTH, np.size(pulse90.waveform))
-		n_new = np.linspace(0, PULSE_90_LENGTH, np.size(pulse90.waveform)+1)
 
-		waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse90.waveform)*A_90)(n_new)
-		waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse90.waveform)*A_90)(n_new)
-		pulse90.waveform = waveform_real + 1j*(waveform_imag)
-
-		ampl_arr = np.abs(pulse90.waveform)*gyratio
-		phas_arr = np.unwrap(np.angle(pulse90.waveform))*180.0/math.pi
-		
 		if plot_flag:
+			pulse90, n_new, ampl_arr, phas_arr = shaped_pulse(inpulse90file, A_90, PULSE_90_LENGTH, gyratio, 'varian', True)
+
 			plt.figure()
 			plt.subplot(3,1,1)
-			plt.plot(n_new, waveform_real)
-			plt.plot(n_new, waveform_imag)
+			plt.plot(n_new, np.real(pulse90.waveform))
+			plt.plot(n_new, np.imag(pulse90.waveform))
 			plt.subplot(3,1,2)
 			plt.plot(n_new, ampl_arr)
 			plt.subplot(3,1,3)
@@ -1716,19 +713,9 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			plt.savefig(self.save_dir_sim + '90AHP' + '_' + str(PULSE_90_LENGTH) + 'sec.png')
 			plt.close()
 
-		pulse = pg.row_vector(len(pulse90.waveform))
-		ptime = pg.row_vector(len(pulse90.waveform))
-		for j, val in enumerate(zip(ampl_arr, phas_arr)):
-			pulse.put(pg.complex(val[0],val[1]), j)
-			ptime.put(pg.complex(pulse90.pulsestep,0), j)
-
-		pulse_dur_90 = pulse.size() * pulse90.pulsestep
-		pwf_90 = pg.PulWaveform(pulse, ptime, "90excite")
-		pulc_90 = pg.PulComposite(pwf_90, spin_system, self.sim_experiment.obs_iso)
+		pulse_dur_90, pulsestep_90, Ureal90 = pulse_propagator(inpulse90file, A_90, PULSE_90_LENGTH, gyratio, spin_system, self.sim_experiment.obs_iso, 'varian', True, False, self.sim_experiment.RF_OFFSET, "90excite")
 
-		Ureal90 = pulc_90.GetUsum(-1)
-
-		return A_90, pulse90, pulse_dur_90, Ureal90
+		return A_90, pulse_dur_90, Ureal90
 
 	# ---- Methods for Plotting in the GUI ---- #
 	def setPlot(self, tab):
@@ -1927,6 +914,11 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		print('  | Total metabolites in file: ' + str(experiment.metabolites_num))
 		print('  | Total metabolites after combination: ' + str(np.size(experiment.metabolites)))
 		print('       | ', experiment.metabolites.sort())
+
+		# peak parameters of all metabolites in contiguous arrays
+		experiment.basis = BasisSet([experiment.data[name] for name in experiment.metabolites])
+		experiment.model = BasisModel(experiment.basis)
+
 		print('  | Import complete.\n')
 
 		return experiment
@@ -2050,12 +1042,10 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 	def calcSignal(self, metabolites, experiment, w0, phi0, lb, shift):
 		
-		signals = np.empty([np.size(metabolites), np.size(experiment.t)], dtype=complex)
-		for i in range(0, np.size(metabolites)):
-			signals[i,] = np.exp(-1j * (w0 * experiment.t) + 1j * (phi0)) \
-						  * experiment.data[metabolites[i]].getFID(experiment.TE, experiment.b0, experiment.t, 0, 1, 0, 0, lb) \
-						  * np.exp(-1j * 2 * sp.pi * experiment.b0 * shift * experiment.t)
-		total_signal = np.sum(signals, axis=0)
+		signals = experiment.model.getFIDs(metabolites, experiment.TE, experiment.b0, experiment.t, 0, 1, 0, 0, lb)
+		total_signal = np.exp(-1j * (w0 * experiment.t) + 1j * (phi0)) \
+					   * np.sum(signals, axis=0) \
+					   * np.exp(-1j * 2 * sp.pi * experiment.b0 * shift * experiment.t)
 		
 		print('')
 		
@@ -2080,7 +1070,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		n = np.size(total_signal)
 		print(n)
 		f = np.arange(+n//2,-n//2,-1)*(self.experiment.fs/n)*(1/self.experiment.b0)
-		spectra = fftw.fftshift(fftw.fft(total_signal))
+		spectra = fftplans.spectrum(total_signal)
 		plt.figure(2)
 		plt.clf()
 		plt.subplot(2,1,1)
@@ -2227,7 +1217,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 				total_signal = self.calcSignal([metabolite], self.experiment, w0, phi0, lb, shift)
 				n = np.size(total_signal)
 				f = np.arange(+n//2,-n//2,-1)*(self.experiment.fs/n)*(1/self.experiment.b0)
-				spectra = fftw.fftshift(fftw.fft(total_signal))
+				spectra = fftplans.spectrum(total_signal)
 				for i in range(0, n):
 					element = spectra[i]
 					shift = f[i]
@@ -2245,36 +1235,19 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 
 	def saveToDAT(self, experiment, signal):
 		filename_out = str(self.outputFilenameInput_dat.text())
-		dat_file = open(filename_out, 'w')
-		
-		dat_file.write(str(np.size(signal)*2) + '\n') # num of data lines
-		dat_file.write(str(1) + '\n') # num of averages
-		dat_file.write(str(experiment.dwell_time) + '\n') # ADC dwell time
-		dat_file.write(str(experiment.b0) + '\n') # main field strength
-		
-		dat_file.write(str(1) + '\n') # (?) NOT SURE WHAT THIS LINE IS (?)
-		
-		dat_file.write("Robarts Research Institute, " + experiment.name + '\n')
-		dat_file.write(' \"' + experiment.date + '\"' + '\n')
-		
-		dat_file.write("MachS=0 ConvS=1.00e-03 V1=20.000 V2=20.000 V3=20.000 vtheta=0.0" + '\n')
-		# ^arbitrary line, since not a real experiment off the scanner
-	
-		dat_file.write("TE=" + str(self.outputTEInput.text()) + " s TR=7.500 s P1=9.02056 P2=37.26239 P3=6.46689 Gain=1.00" + '\n')
-		
-		# (?) NOT SURE WHAT THESE LINES ARE FOR (?)
-		dat_file.write("SIMULTANEOUS" + '\n')
-		dat_file.write('0.0' + '\n')
-		dat_file.write('EMPTY' + '\n')
-		
-		# begin to write data
-		for element in signal:
-			dat_file.write("{0:.6f}".format(float(np.real(element))) + '\n')
-			dat_file.write("{0:.6f}".format(float(np.imag(element))) + '\n')
-		
-		self.outputFilenameInfoLabel_dat.append(">> Successfully output to " + filename_out)
 
-		dat_file.close()
+		header = DatHeader(np.size(signal)*2,	# num of data lines
+						   1,						# num of averages
+						   experiment.dwell_time,	# ADC dwell time
+						   experiment.b0,			# main field strength
+						   1,						# (?) NOT SURE WHAT THIS LINE IS (?)
+						   "Robarts Research Institute, " + experiment.name,
+						   ' \"' + experiment.date + '\"',
+						   "MachS=0 ConvS=1.00e-03 V1=20.000 V2=20.000 V3=20.000 vtheta=0.0",	# arbitrary line, since not a real experiment off the scanner
+						   "TE=" + str(self.outputTEInput.text()) + " s TR=7.500 s P1=9.02056 P2=37.26239 P3=6.46689 Gain=1.00")
+		DatWriter(header, fmt='%.6f').write(filename_out, signal)
+
+		self.outputFilenameInfoLabel_dat.append(">> Successfully output to " + filename_out)
 
 	# ---- Methods for 'Edit Constraint Metabolites' Tab ---- #
 	def populateMetabList(self):
@@ -2766,37 +1739,22 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 	def loadDATFile(self):
 		try:
 			filename = str(self.filenameInput_dat.text())
-			in_file = open(filename, 'r')
+			header, signal = read_dat(filename)
 
-			n = 0
-			fs = 0
-			b0 = 0
-			dat = []
-
-			for i, line in enumerate(in_file):
-				if i == 0:
-					n = int(line.replace(' ', '').replace('\n', ''))//2
-				elif i == 2:
-					fs = 1/float(line.replace(' ', '').replace('\n', ''))
-				elif i == 3:
-					b0 = float(line.replace(' ', '').replace('\n', ''))
-				elif i == 11:
-					print(line)
-				elif i > 11:
-					dat.append(float(line.replace(' ', '').replace('\n', '')))
-
-			real = sp.array(dat)[0::2]
-			imag = sp.array(dat)[1::2]
+			n = int(header[0].replace(' ', '').replace('\n', ''))//2
+			fs = 1/float(header[2].replace(' ', '').replace('\n', ''))
+			b0 = float(header[3].replace(' ', '').replace('\n', ''))
+			print(header[11])
 
 			t = np.arange(0, n, 1) * (1/fs)
 			
-			self.ref_signal = RefSignal(real+1j*imag, n, fs, t, b0)
+			self.ref_signal = RefSignal(precision.signal(signal), n, fs, t, b0)
 			print('n: ' + str(n) + ', fs: ' + str(fs) + ', dt: ' + str(1/fs) + ', b0: ' + str(b0))
 
 			self.filenameInfoLabel_dat.setText("Acquired data loaded! \n >> " + str(self.filenameInput_dat.text()).rsplit('/', 1)[-1])
 			self.plotGESButton.setEnabled(True)
 		except Exception as e:
-			self.filenameInfoLabel_dat.setText("ERROR: " + str(s) + "\n >> Data could not be loaded.\n >> Please try another dat file.")
+			self.filenameInfoLabel_dat.setText("ERROR: " + str(e) + "\n >> Data could not be loaded.\n >> Please try another dat file.")
 
 	def plotGES(self):
 		try:
@@ -2807,7 +1765,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			print('ref_signal: ' + str(self.ref_signal.signal))
 			
 			f_ref = np.arange(+n_ref//2,-n_ref//2,-1)*(self.ref_signal.fs/n_ref)*(1/self.ref_signal.b0)
-			spectra_ref = fftw.fftshift(fftw.fft(self.ref_signal.signal))
+			spectra_ref = fftplans.spectrum(self.ref_signal.signal)
 
 			
 			# GUESS
@@ -2821,9 +1779,6 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			w0 = 0
 			phi0 = 0
 
-			signals = np.empty([np.size(self.metabListWidget.selectedItems()), np.size(self.experiment.t)], dtype=complex)
-			i = 0
-
 			# ---- Get from selected items from 'Plot Metabolites' tab ----
 			# metabolites = []
 			# for item in self.metabListWidget.selectedItems():
@@ -2843,11 +1798,8 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			phi0 = 0
 			lb =   wfactor      
 			
-			signals = np.empty([np.size(metabolites), np.size(self.experiment.t)], dtype=complex)
-			for i in range(0, np.size(metabolites)):
-				signals[i,] = np.exp(-1j * (w0 * self.experiment.t) + 1j * (phi0)) \
-							  * self.experiment.data[metabolites[i]].getFID(self.experiment.TE, self.experiment.b0, self.experiment.t, sfactor, afactor, pfactor, dfactor, lb)
-			total_signal = np.sum(signals, axis=0)
+			signals = self.experiment.model.getFIDs(metabolites, self.experiment.TE, self.experiment.b0, self.experiment.t, sfactor, afactor, pfactor, dfactor, lb)
+			total_signal = np.exp(-1j * (w0 * self.experiment.t) + 1j * (phi0)) * np.sum(signals, axis=0)
 
 			n = np.size(total_signal)
 			
@@ -2855,7 +1807,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			print(total_signal)
 			
 			f = np.arange(+n//2,-n//2,-1)*(self.experiment.fs/n)*(1/self.experiment.b0)
-			spectra = fftw.fftshift(fftw.fft(total_signal))
+			spectra = fftplans.spectrum(total_signal)
 
 			print(np.size(f))
 			print(np.size(np.real(spectra)))
@@ -0,0 +1,351 @@
+from __future__ import print_function
+
+# ---- System Libraries ---- #
+import sys
+import os
+import datetime
+import platform
+import argparse
+import shutil
+import tempfile
+import copy
+import concurrent.futures as cf
+from collections import OrderedDict
+
+# ---- Math Libraries ---- #
+import numpy as np
+
+# ---- Data Classes ---- #
+from magiqdataclasses import *
+
+# ---- Simulation Libraries ---- #
+from simclasses import *
+import timing
+
+# Headless PINTS: simulates basis sets for every combination of sequence, field strength
+# and echo time in one run, e.g.
+#
+#   python pintsbatch.py --sequences slaser laser --b0 123.3 297.2 --te 28 60 100 144
+#
+# Each combination is written to its own pints/experiments/<sequence>_sim_<timestamp>_TE<TE>_<field>/
+# directory, in the same format as the PINTS GUI.
+
+# ---- Sequence Defaults (as in the PINTS GUI) ---- #
+sequence_defaults = {
+	'slaser': {'PULSE_90_LENGTH': 4000, 'PULSE_180_LENGTH': 8000, 'A_90s': (0, 30), 'A_180s': (0, 30)},
+	'laser':  {'PULSE_90_LENGTH': 2000, 'PULSE_180_LENGTH': 1000, 'A_90s': (0, 200), 'A_180s': (70, 200)},
+}
+
+def amplitude_grid(amin, amax):
+	amin = int(np.floor(amin)); amax = int(np.ceil(amax))
+	return np.linspace(amin, amax, (amax-amin)*10 + 1)
+
+def bruker_params(file_dir):
+	# The Bruker sLASER parameters that loadBrukerParams reads into the PINTS GUI.
+	header = BrukerFID(file_dir).header
+
+	params = {}
+	params['b0'] = float(header['PVM_FrqRef']['value'][0])
+	if params['b0'] > 350:
+		params['b0'] = 400.2
+	elif params['b0'] > 200:
+		params['b0'] = 297.2
+	else:
+		params['b0'] = 123.3
+
+	params['dwell_time'] = float(header['PVM_DigDw']['value']) / 1000
+	params['acq_time']   = params['dwell_time'] * int(header['PVM_DigNp']['value'])
+	params['DigShift']   = int(header['PVM_DigShift']['value'])
+	params['TE']  = float(header['PVM_EchoTime']['value'])
+	params['TE1'] = int(float(header['TE1']['value']))
+	params['TE2'] = int(float(header['TE2']['value']))
+
+	# | Pulse Structure (pulse length, pulse bandwith, flip angle, excitation, ~, ~, ~, ~, ~, amplitude, shape)
+	ep  = header['VoxPul1']['value'].replace('(','').replace(' ','').replace(')','').split(',')
+	epn = header['VoxPul1Enum']['value'].replace('>','').replace('<','')
+	rp  = header['VoxPul2']['value'].replace('(','').replace(' ','').replace(')','').split(',')
+	rpn = header['VoxPul2Enum']['value'].replace('>','').replace('<','')
+
+	params['inpulse90file']  = 'pints/pulses/rect.exc' if 'Calculated' in epn else 'pints/pulses/' + epn + '.exc'
+	params['inpulse180file'] = 'pints/pulses/' + rpn + '.inv'
+	params['PULSE_90_LENGTH']  = float(ep[0]) * 1000
+	params['PULSE_180_LENGTH'] = float(rp[0]) * 1000
+	params['A_90s']  = (0, float(ep[-2]) / 10)
+	params['A_180s'] = (0, float(rp[-2]) / 10)
+
+	return params
+
+def batch_experiment(sequence, b0, TE, args, bruker=None):
+	# Same set up as MyApp.confirmSimParams
+	sim_experiment = Experiment(sequence, b0)
+	if sequence == 'slaser_bruker':
+		sim_experiment.name = 'semi-LASER (Bruker)'
+	elif sequence == 'slaser':
+		sim_experiment.name = 'semi-LASER'
+	elif sequence == 'laser':
+		sim_experiment.name = 'LASER'
+
+	sim_experiment.author = platform.node()
+	sim_experiment.date = datetime.datetime.now().strftime("%Y_%m_%d")
+	sim_experiment.description = 'Density-matrix simulations of metabolites using PyGAMMA and metabolite parameters from V. Govindaraju et. al, NMR Biomed. 2000;13:129-153'
+	sim_experiment.type = 'PINTS'
+	sim_experiment.obs_iso = '1H'
+	sim_experiment.spatial_positions = [np.linspace(-extent/2.0, extent/2.0, n).tolist() for (extent, n) in zip(args.grid_extent, args.grid_points)]
+	sim_experiment.slice_gradients = list(args.slice_gradients)
+
+	sim_experiment.acq_time = args.acq_time
+	sim_experiment.dwell_time = args.dwell_time
+	sim_experiment.TE = TE
+	sim_experiment.RF_OFFSET = args.rf_offset
+
+	if sequence == 'slaser_bruker':
+		defaults = bruker
+		sim_experiment.acq_time = bruker['acq_time']
+		sim_experiment.dwell_time = bruker['dwell_time']
+		sim_experiment.TE1 = bruker['TE1']
+		sim_experiment.TE2 = bruker['TE2']
+		sim_experiment.DigShift = bruker['DigShift']*sim_experiment.dwell_time
+		sim_experiment.inpulse90file = bruker['inpulse90file']
+		sim_experiment.inpulse180file = bruker['inpulse180file']
+	else:
+		defaults = sequence_defaults[sequence]
+		if sequence == 'slaser':
+			sim_experiment.fudge_factor = args.fudge_factor
+
+	sim_experiment.PULSE_90_LENGTH  = (args.pulse90_length or defaults['PULSE_90_LENGTH'])*10**(-6)
+	sim_experiment.PULSE_180_LENGTH = (args.pulse180_length or defaults['PULSE_180_LENGTH'])*10**(-6)
+	sim_experiment.A_90s  = amplitude_grid(*(args.A90_range or defaults['A_90s']))
+	sim_experiment.A_180s = amplitude_grid(*(args.A180_range or defaults['A_180s']))
+
+	sim_experiment.tolppm = args.tolppm
+	sim_experiment.tolpha = args.tolpha
+	sim_experiment.ppmlo = args.ppmlo - sim_experiment.RF_OFFSET
+	sim_experiment.ppmhi = args.ppmhi - sim_experiment.RF_OFFSET
+
+	sim_experiment.propagator_cache_dir = args.propagator_cache
+	sim_experiment.basis_cache_dir = args.basis_cache
+
+	return sim_experiment
+
+def calibrated_amplitude(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed, target, adaptive, n_workers, log, reports, guess_A=None):
+	# dense sweep with the curve fit of MyApp.calibratePlateau/calibrateMaximum, or the adaptive search
+	if adaptive:
+		evaluated, calibration_data, A_cal = adaptive_calibration(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed, target, n_workers=n_workers, timings=reports)
+		log('       | adaptive search: ' + str(np.size(evaluated)) + ' of ' + str(np.size(amplitudes)) + ' amplitudes simulated')
+		return A_cal
+
+	calibration_data = calibration_sweep(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed, n_workers, timings=reports)
+	if target == 'plateau':
+		return plateau_fit(amplitudes, calibration_data, guess_A)[0]
+	return maximum_fit(amplitudes, calibration_data)[0]
+
+def calibrate(sim_experiment, metab_name, n_workers, log, A_90=None, A_180=None, timings=None, adaptive=False):
+	# Same calibrations as MyApp.runSimulation. Amplitudes that are passed in are used as
+	# they are. The timing report of every calibration is stored in timings (if given).
+	timings = timings if timings is not None else OrderedDict()
+	insysfile = sysfile_path(metab_name + '.sys', sim_experiment.b0)
+
+	if A_180 is None:
+		log('   | 180-degree calibration (w/ ideal 90, ' + metab_name + ')')
+		reports = []
+		A_180 = calibrated_amplitude(insysfile, metab_name, sim_experiment, 180, sim_experiment.A_180s, None, 'plateau', adaptive, n_workers, log, reports)
+		timings['180-degree calibration'] = timing.merge(reports)
+		if A_180 + int(sim_experiment.A_180s[-1]/6) < sim_experiment.A_180s[-1]:
+			A_180 = A_180 + int(sim_experiment.A_180s[-1]/6) # pad to be sure of adiabicity
+	log('       | CALIBRATED 180 AFP AMPLITUDE: ' + str(A_180))
+
+	if A_90 is None:
+		log('   | 90-degree calibration (w/ AFP 180, ' + metab_name + ')')
+		reports = []
+		if sim_experiment.name == 'semi-LASER (Bruker)':
+			# AFPs at the last amplitude of the 180 sweep
+			A_90 = calibrated_amplitude(insysfile, metab_name, sim_experiment, 90, sim_experiment.A_90s, sim_experiment.A_180s[-1], 'maximum', adaptive, n_workers, log, reports)
+		elif sim_experiment.name == 'semi-LASER':
+			A_90 = calibrated_amplitude(insysfile, metab_name, sim_experiment, 90, sim_experiment.A_90s, A_180, 'maximum', adaptive, n_workers, log, reports)
+		else:
+			A_90 = calibrated_amplitude(insysfile, metab_name, sim_experiment, 90, sim_experiment.A_90s, A_180, 'plateau', adaptive, n_workers, log, reports, 0)
+			if A_90 + int(sim_experiment.A_90s[-1]/6) < sim_experiment.A_90s[-1]:
+				A_90 = A_90 + int(sim_experiment.A_90s[-1]/6) # pad to be sure of adiabicity
+		timings['90-degree calibration'] = timing.merge(reports)
+	log('       | CALIBRATED 90 AMPLITUDE: ' + str(A_90))
+
+	return A_90, A_180
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='Simulate PINTS basis sets for several sequences, field strengths and echo times.')
+
+	parser.add_argument('--sequences', nargs='+', default=['slaser'], choices=['slaser', 'laser', 'slaser_bruker'])
+	parser.add_argument('--b0', nargs='+', type=float, default=[297.2], choices=[123.3, 297.2, 400.2], help='field strengths [MHz]')
+	parser.add_argument('--te', nargs='+', type=float, default=[60.0], help='echo times [msec]')
+	parser.add_argument('--metabolites', nargs='+', default=[insysfile.replace('.sys','') for insysfile in default_insysfiles])
+	parser.add_argument('--macromolecules', action='store_true', help='append the macromolecule/lipid peaks to every basis set')
+
+	parser.add_argument('--bruker-data', default='', help='Bruker data directory (slaser_bruker only; TE, timings and pulses are read from it)')
+	parser.add_argument('--calibration-metabolite', default='alanine')
+	parser.add_argument('--A90', type=float, default=None, help='skip the 90-degree calibration and use this amplitude [mT]')
+	parser.add_argument('--A180', type=float, default=None, help='skip the 180-degree calibration and use this amplitude [mT]')
+	parser.add_argument('--adaptive-calibration', action='store_true', help='calibrate with the adaptive amplitude search instead of the dense sweep and curve fit (faster; may pick a different amplitude)')
+	parser.add_argument('--A90-range', nargs=2, type=float, default=None, metavar=('MIN', 'MAX'))
+	parser.add_argument('--A180-range', nargs=2, type=float, default=None, metavar=('MIN', 'MAX'))
+	parser.add_argument('--pulse90-length', type=float, default=None, help='[usec]')
+	parser.add_argument('--pulse180-length', type=float, default=None, help='[usec]')
+	parser.add_argument('--fudge-factor', type=int, default=0, help='SLR fudge factor (slaser only)')
+
+	parser.add_argument('--grid-extent', nargs='+', type=float, default=[], help='localized simulation: extent of the spatial grid along each selected direction [mm]')
+	parser.add_argument('--grid-points', nargs='+', type=int, default=[], help='localized simulation: number of grid points along each direction')
+	parser.add_argument('--slice-gradients', nargs='+', type=float, default=[], help='localized simulation: slice-selection gradient of each direction [mT/m]')
+	parser.add_argument('--acq-time', type=float, default=341E-3, help='[sec]')
+	parser.add_argument('--dwell-time', type=float, default=0.000166, help='[sec]')
+	parser.add_argument('--rf-offset', type=float, default=4.7, help='[ppm]')
+	parser.add_argument('--tolppm', type=float, default=0.0015)
+	parser.add_argument('--tolpha', type=float, default=50.0)
+	parser.add_argument('--ppmlo', type=float, default=0.0)
+	parser.add_argument('--ppmhi', type=float, default=10.0)
+
+	parser.add_argument('--output', default='pints/experiments')
+	parser.add_argument('--propagator-cache', default='', help='keep shaped-pulse propagators in this directory (default: a temporary directory)')
+	parser.add_argument('--basis-cache', default='pints/cache/basis', help="cache of simulated metabolites ('' disables it)")
+	parser.add_argument('--workers', type=int, default=None)
+
+	return parser.parse_args(argv)
+
+def main(argv):
+	args = parse_args(argv)
+	n_workers = args.workers if args.workers else (os.cpu_count() or 1)
+	timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S")
+
+	console = []
+	def log(string):
+		print(string)
+		console.append(string)
+
+	if 'slaser_bruker' in args.sequences and not args.bruker_data:
+		sys.exit('slaser_bruker needs --bruker-data')
+	bruker = bruker_params(args.bruker_data) if 'slaser_bruker' in args.sequences else None
+
+	insysfiles = [metab + '.sys' for metab in args.metabolites]
+
+	# pulse propagators are shared by all echo times and worker processes through the disk cache
+	temporary_cache = not args.propagator_cache
+	if temporary_cache:
+		args.propagator_cache = tempfile.mkdtemp(prefix='pints_propagators_')
+
+	# ---- Calibrate every sequence/field strength once ---- #
+	experiments = []
+	calibration_timings = []
+	for sequence in args.sequences:
+		if sequence == 'slaser_bruker':
+			protocols = [(bruker['b0'], [bruker['TE']])]
+		else:
+			protocols = [(b0, list(args.te)) for b0 in args.b0]
+
+		for (b0, TEs) in protocols:
+			sim_experiment = batch_experiment(sequence, b0, TEs[0], args, bruker)
+
+			log('\n' + sim_experiment.name + ', b0 = ' + str(b0) + ' MHz, TE = ' + str(TEs) + ' msec')
+			calibration_timings.append(OrderedDict())
+			sim_experiment.A_90, sim_experiment.A_180 = calibrate(sim_experiment, args.calibration_metabolite, n_workers, log, args.A90, args.A180, calibration_timings[-1], args.adaptive_calibration)
+
+			experiments.append((sim_experiment, TEs))
+
+	# ---- Simulate every metabolite at all echo times ---- #
+	log('\nDensity Matrix Simulations of Metabolites (' + str(n_workers) + ' workers)')
+
+	# metabolites and echo times simulated before with the same parameters come from the basis set cache
+	cache = BasisSetCache(args.basis_cache) if args.basis_cache else None
+	results = {}
+	keys = {}
+	jobs = []
+	# timing report per simulated (experiment, metabolite), shared by its missing echo times
+	timings = {}
+	for (e, (sim_experiment, TEs)) in enumerate(experiments):
+		for m in range(len(insysfiles)):
+			missing = []
+			for (t, TE) in enumerate(TEs):
+				if cache is not None:
+					experiment = copy.copy(sim_experiment)
+					experiment.TE = TE
+					keys[(e, m, t)] = cache.key(insysfiles[m], experiment)
+					results[(e, m, t)] = cache.get(keys[(e, m, t)])
+				if results.get((e, m, t)) is None:
+					missing.append(t)
+			if missing:
+				jobs.append((e, m, missing))
+	if cache is not None:
+		log('   | ' + str(cache.hits) + ' of ' + str(cache.hits + cache.misses) + ' basis spectra loaded from cache')
+
+	jobs.sort(key=lambda job: -simulation_cost(insysfiles[job[1]], experiments[job[0]][0].b0))
+
+	with cf.ProcessPoolExecutor(max_workers=n_workers) as pool:
+		futures = {}
+		chunk_results = {}
+		for (e, m, missing) in jobs:
+			sim_experiment, TEs = experiments[e]
+			if localized(sim_experiment):
+				# split the spatial grid over the workers
+				chunk_results[(e, m)] = []
+				for chunk in spatial_chunks(sim_experiment, n_workers):
+					futures[pool.submit(timing.timed, simulate_positions, insysfiles[m], sim_experiment, [TEs[t] for t in missing], chunk)] = (e, m, missing)
+			else:
+				futures[pool.submit(timing.timed, simulate_metabolite_tes, insysfiles[m], sim_experiment, [TEs[t] for t in missing])] = (e, m, missing)
+
+		for future in cf.as_completed(futures):
+			(e, m, missing) = futures[future]
+			sim_experiment = experiments[e][0]
+			try:
+				if localized(sim_experiment):
+					chunk_results[(e, m)].append(future.result())
+					if len(chunk_results[(e, m)]) < len(spatial_chunks(sim_experiment, n_workers)):
+						continue
+					metabs, report = timing.timed(localized_metabolites, insysfiles[m], sim_experiment, [chunk_sums for (chunk_sums, report) in chunk_results[(e, m)]], len(spatial_points(sim_experiment)))
+					timings[(e, m)] = timing.merge([report] + [report for (chunk_sums, report) in chunk_results[(e, m)]])
+				else:
+					metabs, timings[(e, m)] = future.result()
+				for (t, metab) in zip(missing, metabs):
+					results[(e, m, t)] = metab
+					if cache is not None:
+						cache.put(keys[(e, m, t)], metab)
+				log('        | Simulation completed for ... ' + insysfiles[m] + ' (' + experiments[e][0].name + ', ' + str(experiments[e][0].b0) + ' MHz)')
+			except Exception as ex:
+				log('        | ERROR: simulation failed for ... ' + insysfiles[m] + ' (' + str(ex) + ')')
+
+	if temporary_cache:
+		shutil.rmtree(args.propagator_cache, ignore_errors=True)
+
+	log('\nTiming')
+	for (e, (sim_experiment, TEs)) in enumerate(experiments):
+		log('   | ' + sim_experiment.name + ', b0 = ' + str(sim_experiment.b0) + ' MHz')
+		reports = OrderedDict(list(calibration_timings[e].items()) + [(insysfiles[m], timings[(e, m)]) for m in range(len(insysfiles)) if (e, m) in timings])
+		for line in timing.summary(reports):
+			log('   ' + line)
+
+	# ---- Write one results file per sequence/field strength/echo time ---- #
+	for (e, (sim_experiment, TEs)) in enumerate(experiments):
+		macromolecules, macromolecules_data = macromolecule_set(sim_experiment.b0)
+
+		for (t, TE) in enumerate(TEs):
+			sim_experiment.TE = TE
+
+			save_dir = results_dir(args.output, sim_experiment, timestamp)
+			if not os.path.exists(save_dir):
+				os.makedirs(save_dir)
+
+			with open(save_dir + results_filename(sim_experiment), 'w') as sim_results:
+				write_results_header(sim_results, sim_experiment, insysfiles, macromolecules, args.macromolecules)
+				for m in range(len(insysfiles)):
+					if results.get((e, m, t)) is not None:
+						write_metabolite_results(sim_results, results[(e, m, t)], TE)
+				if args.macromolecules:
+					write_macromolecule_results(sim_results, macromolecules, macromolecules_data, TE)
+
+			# metabolites simulated together at several echo times share one report
+			timing.write(save_dir + timings_filename(sim_experiment), {'calibration': calibration_timings[e], 'metabolites': OrderedDict((insysfiles[m], timings[(e, m)]) for m in range(len(insysfiles)) if (e, m) in timings), 'echo_times': TEs})
+
+			log('  | Saved ' + save_dir)
+
+			with open(save_dir + 'console.txt', 'w') as console_output_file:
+				console_output_file.write('\n'.join(console))
+
+# ---- Launch Batch ---- #
+if __name__ == "__main__":
+	main(sys.argv[1:])
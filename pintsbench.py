@@ -0,0 +1,143 @@
+from __future__ import print_function
+
+# ---- System Libraries ---- #
+import sys
+import os
+import argparse
+from collections import OrderedDict
+
+# ---- Math Libraries ---- #
+import numpy as np
+
+# ---- Simulation Libraries ---- #
+from simclasses import *
+from pintsbatch import parse_args as batch_args, batch_experiment
+
+# Benchmarks of the PINTS simulation pipeline, e.g.
+#
+#   python pintsbench.py --sequences slaser laser --b0 297.2 --repeat 5
+#   python pintsbench.py --compare 1a2b3c4
+#
+# The benchmarks are the pytest-benchmark tests in benchmarks/ (test_pints.py), which
+# take their cases from this module; pintsbench.py runs them with its options and saves
+# every run in pints/benchmarks (pytest-benchmark's storage, one file per run named by
+# commit). They can also be run with pytest directly, e.g.
+#
+#   python -m pytest benchmarks --rootdir . --pints-b0 297.2 --benchmark-storage pints/benchmarks --benchmark-autosave
+#   python -m pytest benchmarks --rootdir . --pints-b0 297.2 --benchmark-storage pints/benchmarks --benchmark-compare
+#
+# Every full MetaboliteSimulation.simulate run, calibration sweep and binning step is
+# timed --repeat times. The pulse propagator cache is cleared before every run, so each
+# run builds its pulses from scratch.
+
+# ---- Benchmark Cases ---- #
+# representative spin systems, from a singlet to the 7-spin glucose
+benchmark_metabolites = OrderedDict([
+	('singlet',     'creatine_N(CH3)'),
+	('AB',          'aspartate'),
+	('glutamate',   'glutamate'),
+	('myoinositol', 'myoinositol'),
+	('glucose',     'd-glucose-alpha'),
+])
+
+field_names = {123.3: '3T', 297.2: '7T', 400.2: '9.4T'}
+
+# semi-LASER (Bruker) normally reads these from a Bruker data set (see pintsbatch.bruker_params)
+bruker_defaults = {
+	'acq_time': 341E-3, 'dwell_time': 0.000166, 'DigShift': 0,
+	'TE': 20.0, 'TE1': 10, 'TE2': 10,
+	'inpulse90file': 'pints/pulses/rect.exc', 'inpulse180file': 'pints/pulses/sech.inv',
+	'PULSE_90_LENGTH': 500, 'PULSE_180_LENGTH': 4500,
+	'A_90s': (0, 30), 'A_180s': (0, 30),
+}
+
+def benchmark_experiment(sequence, b0, args):
+	# PINTS defaults with fixed (uncalibrated) amplitudes, so runs are comparable
+	defaults = batch_args(['--basis-cache', ''])
+	TE = bruker_defaults['TE'] if sequence == 'slaser_bruker' else args.te
+	sim_experiment = batch_experiment(sequence, b0, TE, defaults, bruker_defaults)
+	sim_experiment.backend = args.backend
+	sim_experiment.reduce_spin_systems = not args.no_reduction
+
+	sim_experiment.A_90  = sim_experiment.A_90s[int(2*np.size(sim_experiment.A_90s)/3)]
+	sim_experiment.A_180 = sim_experiment.A_180s[int(2*np.size(sim_experiment.A_180s)/3)]
+
+	return sim_experiment
+
+def clear_caches():
+	propagator_cache.entries.clear()
+	propagator_cache.cache_dir = ''
+
+# ---- Benchmarks ---- #
+def simulate_run(insysfile, sim_experiment):
+	simulation = MetaboliteSimulation(0, insysfile, sim_experiment)
+	simulation.simulate()
+
+def binning_run(insysfile, sim_experiment):
+	# the simulated transitions are binned repeat times; only binning_code is timed
+	spin_system = read_spin_system(sysfile_path(insysfile, sim_experiment.b0), sim_experiment.RF_OFFSET, sim_experiment.backend, sim_experiment.reduce_spin_systems)
+	Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180 = sequence_pulses(sim_experiment, spin_system, sim_experiment.A_90, sim_experiment.A_180)
+	delays = sequence_delays(sim_experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180)
+	mx = acquire_sequence(sim_experiment, spin_system, Ureal90, refocusing_pulses(Ureal180, delays), delays)
+
+	return lambda: binning_code(mx, sim_experiment.b0, spin_system, sim_experiment.obs_iso, sim_experiment.tolppm, sim_experiment.tolpha, sim_experiment.ppmlo, sim_experiment.ppmhi, sim_experiment.RF_OFFSET)
+
+def calibration_run(sim_experiment, metab_name, n_points, n_workers):
+	# 180-degree calibration sweep over n_points amplitudes of the experiment's grid
+	insysfile = sysfile_path(metab_name + '.sys', sim_experiment.b0)
+	amplitudes = sim_experiment.A_180s[np.round(np.linspace(0, np.size(sim_experiment.A_180s)-1, n_points)).astype(int)]
+
+	return lambda: calibration_sweep(insysfile, metab_name, sim_experiment, 180, amplitudes, None, n_workers)
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='Time the PINTS simulation pipeline (benchmarks/ with pytest-benchmark) and store the results per commit.')
+
+	parser.add_argument('--sequences', nargs='+', default=['slaser', 'slaser_bruker', 'laser'], choices=['slaser', 'laser', 'slaser_bruker'])
+	parser.add_argument('--b0', nargs='+', type=float, default=[123.3, 297.2, 400.2], choices=[123.3, 297.2, 400.2], help='field strengths [MHz]')
+	parser.add_argument('--te', type=float, default=60.0, help='echo time [msec] (semi-LASER (Bruker) uses 20 msec)')
+	parser.add_argument('--metabolites', nargs='+', default=list(benchmark_metabolites.keys()), choices=list(benchmark_metabolites.keys()))
+	parser.add_argument('--calibration-metabolite', default='alanine')
+	parser.add_argument('--calibration-points', type=int, default=8, help='amplitudes in the calibration sweep (0 skips it)')
+	parser.add_argument('--backend', default='pygamma', choices=['pygamma', 'numpy'], help='density-matrix simulation backend (numpy is not a PINTS option yet, see tests/test_densitymatrix.py)')
+	parser.add_argument('--no-reduction', action='store_true', help='numpy backend: simulate every spin system in its full Hilbert space')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark')
+	parser.add_argument('--workers', type=int, default=1, help='worker processes of the calibration sweep')
+
+	parser.add_argument('--output', default='pints/benchmarks', help='pytest-benchmark storage')
+	parser.add_argument('--compare', default='', help='compare with the stored run of this commit (or run number, e.g. 0003)')
+	parser.add_argument('--threshold', type=int, default=20, help='slowdown of the median [%%] that fails a benchmark when comparing')
+
+	return parser.parse_args(argv)
+
+def pytest_args(args):
+	# pytest command line of the benchmarks in benchmarks/ for the options of parse_args
+	# (stored benchmarks are matched by test id, which is relative to --rootdir)
+	root = os.path.dirname(os.path.abspath(__file__))
+	argv = [os.path.join(root, 'benchmarks'), '--rootdir', root, '-p', 'no:cacheprovider', '--benchmark-only', '--benchmark-sort=name', '--benchmark-columns=min,median,max,rounds']
+	argv += ['--pints-sequences'] + args.sequences
+	argv += ['--pints-b0'] + [str(b0) for b0 in args.b0]
+	argv += ['--pints-te', str(args.te)]
+	argv += ['--pints-metabolites'] + args.metabolites
+	argv += ['--pints-calibration-metabolite', args.calibration_metabolite, '--pints-calibration-points', str(args.calibration_points)]
+	argv += ['--pints-backend', args.backend, '--pints-repeat', str(args.repeat), '--pints-workers', str(args.workers)]
+	if args.no_reduction:
+		argv += ['--pints-no-reduction']
+
+	argv += ['--benchmark-storage', args.output, '--benchmark-autosave']
+	if args.compare:
+		# stored runs are named <counter>_<commit>_<date>...
+		argv += ['--benchmark-compare', args.compare if args.compare.isdigit() else '*_' + args.compare, '--benchmark-compare-fail', 'median:' + str(args.threshold) + '%']
+	return argv
+
+def main(argv):
+	import pytest
+	from pytest_benchmark.session import PerformanceRegression
+	try:
+		return pytest.main(pytest_args(parse_args(argv)))
+	except PerformanceRegression:
+		# the regressions are listed in the pytest-benchmark report
+		return 1
+
+# ---- Launch Benchmarks ---- #
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
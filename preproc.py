@@ -2,6 +2,7 @@ import scipy as sp
 import scipy.signal as spsg
 import numpy as np
 import math
+import precision
 
 # ---- water fitting ---- #
 def water_peak_func(t, A, lb):
@@ -65,7 +66,7 @@ def quecc(data_complex, data_complex_water, quecc_points, t):
 	alpha = -np.log(last_point_ecc/last_point_quality) / (sp.pi * last_point_t)
 
 	# Apply filter
-	data_processed_quality = data_processed_quality * np.exp(-sp.pi*alpha*t)
+	data_processed_quality = data_processed_quality * np.exp(-sp.pi*alpha*t).astype(precision.real_dtype())
 
 	# Join arrays
 	data_processed = []
@@ -1,6 +1,14 @@
 # ---- System Libraries ---- #
 from builtins import zip
 from builtins import range
+import os
+import time
+import hashlib
+import copy
+import itertools
+import concurrent.futures as cf
+from collections import OrderedDict
+from functools import partial
 
 # Check for PyQt6 (for native mac M1 compatibility), otherwise continue using PyQt5
 import importlib
@@ -12,584 +20,1319 @@ else:
 
 # ---- Math Libraries ---- #
 import scipy as sp
+import scipy.optimize
 import numpy as np
 import math
 
 # ---- Simulation Libraries ---- #
-import pygamma as pg
+# pygamma is optional when every run uses the NumPy backend (densitymatrix.py)
+pygamma_spec = importlib.util.find_spec("pygamma")
+if pygamma_spec != None:
+	import pygamma as pg
+import densitymatrix
+import timing
+from timing import stage
 
 # ---- Data Classes ---- #
 from magiqdataclasses import *
+import binning
+
+# ---- Propagator Cache ---- #
+class PropagatorCache(object):
+	# Shaped-pulse propagators keyed by pulse file contents, amplitude, pulse
+	# length, RF offset and spin-system topology. Entries are kept in memory
+	# (least recently used are dropped first) and, if cache_dir is set, also
+	# written to disk so other worker processes and later runs can reuse them.
+
+	def __init__(self, max_entries=64, cache_dir=''):
+		self.max_entries = max_entries
+		self.cache_dir = cache_dir
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, inpulsefile, A, pulse_length, gyratio, spin_system, obs_iso, scanner, interpolate, axis_step, rf_offset):
+		params = (file_hash(inpulsefile), float(A), float(pulse_length), float(gyratio), obs_iso, scanner, bool(interpolate), bool(axis_step), float(rf_offset), spin_system_topology(spin_system), simulation_backend(spin_system), isinstance(spin_system, densitymatrix.ReducedSpinSystem))
+		return hashlib.sha1(repr(params).encode('utf-8')).hexdigest()
+
+	def get(self, key):
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return self.entries[key]
+
+		if self.cache_dir:
+			filename = os.path.join(self.cache_dir, key + '.npz')
+			if os.path.exists(filename):
+				try:
+					data = np.load(filename)
+					if 'parts' in data.files:
+						U = [data['U' + str(k)] for k in range(int(data['parts']))]
+					else:
+						U = data['U'] if str(data['backend']) == 'numpy' else array_to_gen_op(data['U'])
+					entry = (float(data['pulse_dur']), float(data['pulsestep']), U)
+					self.__store__(key, entry)
+					self.hits += 1
+					return entry
+				except Exception:
+					pass
+
+		self.misses += 1
+		return None
+
+	def put(self, key, entry):
+		self.__store__(key, entry)
+
+		if self.cache_dir:
+			if not os.path.exists(self.cache_dir):
+				os.makedirs(self.cache_dir)
+			# write to a temporary file first so concurrent workers never read a partial entry
+			filename = os.path.join(self.cache_dir, key + '.npz')
+			tmp_filename = os.path.join(self.cache_dir, key + '.' + str(os.getpid()) + '.tmp.npz')
+			if isinstance(entry[2], list):
+				# one propagator per part of a reduced spin system
+				parts = dict(('U' + str(k), U) for (k, U) in enumerate(entry[2]))
+				np.savez(tmp_filename, pulse_dur=entry[0], pulsestep=entry[1], parts=len(entry[2]), backend='numpy', **parts)
+			elif isinstance(entry[2], np.ndarray):
+				np.savez(tmp_filename, pulse_dur=entry[0], pulsestep=entry[1], U=entry[2], backend='numpy')
+			else:
+				np.savez(tmp_filename, pulse_dur=entry[0], pulsestep=entry[1], U=gen_op_to_array(entry[2]), backend='pygamma')
+			os.replace(tmp_filename, filename)
+
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+
+	def __store__(self, key, entry):
+		self.entries[key] = entry
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+
+# one cache per process
+propagator_cache = PropagatorCache()
+
+# ---- Basis Set Cache ---- #
+# Part of every basis set cache key. Bump it whenever a change to the simulation, the
+# binning or apply_metab_properties changes the metabolites simulated for the same
+# parameters, so entries written by older code are not served again.
+#   1  first version
+#   2  A_m/T2 looked up without the 3T_/7T_/9.4T_ prefix of the spin system file
+CACHE_VERSION = 2
+
+class BasisSetCache(object):
+	# Simulated metabolites (binned ppm/area/phase) stored on disk as compressed .npz files,
+	# keyed by everything that changes the simulation result. Hits refresh the file time;
+	# the least recently used entries are removed once the cache grows past max_entries
+	# files or max_bytes on disk.
+
+	def __init__(self, cache_dir, max_entries=20000, max_bytes=512*1024**2):
+		self.cache_dir = cache_dir
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, insysfile, sim_experiment):
+		# insysfile without the field strength prefix, e.g. 'naa_acetyl.sys'
+		params = (CACHE_VERSION,
+				file_hash(sysfile_path(insysfile, sim_experiment.b0)),
+				insysfile,
+				sim_experiment.name,
+				float(sim_experiment.TE),
+				float(getattr(sim_experiment, 'TE1', 0)),
+				float(getattr(sim_experiment, 'TE2', 0)),
+				float(getattr(sim_experiment, 'DigShift', 0)),
+				float(sim_experiment.b0),
+				sim_experiment.obs_iso,
+				float(sim_experiment.dwell_time),
+				float(sim_experiment.RF_OFFSET),
+				float(sim_experiment.A_90),
+				float(sim_experiment.A_180),
+				file_hash(sim_experiment.inpulse90file),
+				file_hash(sim_experiment.inpulse180file),
+				float(sim_experiment.PULSE_90_LENGTH),
+				float(sim_experiment.PULSE_180_LENGTH),
+				int(getattr(sim_experiment, 'fudge_factor', 0)),
+				float(sim_experiment.tolppm),
+				float(sim_experiment.tolpha),
+				float(sim_experiment.ppmlo),
+				float(sim_experiment.ppmhi),
+				sim_experiment.backend,
+				sim_experiment.backend == 'numpy' and sim_experiment.reduce_spin_systems,
+				tuple(tuple(float(x) for x in positions) for positions in sim_experiment.spatial_positions),
+				tuple(float(G) for G in sim_experiment.slice_gradients))
+		return hashlib.sha1(repr(params).encode('utf-8')).hexdigest()
+
+	def get(self, key):
+		filename = os.path.join(self.cache_dir, key + '.npz')
+		if os.path.exists(filename):
+			try:
+				with np.load(filename) as data:
+					metab = Metabolite()
+					metab.name = str(data['name'])
+					metab.ppm = data['ppm'].tolist()
+					metab.area = data['area'].tolist()
+					metab.phase = data['phase'].tolist()
+					metab.A_m, metab.T2, metab.var = data['properties'].tolist()
+				os.utime(filename, None)
+				self.hits += 1
+				return metab
+			except Exception:
+				pass
+
+		self.misses += 1
+		return None
+
+	def put(self, key, metab):
+		if not os.path.exists(self.cache_dir):
+			os.makedirs(self.cache_dir)
+
+		# write to a temporary file first so a concurrent reader never sees a partial entry
+		filename = os.path.join(self.cache_dir, key + '.npz')
+		tmp_filename = os.path.join(self.cache_dir, key + '.' + str(os.getpid()) + '.tmp.npz')
+		np.savez_compressed(tmp_filename,
+			name=np.array(metab.name),
+			ppm=np.asarray(metab.ppm, dtype=float),
+			area=np.asarray(metab.area, dtype=float),
+			phase=np.asarray(metab.phase, dtype=float),
+			properties=np.array([metab.A_m, metab.T2, metab.var], dtype=float))
+		os.replace(tmp_filename, filename)
+
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for filename in os.listdir(self.cache_dir):
+			if filename.endswith('.npz') and not filename.endswith('.tmp.npz'):
+				stat = os.stat(os.path.join(self.cache_dir, filename))
+				entries.append((stat.st_mtime, stat.st_size, filename))
+
+		entries.sort()
+		total = sum(entry[1] for entry in entries)
+		while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+			mtime, size, filename = entries.pop(0)
+			try:
+				os.remove(os.path.join(self.cache_dir, filename))
+			except OSError:
+				pass
+			total -= size
+
+# ---- Simulation Functions ---- #
+def simulation_cost(insysfile, b0):
+	# rough cost estimate used to schedule the largest spin systems first
+	# (Liouville space grows as 4^N with the number of spins)
+	nspins = 1
+	with open(sysfile_path(insysfile, b0), 'r') as f:
+		for line in f:
+			if line.startswith('NSpins'):
+				nspins = int(line.split(':')[-1])
+				break
+	return 4**nspins
+
+# md5 of every file hashed so far, keyed by path and reused while its size and mtime are unchanged
+file_hashes = {}
+
+def file_hash(filename):
+	if not filename or not os.path.exists(filename):
+		return ''
+	stat = os.stat(filename)
+	version = (stat.st_size, stat.st_mtime_ns)
+	if filename in file_hashes and file_hashes[filename][0] == version:
+		return file_hashes[filename][1]
+	with open(filename, 'rb') as f:
+		digest = hashlib.md5(f.read()).hexdigest()
+	file_hashes[filename] = (version, digest)
+	return digest
+
+def sysfile_path(insysfile, b0):
+	if b0 == 123.3:
+		return 'pints/metabolites/3T_' + insysfile
+	elif b0 == 297.2:
+		return 'pints/metabolites/7T_' + insysfile
+	elif b0 == 400.2:
+		return 'pints/metabolites/9.4T_' + insysfile
+	return insysfile
+
+def simulation_backend(spin_system):
+	return 'numpy' if isinstance(spin_system, (densitymatrix.SpinSystem, densitymatrix.ReducedSpinSystem)) else 'pygamma'
+
+def spin_system_topology(spin_system):
+	# everything about a spin system that changes its Hamiltonian (the name does not)
+	nspins = spin_system.spins()
+	isotopes = tuple(spin_system.symbol(i) for i in range(nspins))
+	shifts = tuple(round(spin_system.PPM(i), 9) for i in range(nspins))
+	couplings = tuple(round(spin_system.J(i, j), 9) for i in range(nspins) for j in range(i+1, nspins))
+	return (spin_system.Omega(), isotopes, shifts, couplings)
+
+def gen_op_to_array(op):
+	if hasattr(op, 'Op'):
+		op = op.Op()	# HSprop from PulComposite.GetUsum
+	op.set_DBR()
+	return np.array(op.toNParray(), dtype=complex)
+
+def array_to_gen_op(arr):
+	mx = pg.matrix(arr.shape[0], arr.shape[1])
+	for i in range(arr.shape[0]):
+		for j in range(arr.shape[1]):
+			mx.put(pg.complex(arr[i, j].real, arr[i, j].imag), i, j)
+	return pg.gen_op(mx)
+
+def shaped_pulse(inpulsefile, A, pulse_length, gyratio, scanner='siemens', interpolate=True):
+	# A: amplitude in milliTesla
+	# Returns the scaled pulse, its time axis and the amplitude/phase arrays handed to pygamma.
+	pulse = Pulse(inpulsefile, pulse_length, scanner)
+
+	if interpolate:
+		n_old = np.linspace(0, pulse_length, np.size(pulse.waveform))
+		n_new = np.linspace(0, pulse_length, np.size(pulse.waveform)+1)
+
+		waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse.waveform)*A)(n_new)
+		waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse.waveform)*A)(n_new)
+	else:
+		n_new = np.linspace(0, pulse_length, np.size(pulse.waveform))
+
+		waveform_real = np.real(pulse.waveform)*A
+		waveform_imag = np.imag(pulse.waveform)*A
+	pulse.waveform = waveform_real + 1j*(waveform_imag)
+
+	if scanner == 'bruker':
+		ampl_arr = np.abs(pulse.waveform)
+	else:
+		ampl_arr = np.abs(pulse.waveform)*gyratio
+	phas_arr = np.unwrap(np.angle(pulse.waveform))*180.0/math.pi
+
+	return pulse, n_new, ampl_arr, phas_arr
+
+def pulse_propagator(inpulsefile, A, pulse_length, gyratio, spin_system, obs_iso, scanner='siemens', interpolate=True, axis_step=False, rf_offset=0.0, label='pulse'):
+	# Returns (pulse duration, pulse step, propagator) for a shaped pulse.
+	# axis_step: use the step of the interpolated time axis instead of the pulse step.
+	return pulse_propagators(inpulsefile, [A], pulse_length, gyratio, spin_system, obs_iso, scanner, interpolate, axis_step, rf_offset, label)[0]
+
+def pulse_propagators(inpulsefile, amplitudes, pulse_length, gyratio, spin_system, obs_iso, scanner='siemens', interpolate=True, axis_step=False, rf_offset=0.0, label='pulse'):
+	# pulse_propagator for every amplitude. With the NumPy backend the amplitudes missing
+	# from the cache are propagated together as one stack of matrices.
+	keys = [propagator_cache.key(inpulsefile, A, pulse_length, gyratio, spin_system, obs_iso, scanner, interpolate, axis_step, rf_offset) for A in amplitudes]
+
+	entries = {}
+	todo = OrderedDict()
+	for (A, key) in zip(amplitudes, keys):
+		if key not in entries:
+			entries[key] = propagator_cache.get(key)
+			if entries[key] is None:
+				todo[key] = A
+
+	if todo:
+		with stage('pulse shape'):
+			pulses = [shaped_pulse(inpulsefile, A, pulse_length, gyratio, scanner, interpolate) for A in todo.values()]
+		pulse, n_new = pulses[0][0], pulses[0][1]
+		step = n_new[1] if axis_step else pulse.pulsestep
+		pulse_dur = np.size(pulse.waveform) * pulse.pulsestep
+
+		with stage('pulse propagators'):
+			if simulation_backend(spin_system) == 'numpy':
+				Us = densitymatrix.pulse_propagators(spin_system, obs_iso, [p[2] for p in pulses], [p[3] for p in pulses], step)
+			else:
+				Us = [gamma_pulse_propagator(spin_system, obs_iso, p[2], p[3], step, label) for p in pulses]
+
+		for (key, U) in zip(todo, Us):
+			entries[key] = (pulse_dur, pulse.pulsestep, U)
+			propagator_cache.put(key, entries[key])
+
+	return [entries[key] for key in keys]
+
+def gamma_pulse_propagator(spin_system, obs_iso, ampl_arr, phas_arr, step, label):
+	pwave = pg.row_vector(len(ampl_arr))
+	ptime = pg.row_vector(len(ampl_arr))
+	for j, val in enumerate(zip(ampl_arr, phas_arr)):
+		pwave.put(pg.complex(val[0],val[1]), j)
+		ptime.put(pg.complex(step,0), j)
+
+	pwf = pg.PulWaveform(pwave, ptime, label)
+	pulc = pg.PulComposite(pwf, spin_system, obs_iso)
+
+	return pulc.GetUsum(-1)
+
+def sequence_pulse_params(sim_experiment, flip, interpolate_ahp=False):
+	# (pulse file, pulse length, scanner, interpolate, axis_step, label) of the
+	# experiment's 90- or 180-degree pulse
+	if sim_experiment.name == "semi-LASER (Bruker)":
+		scanner, interpolate_90, interpolate_180 = 'bruker', True, True
+	elif sim_experiment.name == "semi-LASER":
+		scanner, interpolate_90, interpolate_180 = 'siemens', True, True
+	elif sim_experiment.name == "LASER":
+		scanner, interpolate_90, interpolate_180 = 'varian', interpolate_ahp, False
+
+	if flip == 90:
+		return sim_experiment.inpulse90file, sim_experiment.PULSE_90_LENGTH, scanner, interpolate_90, False, "90excite"
+	return sim_experiment.inpulse180file, sim_experiment.PULSE_180_LENGTH, scanner, interpolate_180, True, "180afp"
+
+def sequence_pulses(sim_experiment, spin_system, A_90, A_180, ideal_90=False, interpolate_ahp=False):
+	# Returns (Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180) for the
+	# experiment's sequence. With ideal_90 the 90-degree pulse is left to acquire_sequence.
+	return sequence_pulses_batch(sim_experiment, spin_system, [A_90], [A_180], ideal_90, interpolate_ahp)[0]
+
+def sequence_pulses_batch(sim_experiment, spin_system, A_90s, A_180s, ideal_90=False, interpolate_ahp=False):
+	# sequence_pulses for every pair of amplitudes (A_90s[i], A_180s[i]). Each pulse is
+	# built for all of its amplitudes in one batch (see pulse_propagators).
+	gyratio = sim_experiment.getGyratio()
+	obs_iso = sim_experiment.obs_iso
+	rf_off = sim_experiment.RF_OFFSET
+
+	if ideal_90:
+		pulses_90 = [(0, 0, None)] * len(A_90s)
+	else:
+		inpulsefile, pulse_length, scanner, interpolate, axis_step, label = sequence_pulse_params(sim_experiment, 90, interpolate_ahp)
+		pulses_90 = pulse_propagators(inpulsefile, A_90s, pulse_length, gyratio, spin_system, obs_iso, scanner, interpolate, axis_step, rf_off, label)
+
+	inpulsefile, pulse_length, scanner, interpolate, axis_step, label = sequence_pulse_params(sim_experiment, 180, interpolate_ahp)
+	pulses_180 = pulse_propagators(inpulsefile, A_180s, pulse_length, gyratio, spin_system, obs_iso, scanner, interpolate, axis_step, rf_off, label)
+
+	out = []
+	for ((pulse_dur_90, pulsestep_90, Ureal90), (pulse_dur_180, pulsestep_180, Ureal180)) in zip(pulses_90, pulses_180):
+		peak_to_end_90 = 0 if ideal_90 else excitation_peak_to_end(sim_experiment, pulse_dur_90, pulsestep_90)
+		out.append((Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180))
+
+	return out
+
+def excitation_peak_to_end(sim_experiment, pulse_dur_90, pulsestep_90):
+	# time from the peak of the SLR excitation pulse to its end (semi-LASER only)
+	if sim_experiment.name == "semi-LASER":
+		return pulse_dur_90 - (209 + sim_experiment.fudge_factor) * pulsestep_90
+	return 0
+
+def sequence_delays(sim_experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180, crushers=False):
+	# Free evolution delays between the pulses (sec), one more than there are refocusing pulses.
+	if sim_experiment.name == "semi-LASER (Bruker)":
+		TE1 = sim_experiment.TE1 * 1E-3
+		TE2 = sim_experiment.TE2 * 1E-3
+
+		delay1 = TE1/2.0 - pulse_dur_90/2.0 - pulse_dur_180/2.0
+		delay2 = TE1/2.0 + TE2/2.0 - pulse_dur_180
+		delay3 = TE2 - pulse_dur_180
+		delay4 = delay2
+		delay5 = TE1/2.0 - pulse_dur_180 + sim_experiment.DigShift
+
+		return [delay1, delay2, delay3, delay4, delay5]
+
+	elif sim_experiment.name == "semi-LASER":
+		TE = sim_experiment.TE
+		TE1 = float((TE * 0.31) / 1000.0)
+		TE3 = float((TE * 0.31) / 1000.0)
+		TE2 = float(TE/1000.0 - TE1 - TE3)
+		TE_fill = TE/1000.0 - TE1 - TE2 - TE3
+
+		delay1 = TE1/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0 - peak_to_end_90
+		delay2 = TE1/2.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
+		delay3 = TE2/4.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
+		delay4 = TE2/4.0 + TE_fill/8.0 + TE3/2.0 + TE_fill/8.0 - pulse_dur_180
+		delay5 = TE3/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0
+
+		return [delay1, delay2, delay3, delay4, delay5]
+
+	elif sim_experiment.name == "LASER":
+		# calculate pulse timings
+		ROF1 = 100E-6    #sec
+		ROF2 = 10E-6     #sec
+		TCRUSH1 = 0.0008 #sec
+		TCRUSH2 = 0.0008 #sec
+
+		# the crusher delays are only included in the calibration experiments
+		ss_grad_rfDelayFront = TCRUSH1 - ROF1 if crushers else 0
+		ss_grad_rfDelayBack  = TCRUSH2 - ROF2 if crushers else 0
+		ro_grad_atDelayFront = 0
+		ro_grad_atDelayBack  = 0
+
+		TE  = sim_experiment.TE / 1000.
+		ipd = (TE - pulse_dur_90 \
+				  - 6*(ss_grad_rfDelayFront + pulse_dur_180 + ss_grad_rfDelayBack) \
+				  - ro_grad_atDelayFront) / 12
+
+		delay1 = ipd + ss_grad_rfDelayFront
+		delay2 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
+		delay3 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
+		delay4 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
+		delay5 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
+		delay6 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
+		delay7 = ss_grad_rfDelayBack + ipd + ro_grad_atDelayFront
+
+		return [delay1, delay2, delay3, delay4, delay5, delay6, delay7]
+
+def acquire_sequence(sim_experiment, spin_system, Ureal90, Ureal180s, delays, H=None):
+	# Ureal90 = None applies an ideal 90-degree pulse.
+	# Ureal180s: one propagator per refocusing pulse (see refocusing_pulses)
+	if simulation_backend(spin_system) == 'numpy':
+		return densitymatrix.acquire(spin_system, sim_experiment.obs_iso, Ureal90, Ureal180s, [delays], H)[0]
+
+	with stage('evolution'):
+		if H is None:
+			H = pg.Hcs(spin_system) + pg.HJ(spin_system)
+		D = pg.Fm(spin_system, sim_experiment.obs_iso)
+		ACQ = pg.acquire1D(pg.gen_op(D), H, sim_experiment.dwell_time)
+
+		sigma1 = excite(sim_experiment, spin_system, Ureal90)
+
+		for (i, delay) in enumerate(delays):
+			with stage('delay propagators'):
+				U = pg.prop(H, delay)
+			sigma0 = pg.evolve(sigma1, U)
+			if i < len(delays) - 1:
+				sigma1 = apply_pulse(Ureal180s[i], sigma0)	# apply AFP
+
+	# acquire
+	with stage('acquisition'):
+		return pg.TTable1D(ACQ.table(sigma0))
+
+def refocusing_pulses(Ureal180, delays):
+	# the same propagator for every refocusing pulse of the sequence
+	return [Ureal180] * (len(delays) - 1)
+
+def excite(sim_experiment, spin_system, Ureal90):
+	sigma0 = pg.sigma_eq(spin_system)	# init
+	if Ureal90 is None:
+		return pg.Ixpuls(spin_system, sigma0, sim_experiment.obs_iso, 90.0)	# apply ideal 90-degree pulse
+	return apply_pulse(Ureal90, sigma0)		# apply 90-degree pulse
+
+def apply_pulse(U, sigma):
+	# propagators read back from the on-disk cache are plain gen_ops
+	if hasattr(U, 'evolve'):
+		return U.evolve(sigma)
+	return pg.evolve(sigma, U)
+
+def acquire_sequence_tes(sim_experiment, spin_system, Ureal90, Ureal180s, delays_list, H=None):
+	# Same as acquire_sequence for many sets of delays (one per TE). The pulses and H do not
+	# change, so everything is done once in the eigenbasis of H, where free evolution for a
+	# delay t is an element-wise phase: sigma_jk -> sigma_jk exp(-2 pi i (E_j - E_k) t)
+	# (pygamma's prop(H, t) = exp(-2 pi i H t) with H in Hz). Each TE then only costs the
+	# matrix products of the refocusing pulses.
+	if simulation_backend(spin_system) == 'numpy':
+		return densitymatrix.acquire(spin_system, sim_experiment.obs_iso, Ureal90, Ureal180s, delays_list, H)
+
+	with stage('delay propagators'):
+		if H is None:
+			H = pg.Hcs(spin_system) + pg.HJ(spin_system)
+		D = pg.Fm(spin_system, sim_experiment.obs_iso)
+		ACQ = pg.acquire1D(pg.gen_op(D), H, sim_experiment.dwell_time)
+
+		E, V = np.linalg.eigh(gen_op_to_array(H))
+		Vh = np.conj(V.T)
+		dE = E[:, np.newaxis] - E[np.newaxis, :]
+
+	with stage('evolution'):
+		sigma1 = np.dot(Vh, np.dot(gen_op_to_array(excite(sim_experiment, spin_system, Ureal90)), V))
+		Us = {}
+		for U in Ureal180s:
+			if id(U) not in Us:
+				Us[id(U)] = np.dot(Vh, np.dot(gen_op_to_array(U), V))
+
+	tables = []
+	for delays in delays_list:
+		with stage('evolution'):
+			sigma = sigma1
+			for (i, delay) in enumerate(delays):
+				sigma = sigma * np.exp(-2j*np.pi*dE*delay)
+				if i < len(delays) - 1:
+					U = Us[id(Ureal180s[i])]
+					sigma = np.dot(U, np.dot(sigma, np.conj(U.T)))	# apply AFP
 
-# ---- Simulation Class ---- #
-class MetaboliteSimulation(QtCore.QObject):
-
-	postToConsole = QtCore.pyqtSignal(str)
-	outputResults = QtCore.pyqtSignal(object)
-	finished = QtCore.pyqtSignal(int)
-
-	def __init__(self, thread_num, insysfile, sim_experiment):
-		
-		QtCore.QObject.__init__(self)
-
-		self.thread_num = thread_num
-		self.insysfile = insysfile
-		self.sim_experiment = sim_experiment
-
-	def simulate(self):
-		self.postToConsole.emit('   | Simulating ... ' + self.insysfile)
-		print('    | Simulating ...' + self.insysfile)
-
-		metab_name = self.insysfile.replace('.sys','')
-
-		if self.sim_experiment.b0 == 123.3:
-			self.insysfile = 'pints/metabolites/3T_' + self.insysfile
-		elif self.sim_experiment.b0 == 297.2:
-			self.insysfile = 'pints/metabolites/7T_' + self.insysfile
-		elif self.sim_experiment.b0 == 400.2:
-			self.insysfile = 'pints/metabolites/9.4T_' + self.insysfile
-
-		if self.sim_experiment.name == "semi-LASER (Bruker)":
-			spin_system = pg.spin_system()
-			spin_system.read(self.insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
-
-			TE = self.sim_experiment.TE * 1E-3
-			TE1 = self.sim_experiment.TE1 * 1E-3
-			TE2 = self.sim_experiment.TE2 * 1E-3
-
-			# build 90 degree pulse
-			inpulse90file = self.sim_experiment.inpulse90file
-			A_90 = self.sim_experiment.A_90
-			PULSE_90_LENGTH = self.sim_experiment.PULSE_90_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse90 = Pulse(inpulse90file, PULSE_90_LENGTH, 'bruker')
-
-			n_old = np.linspace(0, PULSE_90_LENGTH, sp.size(pulse90.waveform))
-			n_new = np.linspace(0, PULSE_90_LENGTH, sp.size(pulse90.waveform)+1)
-
-			waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse90.waveform)*A_90)(n_new)
-			waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse90.waveform)*A_90)(n_new)
-			pulse90.waveform = waveform_real + 1j*(waveform_imag)
-
-			ampl_arr = np.abs(pulse90.waveform)
-			phas_arr = np.unwrap(np.angle(pulse90.waveform))*180.0/math.pi
-			
-			pulse = pg.row_vector(len(pulse90.waveform))
-			ptime = pg.row_vector(len(pulse90.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(pulse90.pulsestep,0), j)
-
-			pulse_dur_90 = pulse.size() * pulse90.pulsestep
-			pwf_90 = pg.PulWaveform(pulse, ptime, "90excite")
-			pulc_90 = pg.PulComposite(pwf_90, spin_system, self.sim_experiment.obs_iso)
-
-			Ureal90 = pulc_90.GetUsum(-1)
-
-			# build 180 degree pulse
-			inpulse180file = self.sim_experiment.inpulse180file
-			A_180 = self.sim_experiment.A_180
-			PULSE_180_LENGTH = self.sim_experiment.PULSE_180_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse180 = Pulse(inpulse180file, PULSE_180_LENGTH, 'bruker')
+		# acquire
+		with stage('acquisition'):
+			tables.append(pg.TTable1D(ACQ.table(array_to_gen_op(np.dot(V, np.dot(sigma, Vh))))))
+
+	return tables
+
+def read_spin_system(insysfile, rf_off, backend='pygamma', reduce=False):
+	# backend: 'pygamma' or 'numpy' (densitymatrix.py)
+	# reduce: split NumPy spin systems into uncoupled parts and total spins of
+	# magnetically equivalent groups (see densitymatrix.reduce_spin_system)
+	with stage('spin system read'):
+		spin_system = densitymatrix.SpinSystem() if backend == 'numpy' else pg.spin_system()
+		spin_system.read(insysfile)
+		for i in range(spin_system.spins()):
+			spin_system.PPM(i, spin_system.PPM(i) - rf_off)
+		if reduce and backend == 'numpy':
+			return densitymatrix.reduce_spin_system(spin_system)
+		return spin_system
+
+def binning_code(mx, b0, spin_system, obs_iso, tolppm, tolpha, ppmlo, ppmhi, rf_off):
+
+	# See binning.py for a description of the line normalization and blending.
+
+	field  = b0
+	nspins = spin_system.spins()
+
+	nlines = mx.size()
+
+	obs_qn = densitymatrix.isotope_qn(obs_iso)
+
+	qnscale = 1.0
+	for i in range(nspins):
+		qnscale *= 2*spin_system.qn(i)+1
+	qnscale = qnscale / (2.0 * (2.0*obs_qn+1))
+
+	with stage('binning'):
+		if isinstance(mx, densitymatrix.TransitionTable):
+			freqs = -1 * mx.Fr/(2.0*binning.PI*field)
+			intensities = mx.I
+		else:
+			indx = mx.Sort(0,-1,0)
+
+			freqs = np.zeros(nlines)
+			intensities = np.zeros(nlines, dtype=complex)
+			for i in range(nlines):
+				freqs[i] = -1 * mx.Fr(indx[i])/(2.0*binning.PI*field)
+				val = mx.I(indx[i])
+				intensities[i] = val.real() + 1j*val.imag()
+
+		return binning.bin_transitions(freqs, intensities, qnscale, tolppm, tolpha, ppmlo, ppmhi, rf_off)
+
+def apply_metab_properties(metab_name, var, outf, outa, outp, insysfile):
+
+	metab = Metabolite()
+	metab.name = metab_name
+	metab.var = var
+
+	for i in range(np.size(outf)):
+		if outf[i] <= 5:
+			metab.ppm.append(outf[i])
+			metab.area.append(outa[i])
+			metab.phase.append(-1.0*outp[i])
+
+	insysfile = insysfile.replace('pints/metabolites/3T_', '')
+	insysfile = insysfile.replace('pints/metabolites/7T_', '')
+	insysfile = insysfile.replace('pints/metabolites/9.4T_', '')
+
+	if insysfile == 'alanine.sys': #
+		metab.A_m = 0.078
+		metab.T2 = (87E-3)
+	elif insysfile == 'aspartate.sys':
+		metab.A_m = 0.117
+		metab.T2 = (87E-3)
+	elif insysfile == 'choline_1-CH2_2-CH2.sys': #
+		metab.A_m = 0.165
+		metab.T2 = (87E-3)
+	elif insysfile == 'choline_N(CH3)3_a.sys' or insysfile == 'choline_N(CH3)3_b.sys': #
+		metab.A_m = 0.165
+		metab.T2 = (121E-3)
+	elif insysfile == 'creatine_N(CH3).sys':
+		metab.A_m = 0.296
+		metab.T2 = (90E-3)
+	elif insysfile == 'creatine_X.sys':
+		metab.A_m = 0.296
+		metab.T2 = (81E-3)
+	elif insysfile == 'd-glucose-alpha.sys': #
+		metab.A_m = 0.049
+		metab.T2 = (87E-3)
+	elif insysfile == 'd-glucose-beta.sys': #
+		metab.A_m = 0.049
+		metab.T2 = (87E-3)
+	elif insysfile == 'eth.sys': #
+		metab.A_m = 0.320
+		metab.T2 = (87E-3)
+	elif insysfile == 'gaba.sys': #
+		metab.A_m = 0.155
+		metab.T2 = (82E-3)
+	elif insysfile == 'glutamate.sys':
+		metab.A_m = 0.898
+		metab.T2 = (88E-3)
+	elif insysfile == 'glutamine.sys':
+		metab.A_m = 0.427
+		metab.T2 = (87E-3)
+	elif insysfile == 'glutathione_cysteine.sys':
+		metab.A_m = 0.194
+		metab.T2 = (87E-3)
+	elif insysfile == 'glutathione_glutamate.sys':
+		metab.A_m = 0.194
+		metab.T2 = (87E-3)
+	elif insysfile == 'glutathione_glycine.sys':
+		metab.A_m = 0.194
+		metab.T2 = (87E-3)
+	elif insysfile == 'glycine.sys':
+		metab.A_m = 0.068
+		metab.T2 = (87E-3)
+	elif insysfile == 'gpc_7-CH2_8-CH2.sys': #
+		metab.A_m = 0.097
+		metab.T2 = (87E-3)
+	elif insysfile == 'gpc_glycerol.sys': #
+		metab.A_m = 0.097
+		metab.T2 = (87E-3)
+	elif insysfile == 'gpc_N(CH3)3_a.sys': #
+		metab.A_m = 0.097
+		metab.T2 = (121E-3)
+	elif insysfile == 'gpc_N(CH3)3_b.sys': #
+		metab.A_m = 0.097
+		metab.T2 = (121E-3)
+	elif insysfile == 'lactate.sys': #
+		metab.A_m = 0.039
+		metab.T2 = (87E-3)
+	elif insysfile == 'myoinositol.sys':
+		metab.A_m = 0.578
+		metab.T2 = (87E-3)
+	elif insysfile == 'naa_acetyl.sys':
+		metab.A_m = 1.000
+		metab.T2 = (130E-3)
+	elif insysfile == 'naa_aspartate.sys':
+		metab.A_m = 1.000
+		metab.T2 = (69E-3)
+	elif insysfile == 'naag_acetyl.sys':
+		metab.A_m = 0.160
+		metab.T2 = (130E-3)
+	elif insysfile == 'naag_aspartyl.sys':
+		metab.A_m = 0.160
+		metab.T2 = (87E-3)
+	elif insysfile == 'naag_glutamate.sys':
+		metab.A_m = 0.160
+		metab.T2 = (87E-3)
+	elif insysfile == 'pcho_N(CH3)3_a.sys': #
+		metab.A_m = 0.058
+		metab.T2 = (121E-3)
+	elif insysfile == 'pcho_N(CH3)3_b.sys': #
+		metab.A_m = 0.058
+		metab.T2 = (121E-3)
+	elif insysfile == 'pcho_X.sys': #
+		metab.A_m = 0.058
+		metab.T2 = (87E-3)
+	elif insysfile == 'pcr_N(CH3).sys':
+		metab.A_m = 0.422
+		metab.T2 = (90E-3)
+	elif insysfile == 'pcr_X.sys':
+		metab.A_m = 0.422
+		metab.T2 = (81E-3)
+	elif insysfile == 'peth.sys':
+		metab.A_m = 0.126
+		metab.T2 = (87E-3)
+	elif insysfile == 'scyllo-inositol.sys':
+		metab.A_m = 0.044
+		metab.T2 = (87E-3)
+	elif insysfile == 'taurine.sys':
+		metab.A_m = 0.117
+		metab.T2 = (85E-3)
+	elif insysfile == 'water.sys':
+		metab.A_m = 1.000
+		metab.T2 = (43.60E-3)
+
+	return metab
+
+def simulate_metabolite(insysfile, sim_experiment):
+	# Runs in a worker process, so it must not touch any Qt objects.
+	print('    | Simulating ...' + insysfile)
+
+	if localized(sim_experiment):
+		points = spatial_points(sim_experiment)
+		return localized_metabolites(insysfile, sim_experiment, [simulate_positions(insysfile, sim_experiment, [sim_experiment.TE], points)], len(points))[0]
+
+	propagator_cache.cache_dir = sim_experiment.propagator_cache_dir
+
+	metab_name = insysfile.replace('.sys','')
+	insysfile = sysfile_path(insysfile, sim_experiment.b0)
+
+	spin_system = read_spin_system(insysfile, sim_experiment.RF_OFFSET, sim_experiment.backend, sim_experiment.reduce_spin_systems)
+
+	Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180 = sequence_pulses(sim_experiment, spin_system, sim_experiment.A_90, sim_experiment.A_180)
+	delays = sequence_delays(sim_experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180)
+	mx = acquire_sequence(sim_experiment, spin_system, Ureal90, refocusing_pulses(Ureal180, delays), delays)
+
+	# binning to remove degenerate peaks
+	outf, outa, outp = binning_code(mx, sim_experiment.b0, spin_system, sim_experiment.obs_iso, sim_experiment.tolppm, sim_experiment.tolpha, sim_experiment.ppmlo, sim_experiment.ppmhi, sim_experiment.RF_OFFSET)
+
+	return apply_metab_properties(metab_name, 0.0, outf, outa, outp, insysfile)
+
+def simulate_metabolite_tes(insysfile, sim_experiment, TEs):
+	# Simulates one metabolite at several echo times (msec). The spin system, Hamiltonian
+	# and pulse propagators do not depend on TE, so they are only built once.
+	print('    | Simulating ...' + insysfile + ' at ' + str(len(TEs)) + ' echo times')
+
+	if localized(sim_experiment):
+		points = spatial_points(sim_experiment)
+		return localized_metabolites(insysfile, sim_experiment, [simulate_positions(insysfile, sim_experiment, TEs, points)], len(points))
+
+	propagator_cache.cache_dir = sim_experiment.propagator_cache_dir
+
+	metab_name = insysfile.replace('.sys','')
+	insysfile = sysfile_path(insysfile, sim_experiment.b0)
+
+	spin_system = read_spin_system(insysfile, sim_experiment.RF_OFFSET, sim_experiment.backend, sim_experiment.reduce_spin_systems)
+	H = densitymatrix.hamiltonian(spin_system) if sim_experiment.backend == 'numpy' else pg.Hcs(spin_system) + pg.HJ(spin_system)
+
+	Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180 = sequence_pulses(sim_experiment, spin_system, sim_experiment.A_90, sim_experiment.A_180)
+
+	experiment = copy.copy(sim_experiment)
+	delays_list = []
+	for TE in TEs:
+		experiment.TE = TE
+		delays_list.append(sequence_delays(experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180))
+
+	# only the free evolution propagators change with TE
+	mxs = acquire_sequence_tes(sim_experiment, spin_system, Ureal90, refocusing_pulses(Ureal180, delays_list[0]), delays_list, H)
+
+	metabs = []
+	for mx in mxs:
+		# binning to remove degenerate peaks
+		outf, outa, outp = binning_code(mx, experiment.b0, spin_system, experiment.obs_iso, experiment.tolppm, experiment.tolpha, experiment.ppmlo, experiment.ppmhi, experiment.RF_OFFSET)
 
-			n_old = np.linspace(0, PULSE_180_LENGTH, sp.size(pulse180.waveform))
-			n_new = np.linspace(0, PULSE_180_LENGTH, sp.size(pulse180.waveform)+1)
+		metabs.append(apply_metab_properties(metab_name, 0.0, outf, outa, outp, insysfile))
 
-			waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse180.waveform)*A_180)(n_new)
-			waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse180.waveform)*A_180)(n_new)
-			pulse180.waveform = waveform_real + 1j*(waveform_imag)
+	return metabs
 
-			ampl_arr = np.abs(pulse180.waveform)
-			phas_arr = np.unwrap(np.angle(pulse180.waveform))*180.0/math.pi
-			freq_arr = np.gradient(phas_arr)
+def calibration_point(insysfile, metab_name, sim_experiment, flip, A_fixed, A):
+	# Peak intensity of the calibration metabolite for one RF amplitude.
+	# flip == 180: sweep the AFP amplitude A with an ideal 90-degree pulse
+	# flip == 90:  sweep the excitation amplitude A with AFPs at A_fixed
+	return calibration_points(insysfile, metab_name, sim_experiment, flip, A_fixed, [A])[0]
 
-			pulse = pg.row_vector(len(pulse180.waveform))
-			ptime = pg.row_vector(len(pulse180.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(n_new[1],0), j)
+def calibration_points(insysfile, metab_name, sim_experiment, flip, A_fixed, amplitudes):
+	# calibration_point for a batch of amplitudes; the swept pulse is built for all of them at once.
+	propagator_cache.cache_dir = sim_experiment.propagator_cache_dir
 
-			pulse_dur_180 = pulse.size() * pulse180.pulsestep
-			pwf_180 = pg.PulWaveform(pulse, ptime, "180afp")
-			pulc_180 = pg.PulComposite(pwf_180, spin_system, self.sim_experiment.obs_iso)
+	spin_system = read_spin_system(insysfile, sim_experiment.RF_OFFSET, sim_experiment.backend, sim_experiment.reduce_spin_systems)
 
-			Ureal180 = pulc_180.GetUsum(-1)
+	n = np.size(amplitudes)
+	if flip == 180:
+		pulses = sequence_pulses_batch(sim_experiment, spin_system, [None]*n, amplitudes, True, True)
+	else:
+		pulses = sequence_pulses_batch(sim_experiment, spin_system, amplitudes, [A_fixed]*n, False, True)
 
-			H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-			D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-			ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-			ACQ = ac
-
-			delay1 = TE1/2.0 - pulse_dur_90/2.0 - pulse_dur_180/2.0
-			delay2 = TE1/2.0 + TE2/2.0 - pulse_dur_180
-			delay3 = TE2 - pulse_dur_180
-			delay4 = delay2
-			delay5 = TE1/2.0 - pulse_dur_180 + self.sim_experiment.DigShift
-
-			Udelay1 = pg.prop(H, delay1)
-			Udelay2 = pg.prop(H, delay2)
-			Udelay3 = pg.prop(H, delay3)
-			Udelay4 = pg.prop(H, delay4)
-			Udelay5 = pg.prop(H, delay5)
-
-			sigma0 = pg.sigma_eq(spin_system)	# init
-			sigma1 = Ureal90.evolve(sigma0)		# apply 90-degree pulse
-			sigma0 = pg.evolve(sigma1, Udelay1)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-			sigma0 = pg.evolve(sigma1, Udelay2)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-			sigma0 = pg.evolve(sigma1, Udelay3)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-			sigma0 = pg.evolve(sigma1, Udelay4)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-			sigma0 = pg.evolve(sigma1, Udelay5)
-
-		elif self.sim_experiment.name == "semi-LASER":
-			spin_system = pg.spin_system()
-			spin_system.read(self.insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
-
-			TE = self.sim_experiment.TE
-			TE1 = float((TE * 0.31) / 1000.0)
-			TE3 = float((TE * 0.31) / 1000.0)
-			TE2 = float(TE/1000.0 - TE1 - TE3)
-			TE_fill = TE/1000.0 - TE1 - TE2 - TE3
-
-			# build 90 degree pulse
-			inpulse90file = self.sim_experiment.inpulse90file
-			A_90 = self.sim_experiment.A_90
-			PULSE_90_LENGTH = self.sim_experiment.PULSE_90_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse90 = Pulse(inpulse90file, PULSE_90_LENGTH)
-
-			n_old = np.linspace(0, PULSE_90_LENGTH, sp.size(pulse90.waveform))
-			n_new = np.linspace(0, PULSE_90_LENGTH, sp.size(pulse90.waveform)+1)
-
-			waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse90.waveform)*A_90)(n_new)
-			waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse90.waveform)*A_90)(n_new)
-			pulse90.waveform = waveform_real + 1j*(waveform_imag)
-
-			ampl_arr = np.abs(pulse90.waveform)*gyratio
-			phas_arr = np.unwrap(np.angle(pulse90.waveform))*180.0/math.pi
-			
-			pulse = pg.row_vector(len(pulse90.waveform))
-			ptime = pg.row_vector(len(pulse90.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(pulse90.pulsestep,0), j)
-
-			pulse_dur_90 = pulse.size() * pulse90.pulsestep
-			peak_to_end_90 = pulse_dur_90 - (209 + self.sim_experiment.fudge_factor) * pulse90.pulsestep
-			pwf_90 = pg.PulWaveform(pulse, ptime, "90excite")
-			pulc_90 = pg.PulComposite(pwf_90, spin_system, self.sim_experiment.obs_iso)
-
-			Ureal90 = pulc_90.GetUsum(-1)
-
-			# build 180 degree pulse
-			inpulse180file = self.sim_experiment.inpulse180file
-			A_180 = self.sim_experiment.A_180
-			PULSE_180_LENGTH = self.sim_experiment.PULSE_180_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse180 = Pulse(inpulse180file, PULSE_180_LENGTH)
-
-			n_old = np.linspace(0, PULSE_180_LENGTH, sp.size(pulse180.waveform))
-			n_new = np.linspace(0, PULSE_180_LENGTH, sp.size(pulse180.waveform)+1)
-
-			waveform_real = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.real(pulse180.waveform)*A_180)(n_new)
-			waveform_imag = sp.interpolate.InterpolatedUnivariateSpline(n_old, np.imag(pulse180.waveform)*A_180)(n_new)
-			pulse180.waveform = waveform_real + 1j*(waveform_imag)
-
-			ampl_arr = np.abs(pulse180.waveform)*gyratio
-			phas_arr = np.unwrap(np.angle(pulse180.waveform))*180.0/math.pi
-			freq_arr = np.gradient(phas_arr)
-
-			pulse = pg.row_vector(len(pulse180.waveform))
-			ptime = pg.row_vector(len(pulse180.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(n_new[1],0), j)
-
-			pulse_dur_180 = pulse.size() * pulse180.pulsestep
-			pwf_180 = pg.PulWaveform(pulse, ptime, "180afp")
-			pulc_180 = pg.PulComposite(pwf_180, spin_system, self.sim_experiment.obs_iso)
-
-			Ureal180 = pulc_180.GetUsum(-1)
+	if sim_experiment.name == "semi-LASER (Bruker)":
+		TE = sim_experiment.TE * 1E-3
+	elif sim_experiment.name == "semi-LASER":
+		TE = sim_experiment.TE
+	else:
+		TE = sim_experiment.TE / 1000.
 
-			H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-			D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-			ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-			ACQ = ac
-
-			delay1 = TE1/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0 - peak_to_end_90
-			delay2 = TE1/2.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-			delay3 = TE2/4.0 + TE_fill/8.0 + TE2/4.0 + TE_fill/8.0 - pulse_dur_180
-			delay4 = TE2/4.0 + TE_fill/8.0 + TE3/2.0 + TE_fill/8.0 - pulse_dur_180
-			delay5 = TE3/2.0 + TE_fill/8.0                         - pulse_dur_180/2.0
-
-			Udelay1 = pg.prop(H, delay1)
-			Udelay2 = pg.prop(H, delay2)
-			Udelay3 = pg.prop(H, delay3)
-			Udelay4 = pg.prop(H, delay4)
-			Udelay5 = pg.prop(H, delay5)
-
-			sigma0 = pg.sigma_eq(spin_system)	# init
-			sigma1 = Ureal90.evolve(sigma0)		# apply 90-degree pulse
-			sigma0 = pg.evolve(sigma1, Udelay1)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-			sigma0 = pg.evolve(sigma1, Udelay2)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-			sigma0 = pg.evolve(sigma1, Udelay3)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-			sigma0 = pg.evolve(sigma1, Udelay4)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-			sigma0 = pg.evolve(sigma1, Udelay5)
-
-		elif self.sim_experiment.name == "LASER":
-			spin_system = pg.spin_system()
-			spin_system.read(self.insysfile)
-			for i in range(spin_system.spins()):
-				spin_system.PPM(i, spin_system.PPM(i) - self.sim_experiment.RF_OFFSET)
-
-			# build 90 degree AHP pulse
-			inpulse90file = self.sim_experiment.inpulse90file
-			A_90 = self.sim_experiment.A_90
-			PULSE_90_LENGTH = self.sim_experiment.PULSE_90_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse90 = Pulse(inpulse90file, PULSE_90_LENGTH, 'varian')
-
-			n_new = np.linspace(0, PULSE_90_LENGTH, 256)
-
-			waveform_real = np.real(pulse90.waveform)*A_90
-			waveform_imag = np.imag(pulse90.waveform)*A_90
-			pulse90.waveform = waveform_real + 1j*(waveform_imag)
-
-			ampl_arr = np.abs(pulse90.waveform)*gyratio
-			phas_arr = np.unwrap(np.angle(pulse90.waveform))*180.0/math.pi
-			
-			pulse = pg.row_vector(len(pulse90.waveform))
-			ptime = pg.row_vector(len(pulse90.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(pulse90.pulsestep,0), j)
-
-			pulse_dur_90 = pulse.size() * pulse90.pulsestep
-			pwf_90 = pg.PulWaveform(pulse, ptime, "90excite")
-			pulc_90 = pg.PulComposite(pwf_90, spin_system, self.sim_experiment.obs_iso)
-
-			Ureal90 = pulc_90.GetUsum(-1)
-
-			# build 180 degree pulse
-			inpulse180file = self.sim_experiment.inpulse180file
-			A_180 = self.sim_experiment.A_180
-			PULSE_180_LENGTH = self.sim_experiment.PULSE_180_LENGTH
-			gyratio = self.sim_experiment.getGyratio()
-
-			pulse180 = Pulse(inpulse180file, PULSE_180_LENGTH, 'varian')
-
-			n_new = np.linspace(0, PULSE_180_LENGTH, 512)
-
-			waveform_real = np.real(pulse180.waveform)*A_180
-			waveform_imag = np.imag(pulse180.waveform)*A_180
-			pulse180.waveform = waveform_real + 1j*(waveform_imag)
-
-			ampl_arr = np.abs(pulse180.waveform)*gyratio
-			phas_arr = np.unwrap(np.angle(pulse180.waveform))*180.0/math.pi
-			freq_arr = np.gradient(phas_arr)
-
-			pulse = pg.row_vector(len(pulse180.waveform))
-			ptime = pg.row_vector(len(pulse180.waveform))
-			for j, val in enumerate(zip(ampl_arr, phas_arr)):
-				pulse.put(pg.complex(val[0],val[1]), j)
-				ptime.put(pg.complex(n_new[1],0), j)
-
-			pulse_dur_180 = pulse.size() * pulse180.pulsestep
-			pwf_180 = pg.PulWaveform(pulse, ptime, "180afp")
-			pulc_180 = pg.PulComposite(pwf_180, spin_system, self.sim_experiment.obs_iso)
-
-			Ureal180 = pulc_180.GetUsum(-1)
-
-			# calculate pulse timings
-			ROF1 = 100E-6    #sec
-			ROF2 = 10E-6     #sec
-			TCRUSH1 = 0.0008 #sec
-			TCRUSH2 = 0.0008 #sec
-
-			ss_grad_rfDelayFront = 0#TCRUSH1 - ROF1
-			ss_grad_rfDelayBack  = 0#TCRUSH2 - ROF2
-			ro_grad_atDelayFront = 0
-			ro_grad_atDelayBack  = 0
-
-			TE  = self.sim_experiment.TE / 1000.
-			ipd = (TE - pulse_dur_90 \
-					  - 6*(ss_grad_rfDelayFront + pulse_dur_180 + ss_grad_rfDelayBack) \
-					  - ro_grad_atDelayFront) / 12
-
-			delay1 = ipd + ss_grad_rfDelayFront
-			delay2 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-			delay3 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-			delay4 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-			delay5 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-			delay6 = ss_grad_rfDelayBack + 2*ipd + ss_grad_rfDelayFront
-			delay7 = ss_grad_rfDelayBack + ipd + ro_grad_atDelayFront
-
-			# print A_90, A_180, pulse_dur_90, pulse_dur_180
-			# print TE, ipd, pulse_dur_90+6*pulse_dur_180, delay1+delay2+delay3+delay4+delay5+delay6+delay7, pulse_dur_90+6*pulse_dur_180+delay1+delay2+delay3+delay4+delay5+delay6+delay7
-			# print ''
-
-			# initialize acquisition
-			H = pg.Hcs(spin_system) + pg.HJ(spin_system)
-			D = pg.Fm(spin_system, self.sim_experiment.obs_iso)
-			ac = pg.acquire1D(pg.gen_op(D), H, self.sim_experiment.dwell_time)
-			ACQ = ac
-
-			Udelay1 = pg.prop(H, delay1)
-			Udelay2 = pg.prop(H, delay2)
-			Udelay3 = pg.prop(H, delay3)
-			Udelay4 = pg.prop(H, delay4)
-			Udelay5 = pg.prop(H, delay5)
-			Udelay6 = pg.prop(H, delay6)
-			Udelay7 = pg.prop(H, delay7)
-
-			sigma0 = pg.sigma_eq(spin_system)	# init
-			sigma1 = Ureal90.evolve(sigma0)		# apply 90-degree pulse
-			sigma0 = pg.evolve(sigma1, Udelay1)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP1
-			sigma0 = pg.evolve(sigma1, Udelay2)
-			sigma1 = Ureal180.evolve(sigma0)	# apply AFP2
-			sigma0 = pg.evolve(sigma1, Udelay3)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP3
-			sigma0 = pg.evolve(sigma1, Udelay4)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP4
-			sigma0 = pg.evolve(sigma1, Udelay5)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP5
-			sigma0 = pg.evolve(sigma1, Udelay6)
-			sigma1 = Ureal180.evolve(sigma0) 	# apply AFP6
-			sigma0 = pg.evolve(sigma1, Udelay7)
+	lb = 15 if (sim_experiment.b0 == 297.2 or sim_experiment.b0 == 400.2) else 6
 
-		# acquire
-		mx = pg.TTable1D(ACQ.table(sigma0))
+	intensities = []
+	for (A, (Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180)) in zip(amplitudes, pulses):
+		delays = sequence_delays(sim_experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180, True)
+		mx = acquire_sequence(sim_experiment, spin_system, Ureal90, refocusing_pulses(Ureal180, delays), delays)
 
 		# binning to remove degenerate peaks
+		outf, outa, outp = binning_code(mx, sim_experiment.b0, spin_system, sim_experiment.obs_iso, sim_experiment.tolppm, sim_experiment.tolpha, sim_experiment.ppmlo, sim_experiment.ppmhi, sim_experiment.RF_OFFSET)
+
+		metab = apply_metab_properties(metab_name, A, outf, outa, outp, insysfile)
+
+		with stage('calibration spectrum'):
+			f, spectra = metab.getSpec(TE, sim_experiment.b0, sim_experiment.getTime(), 0, 1, 0, 0, lb, sim_experiment.getFs())
+		intensities.append(np.real(spectra)[np.argmax(np.abs(spectra))])
+
+	return intensities
+
+def calibration_batches(amplitudes, n_workers):
+	# splits amplitudes into one batch per worker
+	return [batch for batch in np.array_split(np.asarray(amplitudes), n_workers) if np.size(batch)]
+
+def calibration_sweep(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed=None, n_workers=None, timings=None):
+	# Runs calibration_points for batches of the amplitudes in a pool of worker processes
+	# and returns the peak intensities in the order of amplitudes.
+	# The timing report of every batch is appended to timings (if given).
+	n_workers = n_workers if n_workers else (os.cpu_count() or 1)
+
+	with cf.ProcessPoolExecutor(max_workers=n_workers) as pool:
+		points = list(pool.map(partial(timing.timed, calibration_points, insysfile, metab_name, sim_experiment, flip, A_fixed), calibration_batches(amplitudes, n_workers)))
+		if timings is not None:
+			timings.extend(report for (batch, report) in points)
+		return [y for (batch, report) in points for y in batch]
+
+def adaptive_calibration(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed=None, target='plateau', tol=0.01, n_workers=None, timings=None):
+	# Finds the calibrated amplitude on the amplitudes grid, simulating only where the
+	# calibration curve is still uncertain. A coarse pass over the whole range brackets
+	# the onset of the plateau (target='plateau', within tol of the signal at the largest
+	# amplitude) or the maximum (target='maximum'); every refinement pass evaluates up to
+	# n_points grid amplitudes inside the bracket in parallel until it is one grid step wide.
+	# Returns (evaluated amplitudes, intensities, calibrated amplitude).
+	# The timing report of every batch is appended to timings (if given).
+	amplitudes = np.asarray(amplitudes)
+	n = np.size(amplitudes)
+	n_workers = n_workers if n_workers else (os.cpu_count() or 1)
+	n_points = max(n_workers, 8)
+	data = {}
+
+	def interior(lo, hi):
+		return np.round(np.linspace(lo, hi, min(hi - lo - 1, n_points) + 2)[1:-1])
+
+	def bracket():
+		indx = sorted(data)
+		if target == 'plateau':
+			K = data[indx[-1]]
+			j = len(indx) - 1
+			while j > 0 and np.abs(data[indx[j-1]] - K) <= tol*np.abs(K):
+				j -= 1
+			return (indx[j-1] if j > 0 else indx[j]), indx[j], indx[j]
+		else:
+			j = int(np.argmax([data[i] for i in indx]))
+			return (indx[j-1] if j > 0 else indx[j]), indx[j], (indx[j+1] if j < len(indx)-1 else indx[j])
+
+	with cf.ProcessPoolExecutor(max_workers=n_workers) as pool:
+		points = partial(timing.timed, calibration_points, insysfile, metab_name, sim_experiment, flip, A_fixed)
+
+		def evaluate(indices):
+			indices = sorted(set(int(i) for i in indices) - set(data))
+			batches = list(pool.map(points, calibration_batches(amplitudes[indices], n_workers)))
+			if timings is not None:
+				timings.extend(report for (batch, report) in batches)
+			intensities = [y for (batch, report) in batches for y in batch]
+			for (i, y) in zip(indices, intensities):
+				data[i] = y
+
+		# coarse pass over the whole range
+		evaluate(np.round(np.linspace(0, n-1, min(n, n_points+1))))
+
+		lo, best, hi = bracket()
+		while best - lo > 1 or hi - best > 1:
+			if best - lo > 1:
+				evaluate(interior(lo, best))
+			if hi - best > 1:
+				evaluate(interior(best, hi))
+			lo, best, hi = bracket()
+
+	indx = sorted(data)
+	return amplitudes[indx], [data[i] for i in indx], amplitudes[best]
+
+# ---- Calibration Fits ---- #
+# The dense sweep (calibration_sweep over the whole amplitude grid) is calibrated with
+# these fits. adaptive_calibration picks the onset of the plateau (or the maximum) on the
+# grid instead, which can give a different amplitude.
+
+def logs_func(x, A, B, K, s):
+	return A + (K - A)/(1 + np.exp(-B*(x-s)))
+
+def sinfunc(t, A, w, p, c):
+	return A * np.sin(w*t + p) + c
+
+def fit_sin(tt, yy):
+	'''Fit sin to the input time sequence, and return fitting parameters "amp", "omega", "phase", "offset", "freq", "period" and "fitfunc"'''
+	tt = np.array(tt)
+	yy = np.array(yy)
+	ff = np.fft.fftfreq(len(tt), (tt[1]-tt[0]))   # assume uniform spacing
+	Fyy = abs(np.fft.fft(yy))
+	guess_freq = abs(ff[np.argmax(Fyy[1:])+1])   # excluding the zero frequency "peak", which is related to offset
+	guess_amp = np.std(yy) * 2.**0.5
+	guess_offset = np.mean(yy)
+	guess = np.array([guess_amp, 2.*np.pi*guess_freq, 0., guess_offset])
+
+	popt, pcov = sp.optimize.curve_fit(sinfunc, tt, yy, p0=guess)
+	A, w, p, c = popt
+	f = w/(2.*np.pi)
+	fitfunc = lambda t: A * np.sin(w*t + p) + c
+	return {"amp": A, "omega": w, "phase": p, "offset": c, "freq": f, "period": 1./f, "fitfunc": fitfunc, "maxcov": np.max(pcov), "rawres": (guess,popt,pcov)}
+
+def plateau_fit(amplitudes, calibration_data, guess_A=None):
+	# Adiabatic pulses: fits a logistic function to the sweep (flat at its minimum below the
+	# minimum) and returns the grid amplitude whose signal is closest to the fitted plateau
+	# K, with the initial guess and the fitted parameters (A, B, K, s).
+	calibration_data = np.asarray(calibration_data)
+	initial_guess_A = np.amin(calibration_data) if guess_A is None else guess_A
+	initial_guess_B = np.abs(np.amax(calibration_data)-np.amin(calibration_data))/np.abs(calibration_data[np.argmax(calibration_data)]-calibration_data[np.argmin(calibration_data)])
+	initial_guess_K = np.amax(calibration_data)
+	initial_guess_s = amplitudes[np.argmin(calibration_data)]
+	fit_y = np.pad(calibration_data[np.argmin(calibration_data):], (np.size(calibration_data[:np.argmin(calibration_data)]), 0), 'constant', constant_values=(np.amin(calibration_data),0))
+	guess = [initial_guess_A, initial_guess_B, initial_guess_K, initial_guess_s]
+	params, params_covariance = sp.optimize.curve_fit(logs_func, amplitudes, fit_y, p0=guess)
+
+	return amplitudes[(np.abs(np.asarray(fit_y)-params[2])).argmin()], guess, params
+
+def maximum_fit(amplitudes, calibration_data):
+	# Excitation pulses: fits a sine to the sweep and returns the grid amplitude at the
+	# maximum of the fit, with the fitted parameters (A, w, p, c).
+	fitted_sine = fit_sin(amplitudes, calibration_data)
+	params = [fitted_sine[key] for key in ('amp', 'omega', 'phase', 'offset')]
+	return amplitudes[np.argmax(sinfunc(amplitudes, *params))], params
+
+# ---- Spatially Resolved Simulation ---- #
+# With sim_experiment.spatial_positions set, every metabolite is simulated on a grid of
+# positions (one axis per localized direction) instead of as a single on-resonance isochromat.
+# During each selective pulse the spins see the frequency offset of its slice-selection
+# gradient, and the transition tables of all grid points are averaged.
+
+def localized(sim_experiment):
+	return len(sim_experiment.spatial_positions) > 0
+
+def spatial_points(sim_experiment):
+	# every point of the grid as a tuple of positions [m], one per direction
+	return list(itertools.product(*[np.asarray(positions, dtype=float)*1E-3 for positions in sim_experiment.spatial_positions]))
+
+def spatial_chunks(sim_experiment, n_chunks):
+	# contiguous chunks of grid points (neighbouring points share most pulse propagators)
+	points = spatial_points(sim_experiment)
+	return [[points[i] for i in chunk] for chunk in np.array_split(np.arange(len(points)), min(n_chunks, len(points)))]
+
+def pulse_directions(sim_experiment):
+	# direction selected by the excitation pulse and by each refocusing pulse
+	if sim_experiment.name == "LASER":
+		return None, [0, 0, 1, 1, 2, 2]	# non-selective AHP, one pair of AFPs per direction
+	return 0, [1, 1, 2, 2]
+
+def offset_ppm(sim_experiment, direction, point):
+	# Frequency offset [ppm] at point while the gradient of direction is on. In ppm the offset
+	# (gamma G x / gamma B0) is the same for every isotope.
+	if direction is None or direction >= len(point):
+		return 0.0
+	B0 = sim_experiment.b0 * 1E6 / sim_experiment.getGyratio()	# mT
+	return 1E6 * sim_experiment.slice_gradients[direction] * point[direction] / B0
+
+def transition_table(mx):
+	# pygamma's TTable1D as a densitymatrix.TransitionTable
+	if isinstance(mx, densitymatrix.TransitionTable):
+		return mx
+	Fr = np.array([mx.Fr(i) for i in range(mx.size())])
+	I = np.array([mx.I(i).real() + 1j*mx.I(i).imag() for i in range(mx.size())])
+	return densitymatrix.TransitionTable(Fr, I)
+
+def simulate_positions(insysfile, sim_experiment, TEs, points):
+	# Runs in a worker process. Returns the sum of the transition tables over points, one per
+	# echo time. The pulse propagators only depend on the offset of each pulse, so they are
+	# built once per offset and shared by all points (and echo times) with that offset.
+	propagator_cache.cache_dir = sim_experiment.propagator_cache_dir
+	propagator_cache.max_entries = max(propagator_cache.max_entries, 2*sum(len(positions) for positions in sim_experiment.spatial_positions) + 2)
+
+	insysfile = sysfile_path(insysfile, sim_experiment.b0)
+	backend = sim_experiment.backend
+	reduce = sim_experiment.reduce_spin_systems
+
+	spin_system = read_spin_system(insysfile, sim_experiment.RF_OFFSET, backend, reduce)
+	H = densitymatrix.hamiltonian(spin_system) if backend == 'numpy' else pg.Hcs(spin_system) + pg.HJ(spin_system)
+
+	shifted = {}
+	def shifted_spin_system(direction, point):
+		ppm = offset_ppm(sim_experiment, direction, point)
+		if ppm not in shifted:
+			shifted[ppm] = read_spin_system(insysfile, sim_experiment.RF_OFFSET - ppm, backend, reduce)
+		return shifted[ppm]
+
+	gyratio = sim_experiment.getGyratio()
+	obs_iso = sim_experiment.obs_iso
+	rf_off = sim_experiment.RF_OFFSET
+	inpulse90file, pulse_length_90, scanner_90, interpolate_90, axis_step_90, label_90 = sequence_pulse_params(sim_experiment, 90)
+	inpulse180file, pulse_length_180, scanner_180, interpolate_180, axis_step_180, label_180 = sequence_pulse_params(sim_experiment, 180)
+	direction_90, directions_180 = pulse_directions(sim_experiment)
+
+	experiment = copy.copy(sim_experiment)
+	sums = [None] * len(TEs)
+	for point in points:
+		pulse_dur_90, pulsestep_90, Ureal90 = pulse_propagator(inpulse90file, sim_experiment.A_90, pulse_length_90, gyratio, shifted_spin_system(direction_90, point), obs_iso, scanner_90, interpolate_90, axis_step_90, rf_off, label_90)
+		pulses_180 = [pulse_propagator(inpulse180file, sim_experiment.A_180, pulse_length_180, gyratio, shifted_spin_system(direction, point), obs_iso, scanner_180, interpolate_180, axis_step_180, rf_off, label_180) for direction in directions_180]
+		pulse_dur_180 = pulses_180[0][0]
+
+		delays_list = []
+		for TE in TEs:
+			experiment.TE = TE
+			delays_list.append(sequence_delays(experiment, pulse_dur_90, excitation_peak_to_end(experiment, pulse_dur_90, pulsestep_90), pulse_dur_180))
+
+		mxs = acquire_sequence_tes(sim_experiment, spin_system, Ureal90, [U for (pulse_dur, pulsestep, U) in pulses_180], delays_list, H)
+		for (t, mx) in enumerate(mxs):
+			table = transition_table(mx)
+			sums[t] = table if sums[t] is None else densitymatrix.combine_tables([sums[t], table], [1.0, 1.0])
+
+	return sums
+
+def localized_metabolites(insysfile, sim_experiment, chunk_sums, n_points):
+	# Averages the results of simulate_positions for all chunks of the grid and bins them
+	# (one metabolite per echo time).
+	metab_name = insysfile.replace('.sys','')
+	insysfile = sysfile_path(insysfile, sim_experiment.b0)
+	spin_system = read_spin_system(insysfile, sim_experiment.RF_OFFSET, sim_experiment.backend)
+
+	metabs = []
+	for t in range(len(chunk_sums[0])):
+		mx = densitymatrix.combine_tables([sums[t] for sums in chunk_sums], [1.0/n_points] * len(chunk_sums))
 
-		# BINNING
-		# Note: Metabolite Peak Normalization and Blending
-
-		# The transition tables calculated by the GAMMA density matrix simulations frequently contain a
-		# large number of transitions caused by degenerate splittings and other processes. At the
-		# conclusion of each simulation run a routine is called to extract lines from the transition table.
-		# These lines are then normalized using a closed form calculation based on the number of spins.
-		# To reduce the number of lines required for display, multiple lines are blended by binning them
-		# together based on their PPM locations and phases. The following parameters are used to
-		# customize these procedures:
+		# binning to remove degenerate peaks
+		outf, outa, outp = binning_code(mx, sim_experiment.b0, spin_system, sim_experiment.obs_iso, sim_experiment.tolppm, sim_experiment.tolpha, sim_experiment.ppmlo, sim_experiment.ppmhi, sim_experiment.RF_OFFSET)
+
+		metabs.append(apply_metab_properties(metab_name, 0.0, outf, outa, outp, insysfile))
+
+	return metabs
+
+# ---- Simulation Output ---- #
+default_insysfiles = [
+			'alanine.sys',
+			'aspartate.sys',
+			'choline_1-CH2_2-CH2.sys',
+			'choline_N(CH3)3_a.sys',
+			'choline_N(CH3)3_b.sys',
+			'creatine_N(CH3).sys',
+			'creatine_X.sys',
+			'd-glucose-alpha.sys',
+			'd-glucose-beta.sys',
+			'eth.sys',
+			'gaba.sys',
+			'glutamate.sys',
+			'glutamine.sys',
+			'glutathione_cysteine.sys',
+			'glutathione_glutamate.sys',
+			'glutathione_glycine.sys',
+			'glycine.sys',
+			'gpc_7-CH2_8-CH2.sys',
+			'gpc_glycerol.sys',
+			'gpc_N(CH3)3_a.sys',
+			'gpc_N(CH3)3_b.sys',
+			'lactate.sys',
+			'myoinositol.sys',
+			'naa_acetyl.sys',
+			'naa_aspartate.sys',
+			'naag_acetyl.sys',
+			'naag_aspartyl.sys',
+			'naag_glutamate.sys',
+			'pcho_N(CH3)3_a.sys',
+			'pcho_N(CH3)3_b.sys',
+			'pcho_X.sys',
+			'pcr_N(CH3).sys',
+			'pcr_X.sys',
+			'peth.sys',
+			'scyllo-inositol.sys',
+			'taurine.sys']
+
+def macromolecule_set(b0):
+	# Returns the macromolecule names and their Macromolecule objects for a field strength.
+	macromolecules_data = {}
+
+	if b0 == 123.3:
+		macromolecules = [ 
+					'MM09', 
+					'MM12', 
+					'MM14', 
+					'MM16', 
+					'MM20', 
+					'MM21', 
+					'MM23', 
+					'MM26', 
+					'MM30', 
+					'MM31', 
+					'MM37', 
+					'MM38', 
+					'MM40' ]
+
+		# From https://www.ncbi.nlm.nih.gov/pmc/articles/PMC5215417/
+		macromolecules_data['MM09'] = Macromolecule('MM09',  0.90, 'L', 21.20, 0.72, 0)
+		macromolecules_data['MM12'] = Macromolecule('MM12',  1.21, 'L', 19.16, 0.28, 0)
+		macromolecules_data['MM14'] = Macromolecule('MM14',  1.38, 'L', 15.90, 0.38, 0)
+		macromolecules_data['MM16'] = Macromolecule('MM16',  1.63, 'L', 07.50, 0.05, 0)
+		macromolecules_data['MM20'] = Macromolecule('MM20',  2.01, 'L', 29.03, 0.45, 0)
+		macromolecules_data['MM21'] = Macromolecule('MM21',  2.09, 'L', 20.53, 0.36, 0)
+		macromolecules_data['MM23'] = Macromolecule('MM23',  2.25, 'L', 17.89, 0.36, 0)
+		macromolecules_data['MM26'] = Macromolecule('MM26',  2.61, 'L', 05.30, 0.04, 0)
+		macromolecules_data['MM30'] = Macromolecule('MM30',  2.96, 'L', 14.02, 0.20, 0)
+		macromolecules_data['MM31'] = Macromolecule('MM31',  3.11, 'L', 17.89, 0.11, 0)
+		macromolecules_data['MM37'] = Macromolecule('MM37',  3.67, 'L', 33.52, 0.64, 0)
+		macromolecules_data['MM38'] = Macromolecule('MM38',  3.80, 'L', 11.85, 0.07, 0)
+		macromolecules_data['MM40'] = Macromolecule('MM40',  3.96, 'L', 37.48, 1.00, 0)
+	else:
+		macromolecules = [ 'lm1', 
+					'lm2', 
+					'lm3', 
+					'lm4', 
+					'lm5', 
+					'lm6', 
+					'lm7', 
+					'lm8', 
+					'lm9', 
+					'lm10', 
+					'lm11', 
+					'lm12', 
+					'lm13', 
+					'lm14' ]
+
+		macromolecules_data['lm1']  = Macromolecule('lm1',  0.9457810, 'L', 50.72009, 3.5501260, -1.13820100)
+		macromolecules_data['lm2']  = Macromolecule('lm2',  1.4757810, 'L', 54.12614, 2.8557010, 0.054570260)
+		macromolecules_data['lm3']  = Macromolecule('lm3',  1.7057810, 'L', 68.32043, 3.9072800, -0.06015777)
+		macromolecules_data['lm4']  = Macromolecule('lm4',  2.1157810, 'L', 96.43580, 4.7191390, -0.09620739)
+		macromolecules_data['lm5']  = Macromolecule('lm5',  2.3157810, 'L', 69.70896, 2.7845620, -0.57759460)
+		macromolecules_data['lm6']  = Macromolecule('lm6',  3.0157810, 'L', 42.72932, 1.0176800, -0.65827850)
+		macromolecules_data['lm7']  = Macromolecule('lm7',  3.9854041, 'L', 29.64625, 1.2094070, 0.288971500)
+		macromolecules_data['lm8']  = Macromolecule('lm8',  7.1257810, 'L', 274.4760, 4.0466410, 0.302700400)
+		macromolecules_data['lm9']  = Macromolecule('lm9',  7.8557810, 'L', 37.37627, 1.3135740, 0.020221810)
+		macromolecules_data['lm10'] = Macromolecule('lm10', 2.6557810, 'L', 121.4557, 2.3499680, -0.58261020)
+		macromolecules_data['lm11'] = Macromolecule('lm11', 1.2357810, 'L', 30.68139, 0.7444791, -1.13820100)
+		macromolecules_data['lm12'] = Macromolecule('lm12', -0.628240, 'L', 1789.202, 21.518780, -3.65296700)
+		macromolecules_data['lm13'] = Macromolecule('lm13', 3.2957810, 'L', 109.4958, 1.6655390, 0.163575600)
+		macromolecules_data['lm14'] = Macromolecule('lm14', 3.7057810, 'L', 169.6304, 4.8735330, -1.35431900)
+
+	return macromolecules, macromolecules_data
+
+def results_dir(root, sim_experiment, timestamp):
+	# pints/experiments/<sequence>_sim_<timestamp>_TE<TE>_<field>/ as created by PINTS
+	if sim_experiment.name == "semi-LASER (Bruker)":
+		save_dir = root + '/sLASER_sim_bruker_'
+	elif sim_experiment.name == "semi-LASER":
+		save_dir = root + '/sLASER_sim_siemens_'
+	else:
+		save_dir = root + '/LASER_sim_'
+	save_dir += timestamp + '_TE' + str(sim_experiment.TE)
+
+	if sim_experiment.b0 == 297.2:
+		save_dir += '_7T/'
+	elif sim_experiment.b0 == 123.3:
+		save_dir += '_3T/'
+	elif sim_experiment.b0 == 400.2:
+		save_dir += '_9T/'
+
+	return save_dir
+
+def results_filename(sim_experiment):
+	return 'LASER_sim_results.txt' if sim_experiment.name == "LASER" else 'sLASER_sim_results.txt'
+
+def timings_filename(sim_experiment):
+	# per-stage timings are saved next to the results
+	return results_filename(sim_experiment).replace('.txt', '_timings.json')
+
+def write_results_header(sim_results, sim_experiment, insysfiles, macromolecules, include_macromolecules):
+	sim_results.write(';PINTS for FITMAN Simulation Output\n')
+	sim_results.write(';Experiment Information\n')
+	sim_results.write(';---------------------------------------------------------------------------\n')
+	sim_results.write(';Name: ' + sim_experiment.name + '\n')
+	sim_results.write(';Created: ' + sim_experiment.date + '\n')
+	sim_results.write(';Comment: ' + sim_experiment.description + '\n')
+	sim_results.write(';PI: ' + sim_experiment.author + '\n')
+	sim_results.write(';b0: ' + str(sim_experiment.b0) + '\n')
+	sim_results.write(';' + str(int(np.size(insysfiles)+int(np.size(macromolecules)))) + ' Metabolites: ' + str(insysfiles).replace('[','').replace(']','').replace('\'','').replace('.sys',''))
+	if include_macromolecules: sim_results.write(', ' + str(macromolecules).replace('[','').replace(']','').replace('\'',''))
+	sim_results.write('\n')
+
+	sim_results.write(';Simulation Results\n')
+	sim_results.write(';---------------------------------------------------------------------------\n')
+
+def write_metabolite_results(sim_results, metabolite, TE):
+	for (i, area) in enumerate(metabolite.area):
+		sim_results.write(metabolite.name + '\t' + str(float(TE)) + '\t' + str(float(metabolite.A_m)) + '\t' + str(float(metabolite.T2)) + '\t' + str(i) + '\t' + str(metabolite.ppm[i]) + '\t' + str(metabolite.area[i]) + '\t' + str(metabolite.phase[i]) + '\n')
+
+def write_macromolecule_results(sim_results, macromolecules, macromolecules_data, TE):
+	for lipid in macromolecules:
+		macromolecule = macromolecules_data[lipid]
+		# name, TE, A_m, shift, line_type, lw, area, phase
+		sim_results.write(macromolecule.name + '\t' + str(float(TE)) \
+			+ '\t' + str(float(macromolecule.A_m)) + '\t' + str(float(macromolecule.ppm[0])) \
+			+ '\t' + str(macromolecule.line_type) + '\t' + str(macromolecule.lw) \
+			+ '\t' + str(macromolecule.area[0]) + '\t' + str(macromolecule.phase[0]) + '\n')
+
+# ---- Simulation Classes ---- #
+class MetaboliteSimulation(QtCore.QObject):
 
-		# Peak Search Range -- Low/High (PPM): the range in PPM that is searched for lines from the
-		# metabolite simulation.
+	postToConsole = QtCore.pyqtSignal(str)
+	outputResults = QtCore.pyqtSignal(object)
+	finished = QtCore.pyqtSignal(int)
 
-		# Peak Blending Tolerance (PPM and Degrees): the width of the bins (+/- in PPM and +/- in
-		# PhaseDegrees) that are used to blend the lines in the simulation. Lines that are included in the
-		# same bin are summed using complex addition based on Amplitude and Phase.
+	def __init__(self, thread_num, insysfile, sim_experiment):
+		
+		QtCore.QObject.__init__(self)
 
-		b0 = self.sim_experiment.b0
-		obs_iso = self.sim_experiment.obs_iso
-		tolppm = self.sim_experiment.tolppm
-		tolpha = self.sim_experiment.tolpha
-		ppmlo = self.sim_experiment.ppmlo
-		ppmhi = self.sim_experiment.ppmhi
-		rf_off = self.sim_experiment.RF_OFFSET
+		self.thread_num = thread_num
+		self.insysfile = insysfile
+		self.sim_experiment = sim_experiment
+		self.timings = None
 
-		field  = b0
-		nspins = spin_system.spins()
+	def simulate(self):
+		self.postToConsole.emit('   | Simulating ... ' + self.insysfile)
 
-		nlines = mx.size()
+		metab, self.timings = timing.timed(simulate_metabolite, self.insysfile, self.sim_experiment)
 
-		tmp = pg.Isotope(obs_iso)
-		obs_qn = tmp.qn()
+		# Send save data signal
+		self.outputResults.emit(metab)
+		self.postToConsole.emit('        | Simulation completed for ... ' + self.insysfile)
+		self.finished.emit(self.thread_num)
 
-		qnscale = 1.0
-		for i in range(nspins):
-			qnscale *= 2*spin_system.qn(i)+1
-		qnscale = qnscale / (2.0 * (2.0*obs_qn+1))
+class SimulationPool(QtCore.QObject):
+	# Simulates a list of metabolites in a pool of worker processes. Idle workers
+	# pull the next spin system (or chunk of spatial grid points) off a shared queue,
+	# so one slow metabolite only occupies one core. Results are re-ordered and
+	# emitted in input order.
 
-		freqs = []
-		outf = []
-		outa = []
-		outp = []
-		nbin = 0
-		found = False
+	postToConsole = QtCore.pyqtSignal(str)
+	outputResults = QtCore.pyqtSignal(object)
+	finished = QtCore.pyqtSignal(int)
+	allFinished = QtCore.pyqtSignal()
 
-		PI = 3.14159265358979323846
-		RAD2DEG = 180.0/PI
+	def __init__(self, insysfiles, sim_experiment, n_workers=None):
 
-		indx = mx.Sort(0,-1,0)
+		QtCore.QObject.__init__(self)
 
-		for i in range(nlines):
-			freqs.append(-1 * mx.Fr(indx[i])/(2.0*PI*field))
+		self.insysfiles = list(insysfiles)
+		self.sim_experiment = sim_experiment
+		self.n_workers = n_workers if n_workers else (os.cpu_count() or 1)
 
-		for i in range(nlines):
-			freq = freqs[i]
-			if (freq > ppmlo) and (freq < ppmhi):
-				val = mx.I(indx[i])
-				tmpa = np.sqrt(val.real()**2 + val.imag()**2) / qnscale
-				tmpp = -RAD2DEG * np.angle(val.real()+1j*val.imag())
-
-			if nbin == 0:
-				outf.append(freq)
-				outa.append(tmpa)
-				outp.append(tmpp)
-				nbin += 1
-			else:
-				for k in range(nbin):
-					if (freq >= outf[k]-tolppm) and (freq <= outf[k]+tolppm):
-						if (tmpp >= outp[k]-tolpha) and (tmpp <= outp[k]+tolpha):
-							ampsum   =  outa[k]+tmpa
-							outf[k]  = (outa[k]*outf[k] + tmpa*freq)/ampsum
-							outp[k]  = (outa[k]*outp[k] + tmpa*tmpp)/ampsum
-							outa[k] +=  tmpa;
-							found = True 
-				if not found:
-					outf.append(freq)
-					outa.append(tmpa)
-					outp.append(tmpp)
-					nbin += 1
-				found = False
-
-		for i, item in enumerate(outf):
-			outf[i] = item + rf_off
-			outp[i] = outp[i] - 90.0
-
-		metab = Metabolite()
-		metab.name = metab_name
-		metab.var = 0.0
-
-		for i in range(sp.size(outf)):
-			if outf[i] <= 5:
-				metab.ppm.append(outf[i])
-				metab.area.append(outa[i])
-				metab.phase.append(-1.0*outp[i])
-
-		insysfile = self.insysfile.replace('pints/metabolites/3T_', '')
-		insysfile = self.insysfile.replace('pints/metabolites/7T_', '')
-		insysfile = self.insysfile.replace('pints/metabolites/9.4T_','')
-
-		if insysfile == 'alanine.sys': #
-			metab.A_m = 0.078
-			metab.T2 = (87E-3)
-		elif insysfile == 'aspartate.sys':
-			metab.A_m = 0.117
-			metab.T2 = (87E-3)
-		elif insysfile == 'choline_1-CH2_2-CH2.sys': #
-			metab.A_m = 0.165
-			metab.T2 = (87E-3)
-		elif insysfile == 'choline_N(CH3)3_a.sys' or insysfile == 'choline_N(CH3)3_b.sys': #
-			metab.A_m = 0.165
-			metab.T2 = (121E-3)
-		elif insysfile == 'creatine_N(CH3).sys':
-			metab.A_m = 0.296
-			metab.T2 = (90E-3)
-		elif insysfile == 'creatine_X.sys':
-			metab.A_m = 0.296
-			metab.T2 = (81E-3)
-		elif insysfile == 'd-glucose-alpha.sys': #
-			metab.A_m = 0.049
-			metab.T2 = (87E-3)
-		elif insysfile == 'd-glucose-beta.sys': #
-			metab.A_m = 0.049
-			metab.T2 = (87E-3)
-		elif insysfile == 'eth.sys': #
-			metab.A_m = 0.320
-			metab.T2 = (87E-3)
-		elif insysfile == 'gaba.sys': #
-			metab.A_m = 0.155
-			metab.T2 = (82E-3)
-		elif insysfile == 'glutamate.sys':
-			metab.A_m = 0.898
-			metab.T2 = (88E-3)
-		elif insysfile == 'glutamine.sys':
-			metab.A_m = 0.427
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_cysteine.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_glutamate.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glutathione_glycine.sys':
-			metab.A_m = 0.194
-			metab.T2 = (87E-3)
-		elif insysfile == 'glycine.sys':
-			metab.A_m = 0.068
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_7-CH2_8-CH2.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_glycerol.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (87E-3)
-		elif insysfile == 'gpc_N(CH3)3_a.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (121E-3)
-		elif insysfile == 'gpc_N(CH3)3_b.sys': #
-			metab.A_m = 0.097
-			metab.T2 = (121E-3)
-		elif insysfile == 'lactate.sys': #
-			metab.A_m = 0.039
-			metab.T2 = (87E-3)
-		elif insysfile == 'myoinositol.sys':
-			metab.A_m = 0.578
-			metab.T2 = (87E-3)
-		elif insysfile == 'naa_acetyl.sys':
-			metab.A_m = 1.000
-			metab.T2 = (130E-3)
-		elif insysfile == 'naa_aspartate.sys':
-			metab.A_m = 1.000
-			metab.T2 = (69E-3)
-		elif insysfile == 'naag_acetyl.sys':
-			metab.A_m = 0.160
-			metab.T2 = (130E-3)
-		elif insysfile == 'naag_aspartyl.sys':
-			metab.A_m = 0.160
-			metab.T2 = (87E-3)
-		elif insysfile == 'naag_glutamate.sys':
-			metab.A_m = 0.160
-			metab.T2 = (87E-3)
-		elif insysfile == 'pcho_N(CH3)3_a.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (121E-3)
-		elif insysfile == 'pcho_N(CH3)3_b.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (121E-3)
-		elif insysfile == 'pcho_X.sys': #
-			metab.A_m = 0.058
-			metab.T2 = (87E-3)
-		elif insysfile == 'pcr_N(CH3).sys':
-			metab.A_m = 0.422
-			metab.T2 = (90E-3)
-		elif insysfile == 'pcr_X.sys':
-			metab.A_m = 0.422
-			metab.T2 = (81E-3)
-		elif insysfile == 'peth.sys':
-			metab.A_m = 0.126
-			metab.T2 = (87E-3)
-		elif insysfile == 'scyllo-inositol.sys':
-			metab.A_m = 0.044
-			metab.T2 = (87E-3)
-		elif insysfile == 'taurine.sys':
-			metab.A_m = 0.117
-			metab.T2 = (85E-3)
-		elif insysfile == 'water.sys':
-			metab.A_m = 1.000
-			metab.T2 = (43.60E-3)
+		# timing report per metabolite (insysfile -> report)
+		self.timings = OrderedDict()
 
-		# Send save data signal
-		self.outputResults.emit(metab)
-		self.postToConsole.emit('        | Simulation completed for ... ' + self.insysfile)
-		self.finished.emit(self.thread_num)
+	def simulate(self):
+		results = {}
+		reports = {}
+		self.next_index = 0
+
+		def emit_ready():
+			# emit everything that is now available in input order
+			while self.next_index in results:
+				metab = results.pop(self.next_index)
+				start = time.time()
+				if metab is not None:
+					self.outputResults.emit(metab)
+				if self.next_index in reports:
+					timing.add(reports[self.next_index], 'result output', time.time() - start)
+					self.timings[self.insysfiles[self.next_index]] = reports.pop(self.next_index)
+				self.finished.emit(self.next_index)
+				self.next_index += 1
+
+		# metabolites simulated before with the same parameters are read from the basis set cache
+		cache = BasisSetCache(self.sim_experiment.basis_cache_dir) if self.sim_experiment.basis_cache_dir else None
+		keys = {}
+		cached = set()
+		if cache is not None:
+			for (i, insysfile) in enumerate(self.insysfiles):
+				timing.timer.reset()
+				with stage('basis set cache'):
+					keys[i] = cache.key(insysfile, self.sim_experiment)
+					metab = cache.get(keys[i])
+				if metab is not None:
+					results[i] = metab
+					reports[i] = timing.timer.report()
+					cached.add(i)
+					self.postToConsole.emit('   | Loaded from cache ... ' + insysfile)
+			emit_ready()
+
+		todo = [i for i in range(len(self.insysfiles)) if i not in cached]
+		if todo:
+			self.postToConsole.emit('   | Starting ' + str(self.n_workers) + ' simulation workers ...')
+
+		# submit the largest spin systems first so they do not end up as stragglers
+		order = sorted(todo, key=lambda i: -simulation_cost(self.insysfiles[i], self.sim_experiment.b0))
+
+		# localized simulations: the grid points of every metabolite are split over the workers
+		chunks = spatial_chunks(self.sim_experiment, self.n_workers) if localized(self.sim_experiment) else None
+		n_points = len(spatial_points(self.sim_experiment))
+		chunk_results = {}
+
+		with cf.ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+			futures = {}
+			for i in order:
+				if chunks is None:
+					futures[pool.submit(timing.timed, simulate_metabolite, self.insysfiles[i], self.sim_experiment)] = i
+				else:
+					chunk_results[i] = []
+					for chunk in chunks:
+						futures[pool.submit(timing.timed, simulate_positions, self.insysfiles[i], self.sim_experiment, [self.sim_experiment.TE], chunk)] = i
+				self.postToConsole.emit('   | Simulating ... ' + self.insysfiles[i])
+
+			for future in cf.as_completed(futures):
+				i = futures[future]
+				try:
+					if chunks is None:
+						results[i], reports[i] = future.result()
+					else:
+						chunk_results[i].append(future.result())
+						if len(chunk_results[i]) < len(chunks):
+							continue
+						# chunk reports add up to the worker time of the metabolite
+						metabs, report = timing.timed(localized_metabolites, self.insysfiles[i], self.sim_experiment, [chunk_sums for (chunk_sums, report) in chunk_results[i]], n_points)
+						results[i] = metabs[0]
+						reports[i] = timing.merge([report] + [report for (chunk_sums, report) in chunk_results[i]])
+					self.postToConsole.emit('        | Simulation completed for ... ' + self.insysfiles[i])
+					if cache is not None:
+						start = time.time()
+						cache.put(keys[i], results[i])
+						timing.add(reports[i], 'basis set cache', time.time() - start)
+				except Exception as e:
+					results[i] = None
+					self.postToConsole.emit('        | ERROR: simulation failed for ... ' + self.insysfiles[i] + ' (' + str(e) + ')')
+
+				emit_ready()
+
+		self.allFinished.emit()
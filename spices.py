@@ -18,7 +18,7 @@ else:
 # ---- Math Libraries ---- #
 import scipy as sp
 import numpy as np
-from pyfftw.interfaces import scipy_fftpack as fftw
+import fftplans
 
 # ---- Plotting Libraries ---- #
 import matplotlib as mpl;
@@ -112,6 +112,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			# load output file
 			fit_file     = str(self.outFileInput.text())
 			self.fit_out = OutputFile(fit_file)
+			self.fit_model = BasisModel(self.fit_out.basis)	# cached FIDs for replotting
 			self.outFileInfoLabel.setText(fit_file.split('/')[-1] + "\nsuccessfully loaded.")
 
 			# populate available metabolite list
@@ -130,7 +131,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 		try:
 			# load dat file
 			invivo_file     = str(self.datFileInput.text())
-			self.invivo_dat = DatFile(invivo_file)
+			self.invivo_dat = DatFile(invivo_file, sidecar=True)
 			self.datFileInfoLabel.setText(invivo_file.split('/')[-1] + "\nsuccessfully loaded.")
 
 			# populate plotting parameters
@@ -234,23 +235,19 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 				r, g, b = tableau10[i]    
 				tableau10[i] = (r / 255., g / 255., b / 255.)
 
-			# Calculate Summed Spectra
-			fit_spec_sum = []; fit_fid_sum = []
-			for metabolite in self.fit_out.metabolites_list:
-				fid  = self.fit_out.metabolites[metabolite].getFID(0, b0, t, 0, 1, pfactor, 0, lb)
-				if not(self.extrap0CheckBox.isChecked()):
-					fid  = fid[FT1:]
-				spec = fftw.fftshift(fftw.fft(fid))
+			# Calculate Summed Spectra (one FID and spectrum per metabolite)
+			fids = self.fit_model.getFIDs(self.fit_out.metabolites_list, 0, b0, t, 0, 1, pfactor, 0, lb)
+			if not(self.extrap0CheckBox.isChecked()):
+				fids = fids[:,FT1:]
+			specs = fftplans.spectrum(fids, axis=-1)	# one batched FFT
+			rows = dict((metabolite, i) for (i, metabolite) in enumerate(self.fit_out.metabolites_list))
 
-				n = np.size(fid)
-				f = np.arange(+n//2,-n//2,-1)*(fs/n)*(1/b0)
-				fit_f = -f
+			n = np.size(fids, axis=-1)
+			f = np.arange(+n//2,-n//2,-1)*(fs/n)*(1/b0)
+			fit_f = -f
 
-				# fit_f, spec = self.fit_out.metabolites[metabolite].getSpec(0, b0, t, 0, 1, pfactor, 0, lb, fs)
-				fit_fid_sum.append(fid)
-				fit_spec_sum.append(spec)
-			fit_fid_sum  =         np.sum(np.array(fit_fid_sum), axis=0)
-			fit_spec_sum = np.real(np.sum(np.array(fit_spec_sum), axis=0))
+			fit_fid_sum  =         np.sum(fids, axis=0)
+			fit_spec_sum = np.real(np.sum(specs, axis=0))
 
 			# Calculate In-Vivo Spectra
 			invivo_dat_temp        = copy.copy(self.invivo_dat);
@@ -265,19 +262,7 @@ class MyApp(QtWidgets.QWidget, Ui_MainWindow):
 			# Calculate Fitted Spectra
 			fit_spec = []; fit_spec_names = []
 			for group in plot_groups:
-				group_spec = []
-				for member in group.members:
-					fid  = self.fit_out.metabolites[member].getFID(0, b0, t, 0, 1, pfactor, 0, lb)
-					if not(self.extrap0CheckBox.isChecked()):
-						fid  = fid[FT1:]
-					spec = fftw.fftshift(fftw.fft(fid))
-
-					n = np.size(fid)
-					f = np.arange(+n//2,-n//2,-1)*(fs/n)*(1/b0)
-					fit_f = -f
-					# fit_f, spec = self.fit_out.metabolites[member].getSpec(0, b0, t, 0, 1, pfactor, 0, lb, fs)
-					group_spec.append(spec)
-				group_spec = np.real(np.sum(np.array(group_spec), axis=0))
+				group_spec = np.real(np.sum(specs[[rows[member] for member in group.members]], axis=0))
 				fit_spec.append(group_spec)
 				fit_spec_names.append(group.name)
 
@@ -0,0 +1,15 @@
+# The MAGIQ modules live at the top of the repository; run the tests from there with
+#
+#   python -m pytest tests
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def in_repository(monkeypatch):
+	# the simulation and loading code opens pints/... relative to the working directory
+	monkeypatch.chdir(ROOT)
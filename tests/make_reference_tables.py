@@ -0,0 +1,62 @@
+# Writes the pygamma transition tables that test_densitymatrix.py compares the NumPy backend
+# against. Needs pygamma; run from the top of the repository:
+#
+#   python tests/make_reference_tables.py
+#
+# One table per shipped 7T spin system, for the semi-LASER TE 60 ms experiment of
+# pints/experiments/sLASER_sim_2018_08_22_1534970968_TE60.0, saved as
+# tests/reference/7T_<metabolite>_slaser_te60.npz (Fr in rad/sec and I, as in TTable1D).
+# The committed tables were written with pygamma 4.3.4.
+import os
+import sys
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_DIR = os.path.join(TESTS_DIR, 'reference')
+
+def slaser_experiment(backend):
+	from magiqdataclasses import Experiment
+	experiment = Experiment('slaser', 297.2)
+	experiment.name = 'semi-LASER'
+	experiment.backend = backend
+	experiment.TE = 60.0
+	experiment.PULSE_90_LENGTH = 4000E-6
+	experiment.PULSE_180_LENGTH = 8000E-6
+	experiment.fudge_factor = 0
+	experiment.A_90 = 10.1
+	experiment.A_180 = 22.0
+	experiment.ppmlo = 0.0 - experiment.RF_OFFSET
+	experiment.ppmhi = 10.0 - experiment.RF_OFFSET
+	return experiment
+
+def simulate_table(insysfile, experiment):
+	# the transition table simulate_metabolite bins, as a densitymatrix.TransitionTable
+	import simclasses
+	spin_system = simclasses.read_spin_system(simclasses.sysfile_path(insysfile, experiment.b0), experiment.RF_OFFSET, experiment.backend, experiment.reduce_spin_systems)
+	Ureal90, pulse_dur_90, peak_to_end_90, Ureal180, pulse_dur_180 = simclasses.sequence_pulses(experiment, spin_system, experiment.A_90, experiment.A_180)
+	delays = simclasses.sequence_delays(experiment, pulse_dur_90, peak_to_end_90, pulse_dur_180)
+	mx = simclasses.acquire_sequence(experiment, spin_system, Ureal90, simclasses.refocusing_pulses(Ureal180, delays), delays)
+	return spin_system, simclasses.transition_table(mx)
+
+def reference_file(insysfile):
+	return os.path.join(REFERENCE_DIR, '7T_' + insysfile.replace('.sys', '') + '_slaser_te60.npz')
+
+def main():
+	import simclasses
+	if simclasses.pygamma_spec is None:
+		sys.exit('pygamma is not installed')
+
+	if not os.path.exists(REFERENCE_DIR):
+		os.makedirs(REFERENCE_DIR)
+
+	experiment = slaser_experiment('pygamma')
+	for insysfile in simclasses.default_insysfiles:
+		spin_system, table = simulate_table(insysfile, experiment)
+		np.savez(reference_file(insysfile), Fr=table.Fr, I=table.I)
+		print(reference_file(insysfile) + ': ' + str(table.size()) + ' transitions')
+
+if __name__ == '__main__':
+	sys.path.insert(0, os.path.dirname(TESTS_DIR))
+	os.chdir(os.path.dirname(TESTS_DIR))
+	main()
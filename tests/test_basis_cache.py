@@ -0,0 +1,51 @@
+# Metabolites read back from the on-disk basis set cache (simclasses.BasisSetCache) are the
+# ones that were simulated: same lines, same properties, same synthesized FID.
+import numpy as np
+import pytest
+
+from make_reference_tables import slaser_experiment
+
+simclasses = pytest.importorskip('simclasses')
+
+METABOLITES = ['creatine_N(CH3).sys', 'aspartate.sys', 'glutamate.sys']
+
+@pytest.fixture
+def experiment(in_repository):
+	experiment = slaser_experiment('numpy')
+	experiment.propagator_cache_dir = ''
+	return experiment
+
+@pytest.mark.parametrize('insysfile', METABOLITES)
+def test_cached_equals_uncached(tmp_path, experiment, insysfile):
+	simulated = simclasses.simulate_metabolite(insysfile, experiment)
+
+	cache = simclasses.BasisSetCache(str(tmp_path))
+	key = cache.key(insysfile, experiment)
+	assert cache.get(key) is None
+	cache.put(key, simulated)
+	cached = simclasses.BasisSetCache(str(tmp_path)).get(key)
+
+	assert cached.name == simulated.name
+	assert (cached.A_m, cached.T2, cached.var) == (simulated.A_m, simulated.T2, simulated.var)
+	np.testing.assert_array_equal(cached.ppm, simulated.ppm)
+	np.testing.assert_array_equal(cached.area, simulated.area)
+	np.testing.assert_array_equal(cached.phase, simulated.phase)
+
+	t = np.arange(2048)*experiment.dwell_time
+	args = (experiment.TE, experiment.b0, t, 0.0, 1.0, 0.0, 0.0, 2.0)
+	np.testing.assert_array_equal(cached.getFID(*args), simulated.getFID(*args))
+
+def test_key_follows_the_code_version(monkeypatch, experiment):
+	cache = simclasses.BasisSetCache('')
+	key = cache.key(METABOLITES[1], experiment)
+	monkeypatch.setattr(simclasses, 'CACHE_VERSION', simclasses.CACHE_VERSION + 1)
+	assert cache.key(METABOLITES[1], experiment) != key
+
+def test_key_follows_the_experiment(experiment):
+	cache = simclasses.BasisSetCache('')
+	key = cache.key(METABOLITES[1], experiment)
+	assert cache.key(METABOLITES[1], experiment) == key
+	assert cache.key(METABOLITES[2], experiment) != key
+
+	experiment.TE = 30.0
+	assert cache.key(METABOLITES[1], experiment) != key
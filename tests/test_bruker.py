@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+magiqdataclasses = pytest.importorskip('magiqdataclasses')
+
+def write_scan(scan_dir, points, rows, digshift=68, raw_file='fid', raw_format='GO_32BIT_SGN_INT', word='<i4'):
+	scan_dir.mkdir()
+	(scan_dir / 'method').write_text('##TITLE=Parameter List\n##$PVM_DigShift=%d\n##$PVM_DigDw=0.166\n##$PVM_DigNp=%d\n##END=\n' % (digshift, points))
+	(scan_dir / 'acqp').write_text('##TITLE=Parameter List\n##$GO_raw_data_format=%s\n##$BYTORDA=little\n##$GO_block_size=continuous\n##END=\n' % raw_format)
+	values = (np.random.default_rng(0).normal(size=(rows, 2*points))*1E6).astype(word)
+	values.tofile(str(scan_dir / raw_file))
+	return values[:, 0::2] + 1j*values[:, 1::2].astype(float)
+
+def test_plain_fid_is_one_transient(tmp_path):
+	# a fid with several repetitions is read as one long FID, as before the acqp support
+	data = write_scan(tmp_path / 'scan', 1024, 4)
+	fid = magiqdataclasses.BrukerFID(str(tmp_path / 'scan'))
+
+	assert fid.n_transients == 1
+	assert fid.n == 4*1024 - 68
+	np.testing.assert_array_equal(fid.signal, np.ravel(data)[68:]*fid.ConvS)
+
+def test_split_transients_are_summed(tmp_path):
+	data = write_scan(tmp_path / 'scan', 1024, 4, raw_file='ser')
+	fid = magiqdataclasses.BrukerFID(str(tmp_path / 'scan'), raw_file='ser')
+
+	assert fid.n_transients == 4
+	assert fid.n == 1024 - 68
+	np.testing.assert_allclose(fid.signal, np.sum(data[:, 68:], axis=0)*fid.ConvS)
+	np.testing.assert_array_equal(fid.transients(), data[:, 68:]*fid.ConvS)
+	np.testing.assert_array_equal(fid.transients(2), data[2, 68:]*fid.ConvS)
+
+def test_unknown_raw_data_format(tmp_path):
+	write_scan(tmp_path / 'scan', 1024, 1, raw_format='GO_12BIT_SGN_INT')
+	with pytest.raises(ValueError, match='GO_12BIT_SGN_INT'):
+		magiqdataclasses.BrukerFID(str(tmp_path / 'scan'))
@@ -0,0 +1,46 @@
+# RF calibration: the dense sweep and its curve fits are the default in PINTS and in
+# pintsbatch.py. The adaptive search picks the plateau onset or the maximum on the grid
+# instead (for alanine at 7T it calibrates the semi-LASER AFPs at 23.8 mT where the fit
+# gives 12.2 mT), so it is only used when asked for.
+import numpy as np
+import pytest
+
+simclasses = pytest.importorskip('simclasses')
+pintsbatch = pytest.importorskip('pintsbatch')
+
+AMPLITUDES = np.linspace(0, 30, 301)
+
+def sine(amplitudes):
+	return 2.0*np.sin(np.pi*np.asarray(amplitudes)/16.0) + 0.1
+
+def plateau(amplitudes):
+	# rises, overshoots and settles, like the AFP sweep of a real calibration
+	amplitudes = np.asarray(amplitudes)
+	return simclasses.logs_func(amplitudes, -4.0, 1.5, 6.7, 5.0) + 1.5*np.exp(-((amplitudes - 8.0)/2.0)**2)
+
+def test_maximum_fit():
+	A_cal, params = simclasses.maximum_fit(AMPLITUDES, sine(AMPLITUDES))
+	assert A_cal == pytest.approx(8.0)
+
+def test_plateau_fit():
+	A_cal, guess, params = simclasses.plateau_fit(AMPLITUDES, plateau(AMPLITUDES))
+	assert params[2] == pytest.approx(6.7, rel=0.05)
+	# past the overshoot, where the signal comes back to the fitted plateau
+	assert 10.0 < A_cal < 14.0
+	assert A_cal == AMPLITUDES[np.argmin(np.abs(plateau(AMPLITUDES) - params[2]))]
+
+def test_batch_calibrates_with_the_dense_fit(monkeypatch):
+	def calibration_sweep(insysfile, metab_name, sim_experiment, flip, amplitudes, A_fixed=None, n_workers=None, timings=None):
+		return list(plateau(amplitudes) if flip == 180 else sine(amplitudes))
+	def adaptive_calibration(*args, **kwargs):
+		raise AssertionError('adaptive search used by default')
+	monkeypatch.setattr(pintsbatch, 'calibration_sweep', calibration_sweep)
+	monkeypatch.setattr(pintsbatch, 'adaptive_calibration', adaptive_calibration)
+
+	sim_experiment = pintsbatch.batch_experiment('slaser', 297.2, 60.0, pintsbatch.parse_args([]), {})
+	assert not pintsbatch.parse_args([]).adaptive_calibration
+	A_90, A_180 = pintsbatch.calibrate(sim_experiment, 'alanine', 1, lambda line: None)
+
+	A_plateau = simclasses.plateau_fit(sim_experiment.A_180s, plateau(sim_experiment.A_180s))[0]
+	assert A_180 == A_plateau + int(sim_experiment.A_180s[-1]/6)
+	assert A_90 == pytest.approx(8.0)
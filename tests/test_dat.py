@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pytest
+
+magiqdataclasses = pytest.importorskip('magiqdataclasses')
+
+def write_dat(filename, signal):
+	header = magiqdataclasses.DatHeader(2*np.size(signal), 1, 0.000166, 297.2, 64, 'test', '2020 01 01', 'MachS=0 ConvS=1.0 V1=0 V2=0 V3=0', 'TE=0.02 s TR=3 s P1=0 P2=0 P3=0 Gain=1')
+	magiqdataclasses.DatWriter(header, fmt=None).write(filename, signal)
+
+@pytest.mark.parametrize('sidecar', [False, True])
+def test_read_dat(tmp_path, sidecar):
+	signal = np.array([1, 1j]) @ np.random.default_rng(0).normal(size=(2, 1024))
+	write_dat(str(tmp_path / 'fid.dat'), signal)
+
+	for i in range(2):
+		header, loaded = magiqdataclasses.read_dat(str(tmp_path / 'fid.dat'), sidecar)
+		np.testing.assert_array_equal(loaded, signal)
+	assert os.path.exists(str(tmp_path / 'fid.dat.npy')) == sidecar
+
+@pytest.mark.parametrize('corruption', ['malformed', 'truncated'])
+def test_corrupt_dat_raises(tmp_path, corruption):
+	write_dat(str(tmp_path / 'fid.dat'), np.ones(1024, dtype=complex))
+	with open(str(tmp_path / 'fid.dat')) as f:
+		lines = f.readlines()
+	if corruption == 'malformed':
+		lines[500] = '0.5x\n'
+	else:
+		lines = lines[0:500]
+	with open(str(tmp_path / 'fid.dat'), 'w') as f:
+		f.writelines(lines)
+
+	with pytest.raises(ValueError):
+		magiqdataclasses.read_dat(str(tmp_path / 'fid.dat'), sidecar=True)
+	assert not os.path.exists(str(tmp_path / 'fid.dat.npy'))
@@ -0,0 +1,77 @@
+# Spatially resolved simulation (simclasses.simulate_positions / localized_metabolites)
+# with the NumPy backend.
+import concurrent.futures as cf
+import copy
+
+import numpy as np
+import pytest
+
+from make_reference_tables import slaser_experiment
+
+simclasses = pytest.importorskip('simclasses')
+densitymatrix = pytest.importorskip('densitymatrix')
+
+GRADIENTS = [5.0, 4.0, 3.0]	# mT/m
+
+@pytest.fixture
+def experiment(in_repository):
+	experiment = slaser_experiment('numpy')
+	experiment.propagator_cache_dir = ''
+	experiment.slice_gradients = list(GRADIENTS)
+	return experiment
+
+def fid(metab, experiment):
+	t = np.arange(2048)*experiment.dwell_time
+	return metab.getFID(experiment.TE, experiment.b0, t, 0.0, 1.0, 0.0, 0.0, 2.0)
+
+def assert_same_fid(metab, reference, experiment, tolerance):
+	reference_fid = fid(reference, experiment)
+	assert np.max(np.abs(fid(metab, experiment) - reference_fid)) < tolerance*np.max(np.abs(reference_fid))
+
+@pytest.mark.parametrize('insysfile', ['creatine_N(CH3).sys', 'aspartate.sys'])
+def test_one_point_grid_is_the_isochromat(experiment, insysfile):
+	isochromat = simclasses.simulate_metabolite(insysfile, experiment)
+
+	experiment.spatial_positions = [[0.0], [0.0], [0.0]]
+	localized = simclasses.simulate_metabolite(insysfile, experiment)
+
+	# combine_tables rounds the frequencies of the grid to 1E-6 rad/sec
+	np.testing.assert_allclose(localized.ppm, isochromat.ppm, rtol=0, atol=1E-9)
+	assert_same_fid(localized, isochromat, experiment, 1E-6)
+
+def test_pooled_equals_sequential(experiment):
+	insysfile = 'aspartate.sys'
+	experiment.spatial_positions = [[-10.0, 0.0, 10.0], [-8.0, 8.0], [-6.0, 6.0]]
+	points = simclasses.spatial_points(experiment)
+
+	sequential = simclasses.localized_metabolites(insysfile, experiment, [simclasses.simulate_positions(insysfile, experiment, [experiment.TE], points)], len(points))[0]
+
+	# as SimulationPool: the grid is split over the worker processes
+	chunks = simclasses.spatial_chunks(experiment, 3)
+	with cf.ProcessPoolExecutor(max_workers=3) as pool:
+		chunk_sums = list(pool.map(simclasses.simulate_positions, [insysfile]*len(chunks), [experiment]*len(chunks), [[experiment.TE]]*len(chunks), chunks))
+	pooled = simclasses.localized_metabolites(insysfile, experiment, chunk_sums, len(points))[0]
+
+	assert len(chunks) == 3
+	np.testing.assert_allclose(pooled.ppm, sequential.ppm, rtol=0, atol=1E-9)
+	assert_same_fid(pooled, sequential, experiment, 1E-9)
+
+@pytest.mark.parametrize('direction, position', [(0, 10.0), (1, -8.0), (2, 6.0)])
+def test_offset_shifts_a_singlet(experiment, direction, position):
+	point = [0.0, 0.0, 0.0]
+	point[direction] = position*1E-3
+	ppm = simclasses.offset_ppm(experiment, direction, point)
+
+	# G x / B0, with B0 = b0 / gamma(1H) = 297.2 MHz / 42.576 MHz/T
+	B0 = experiment.b0/42.576
+	assert ppm == pytest.approx(1E6*GRADIENTS[direction]*1E-3*point[direction]/B0, rel=1E-9)
+
+	# the singlet of the spin system read at RF_OFFSET - ppm resonates ppm higher
+	insysfile = simclasses.sysfile_path('creatine_N(CH3).sys', experiment.b0)
+	frequencies = []
+	for rf_off in (experiment.RF_OFFSET, experiment.RF_OFFSET - ppm):
+		spin_system = simclasses.read_spin_system(insysfile, rf_off, 'numpy')
+		Iz, Ip = densitymatrix.spin_operators(spin_system)
+		Fz = sum(Iz)
+		frequencies.append(np.real(np.trace(np.dot(densitymatrix.hamiltonian(spin_system), Fz))/np.trace(np.dot(Fz, Fz))))
+	assert frequencies[1] - frequencies[0] == pytest.approx(ppm*experiment.b0, rel=1E-9)
@@ -0,0 +1,68 @@
+# The 'single' precision policy against 'double': synthesized FIDs and spectra stay within
+# the relative error documented in precision.py (largest error / largest magnitude).
+import numpy as np
+import pytest
+
+magiqdataclasses = pytest.importorskip('magiqdataclasses')
+import precision
+import fftplans
+
+SYNTHESIS_TOLERANCE = 1E-6
+
+@pytest.fixture
+def restore_policy():
+	policy = precision.policy
+	yield
+	precision.set_policy(policy)
+
+def relative_error(x, reference):
+	return np.max(np.abs(x - reference))/np.max(np.abs(reference))
+
+def random_basis(rng):
+	metabolites = []
+	for k in range(12):
+		metab = magiqdataclasses.Metabolite()
+		metab.name = 'm' + str(k)
+		metab.A_m = 1.0
+		metab.T2 = 0.1*(k % 3)
+		for j in range(int(rng.integers(1, 40))):
+			metab.ppm.append(rng.uniform(0.5, 9.5))
+			metab.area.append(rng.uniform())
+			metab.phase.append(rng.uniform(-180, 180))
+			if k % 4 == 0:
+				metab.width_L.append(rng.uniform(0, 5))
+				metab.delay.append(rng.uniform(-1E-3, 1E-3))
+				metab.width_G.append(rng.uniform(0, 5))
+		metabolites.append(metab)
+	metabolites.append(magiqdataclasses.Macromolecule('G2', 1.3, 'G', 30.0, 0.5, -0.4))
+	metabolites.append(magiqdataclasses.Macromolecule('L2', 2.3, 'L', 20.0, 0.5, 0.4))
+	return metabolites
+
+def synthesize(metabolites, args):
+	basis = magiqdataclasses.BasisSet(metabolites)
+	names = [metab.name for metab in metabolites]
+	return basis.getFIDs(names, *args), magiqdataclasses.BasisModel(basis).getFIDs(names, *args), [metab.getFID(*args) for metab in metabolites]
+
+@pytest.mark.parametrize('n, dwell_time, b0', [(2048, 0.000166, 297.2), (4096, 0.0002, 123.3), (4096, 0.0001, 400.2)])
+def test_single_precision_synthesis(restore_policy, n, dwell_time, b0):
+	rng = np.random.default_rng(n + int(b0))
+	metabolites = random_basis(rng)
+	t = np.arange(n)*dwell_time
+	args = (60, b0, t, rng.uniform(-0.2, 0.2), rng.uniform(0.5, 2), rng.uniform(-1, 1), rng.uniform(0, 5E-4), rng.uniform(0, 5))
+
+	precision.set_policy('double')
+	double = synthesize(metabolites, args)
+	double_spectrum = fftplans.spectrum(double[0].sum(0))
+	precision.set_policy('single')
+	single = synthesize(metabolites, args)
+	single_spectrum = fftplans.spectrum(single[0].sum(0))
+
+	for fids, reference in zip(single[:2], double[:2]):
+		assert fids.dtype == np.complex64
+		for fid, reference_fid in zip(fids, reference):
+			assert relative_error(fid, reference_fid) < SYNTHESIS_TOLERANCE
+	for fid, reference_fid in zip(single[2], double[2]):
+		assert fid.dtype == np.complex64
+		assert relative_error(fid, reference_fid) < SYNTHESIS_TOLERANCE
+	assert single_spectrum.dtype == np.complex64
+	assert relative_error(single_spectrum, double_spectrum) < SYNTHESIS_TOLERANCE
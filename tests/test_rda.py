@@ -0,0 +1,51 @@
+# RDAFile transforms all FIDs of a file in one batched FFT (eager) or the rows that are
+# indexed (lazy). Both must match the per-row scipy.fftpack transform MAGIQ used before,
+# to SPECTRUM_TOLERANCE of the largest magnitude of every spectrum.
+import numpy as np
+import pytest
+
+magiqdataclasses = pytest.importorskip('magiqdataclasses')
+import precision
+import scipy.fftpack
+
+SPECTRUM_TOLERANCE = 1E-12
+
+@pytest.fixture
+def double_precision():
+	policy = precision.policy
+	precision.set_policy('double')
+	yield
+	precision.set_policy(policy)
+
+def write_rda(filename, data, grid):
+	header = {'MRFrequency': '123.25', 'StudyDate': '20200101', 'NumberOfAverages': '64', 'DwellTime': '500', 'VectorSize': str(data.shape[1]),
+		'CSIMatrixSize[0]': str(grid[0]), 'CSIMatrixSize[1]': str(grid[1]), 'CSIMatrixSize[2]': str(grid[2]), 'TE': '30', 'TR': '2000',
+		'PixelSpacingRow': '10', 'PixelSpacingCol': '10', 'PixelSpacing3D': '15', 'VOIPositionSag': '1.5', 'VOIPositionCor': '-2', 'VOIPositionTra': '3',
+		'RowVector[0]': '1', 'RowVector[1]': '0', 'RowVector[2]': '0', 'ColumnVector[0]': '0', 'ColumnVector[1]': '1', 'ColumnVector[2]': '0',
+		'PatientName': 'X', 'InstitutionName': 'Y'}
+	with open(filename, 'wb') as f:
+		f.write(b'>>> Begin of header <<<\r\n' + ''.join('%s: %s\r\n' % item for item in header.items()).encode() + b'>>> End of header <<<\r\n')
+		f.write(np.asarray(data, dtype='<c16').tobytes())
+
+def random_fids(rng, n_vectors, vect_size):
+	# FIDs of very different magnitudes, so every vector gets its own scale factor
+	magnitude = 10.0**rng.uniform(-9, 9, (n_vectors, 1))*rng.uniform(0.5, 2, (n_vectors, vect_size))
+	return magnitude*np.exp(1j*rng.uniform(0, 2*np.pi, (n_vectors, vect_size)))
+
+def baseline_spectrum(fid):
+	return scipy.fftpack.fftshift(scipy.fftpack.fft(fid))
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('scale_fid', [True, False])
+@pytest.mark.parametrize('vect_size, grid', [(1024, (1, 1, 1)), (512, (8, 8, 1)), (48, (3, 1, 1))])
+def test_spectra_match_per_row_fft(tmp_path, double_precision, vect_size, grid, scale_fid, lazy):
+	rng = np.random.default_rng(vect_size)
+	data = random_fids(rng, int(np.prod(grid)), vect_size)
+	write_rda(str(tmp_path / 'csi.rda'), data, grid)
+	rda = magiqdataclasses.RDAFile(str(tmp_path / 'csi.rda'), scale_fid=scale_fid, lazy=lazy)
+
+	for i in range(data.shape[0]):
+		fid = rda.fid[i]
+		np.testing.assert_allclose(fid, data[i]*rda.ConvS[i], rtol=1E-15)
+		reference = baseline_spectrum(fid)
+		assert np.max(np.abs(rda.spec[i] - reference)) <= SPECTRUM_TOLERANCE*np.max(np.abs(reference))
@@ -0,0 +1,23 @@
+# densitymatrix.reduce_spin_system against the full Hilbert space: the detected signal of the
+# transition table simulate_metabolite bins must be the same.
+import numpy as np
+import pytest
+
+from make_reference_tables import slaser_experiment, simulate_table
+
+densitymatrix = pytest.importorskip('densitymatrix')
+
+@pytest.mark.parametrize('insysfile', ['choline_N(CH3)3_a.sys', 'myoinositol.sys', 'naa_acetyl.sys', 'glutamate.sys', 'scyllo-inositol.sys'])
+def test_reduced_equals_full_space(in_repository, insysfile):
+	experiment = slaser_experiment('numpy')
+	experiment.propagator_cache_dir = ''
+	t = np.arange(2048)*experiment.dwell_time
+
+	experiment.reduce_spin_systems = False
+	spin_system, full = simulate_table(insysfile, experiment)
+	experiment.reduce_spin_systems = True
+	reduced_spin_system, reduced = simulate_table(insysfile, experiment)
+
+	assert isinstance(reduced_spin_system, densitymatrix.ReducedSpinSystem)
+	full_fid = full.fid(t)
+	assert np.max(np.abs(reduced.fid(t) - full_fid)) < 1E-10*np.max(np.abs(full_fid))
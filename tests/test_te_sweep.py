@@ -0,0 +1,34 @@
+# simulate_metabolite_tes (one eigendecomposition of the Hamiltonian, free evolution
+# propagators per echo time) against simulate_metabolite run once per echo time.
+import copy
+
+import numpy as np
+import pytest
+
+from make_reference_tables import slaser_experiment
+
+simclasses = pytest.importorskip('simclasses')
+
+TES = [30.0, 60.0, 144.0]
+
+def fid(metab, TE, t):
+	return metab.getFID(TE, 297.2, t, 0.0, 1.0, 0.0, 0.0, 2.0)
+
+@pytest.mark.parametrize('insysfile', ['lactate.sys', 'glutamate.sys'])
+def test_te_sweep_equals_single_runs(in_repository, insysfile):
+	experiment = slaser_experiment('numpy')
+	experiment.propagator_cache_dir = ''
+	t = np.arange(2048)*experiment.dwell_time
+
+	swept = simclasses.simulate_metabolite_tes(insysfile, experiment, TES)
+	assert len(swept) == len(TES)
+	for TE, metab in zip(TES, swept):
+		single_experiment = copy.copy(experiment)
+		single_experiment.TE = TE
+		single = simclasses.simulate_metabolite(insysfile, single_experiment)
+
+		assert len(metab.ppm) == len(single.ppm)
+		np.testing.assert_allclose(metab.ppm, single.ppm, rtol=0, atol=1E-9)
+		np.testing.assert_allclose(metab.area, single.area, rtol=1E-9, atol=1E-12)
+		reference = fid(single, TE, t)
+		assert np.max(np.abs(fid(metab, TE, t) - reference)) < 1E-9*np.max(np.abs(reference))
@@ -0,0 +1,114 @@
+import sys
+import json
+import time
+import importlib.util
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# resource (peak memory) is only available on Unix
+resource_spec = importlib.util.find_spec("resource")
+if resource_spec != None:
+	import resource
+
+# ---- Stage Timer ---- #
+class StageTimer(object):
+	# Wall-clock time per named stage of a simulation. Stages can be nested; time is
+	# always booked to the innermost stage, so the stage times add up to the total.
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.seconds = OrderedDict()
+		self.calls = OrderedDict()
+		self.stack = []
+
+	@contextmanager
+	def stage(self, name):
+		now = time.time()
+		if self.stack:
+			self.__book__(self.stack[-1][0], now - self.stack[-1][1])
+		self.stack.append([name, now])
+		self.calls[name] = self.calls.get(name, 0) + 1
+		try:
+			yield
+		finally:
+			now = time.time()
+			self.__book__(name, now - self.stack.pop()[1])
+			if self.stack:
+				self.stack[-1][1] = now
+
+	def report(self, total=None):
+		stages = OrderedDict((name, {'seconds': self.seconds[name], 'calls': self.calls.get(name, 0)}) for name in self.seconds)
+		report = {'total_seconds': sum(self.seconds.values()), 'stages': stages, 'peak_rss_mb': peak_rss_mb()}
+		# time of the job outside any stage
+		if total is not None and total > report['total_seconds']:
+			add(report, 'other', total - report['total_seconds'], 0)
+		return report
+
+	def __book__(self, name, seconds):
+		self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+# one timer per process
+timer = StageTimer()
+
+def stage(name):
+	return timer.stage(name)
+
+def peak_rss_mb():
+	# peak resident memory of this process so far (None where resource is missing)
+	if resource_spec == None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / 1024.0**2 if sys.platform == 'darwin' else rss / 1024.0	# bytes on macOS, kB on Linux
+
+def timed(function, *args):
+	# Runs function (usually in a worker process) with a fresh timer.
+	# Returns (result, timing report).
+	timer.reset()
+	start = time.time()
+	result = function(*args)
+	return result, timer.report(time.time() - start)
+
+def add(report, name, seconds, calls=1):
+	# books time spent outside the timed function (e.g. in the main process) to a report
+	entry = report['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0})
+	entry['seconds'] += seconds
+	entry['calls'] += calls
+	report['total_seconds'] += seconds
+
+def merge(reports):
+	# adds up reports of the same job run in pieces (e.g. chunks of a spatial grid)
+	merged = {'total_seconds': 0.0, 'stages': OrderedDict(), 'peak_rss_mb': None}
+	for report in reports:
+		merged['total_seconds'] += report['total_seconds']
+		for (name, entry) in report['stages'].items():
+			if name not in merged['stages']:
+				merged['stages'][name] = {'seconds': 0.0, 'calls': 0}
+			merged['stages'][name]['seconds'] += entry['seconds']
+			merged['stages'][name]['calls'] += entry['calls']
+		if report['peak_rss_mb'] is not None:
+			merged['peak_rss_mb'] = max(merged['peak_rss_mb'] or 0.0, report['peak_rss_mb'])
+	return merged
+
+# ---- Output ---- #
+def write(filename, timings):
+	with open(filename, 'w') as f:
+		json.dump(timings, f, indent=1)
+
+def summary(reports):
+	# console lines for a dict of reports (name -> report): one line per job and the
+	# share of every stage in the summed time
+	lines = []
+	for (name, report) in reports.items():
+		line = '   | ' + name + ': ' + '{0:.2f}'.format(report['total_seconds']) + ' s'
+		if report['peak_rss_mb'] is not None:
+			line += ', peak ' + '{0:.0f}'.format(report['peak_rss_mb']) + ' MB'
+		lines.append(line)
+
+	total = merge(list(reports.values()))
+	lines.append('   | total: ' + '{0:.2f}'.format(total['total_seconds']) + ' s')
+	for (name, entry) in sorted(total['stages'].items(), key=lambda item: -item[1]['seconds']):
+		share = 100.0*entry['seconds']/total['total_seconds'] if total['total_seconds'] > 0 else 0.0
+		lines.append('       | ' + name + ': ' + '{0:.2f}'.format(entry['seconds']) + ' s (' + '{0:.1f}'.format(share) + '%, ' + str(entry['calls']) + ' calls)')
+	return lines